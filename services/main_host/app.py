@@ -1,79 +1,376 @@
-from flask import Flask, request, jsonify
-from prometheus_client import Gauge, generate_latest, CONTENT_TYPE_LATEST
+from flask import Flask, Response, request, jsonify
+from prometheus_client import Counter, generate_latest, REGISTRY, CollectorRegistry, multiprocess
+from prometheus_client.openmetrics import exposition as openmetrics
+import atexit
 import logging
 import json
-from collections import defaultdict
+import math
+import os
+import threading
+import time
+
+from patient_store import parse_timestamp, format_timestamp
+from exposition import VitalsExposition
+from shared_store import SharedPatientStore
+from storage import create_patient_store, create_tsdb, wal_dir
+from tsdb import CHUNK_SECONDS, AGGREGATIONS
+from wal import WriteAheadLog, Checkpointer, recover, DEFAULT_FSYNC_SECONDS, DEFAULT_SNAPSHOT_SECONDS
+from scoring import create_scorer
+from structured_logging import setup_logging, PatientTraceSampler, dropped_records
 
 app = Flask(__name__)
-logging.basicConfig(level=logging.INFO)
+setup_logging('main_host')
+logger = logging.getLogger('main_host')
+
+# Per-reading debug output: every reading for traced patients, sampled for the rest
+trace_sampler = PatientTraceSampler(logger)
 
-# Define Gauges (current value metrics)
+# Exported vitals: reading field -> (metric name, help text). /metrics renders one
+# gauge per vital and patient straight from the patient store (see exposition.py),
+# so every worker reports the same values without per-worker gauge files
 metrics = {
-    'heart_rate': Gauge('heart_rate_bpm', 'Heart Rate (BPM)', ['hospital', 'department', 'ward', 'patient']),
-    'bp_systolic': Gauge('bp_systolic', 'BP Systolic', ['hospital', 'department', 'ward', 'patient']),
-    'bp_diastolic': Gauge('bp_diastolic', 'BP Diastolic', ['hospital', 'department', 'ward', 'patient']),
-    'respiratory_rate': Gauge('respiratory_rate', 'Respiratory Rate', ['hospital', 'department', 'ward', 'patient']),
-    'spo2': Gauge('spo2_percent', 'SpO2 (%)', ['hospital', 'department', 'ward', 'patient']),
-    'etco2': Gauge('etco2', 'EtCO2', ['hospital', 'department', 'ward', 'patient']),
-    'fio2': Gauge('fio2_percent', 'FiO2 (%)', ['hospital', 'department', 'ward', 'patient']),
-    'temperature': Gauge('temperature_celsius', 'Temperature (°C)', ['hospital', 'department', 'ward', 'patient']),
-    'wbc_count': Gauge('wbc_count', 'WBC Count', ['hospital', 'department', 'ward', 'patient']),
-    'lactate': Gauge('lactate', 'Lactate (mmol/L)', ['hospital', 'department', 'ward', 'patient']),
-    'blood_glucose': Gauge('blood_glucose', 'Blood Glucose (mg/dL)', ['hospital', 'department', 'ward', 'patient']),
+    'heart_rate': ('heart_rate_bpm', 'Heart Rate (BPM)'),
+    'bp_systolic': ('bp_systolic', 'BP Systolic'),
+    'bp_diastolic': ('bp_diastolic', 'BP Diastolic'),
+    'respiratory_rate': ('respiratory_rate', 'Respiratory Rate'),
+    'spo2': ('spo2_percent', 'SpO2 (%)'),
+    'etco2': ('etco2', 'EtCO2'),
+    'fio2': ('fio2_percent', 'FiO2 (%)'),
+    'temperature': ('temperature_celsius', 'Temperature (°C)'),
+    'wbc_count': ('wbc_count', 'WBC Count'),
+    'lactate': ('lactate', 'Lactate (mmol/L)'),
+    'blood_glucose': ('blood_glucose', 'Blood Glucose (mg/dL)'),
     # ECG skipped for now
-    'anomaly_score': Gauge('anomaly_score', 'Anomaly Score', ['hospital', 'department', 'ward', 'patient']),  # New anomaly score metric
+    'anomaly_score': ('anomaly_score', 'Anomaly Score'),  # New anomaly score metric
 }
 
-# In-memory data store for the dashboard
-patient_data_store = defaultdict(list)
+series_rendered = Counter('exposition_series_rendered', 'Patients whose /metrics lines were re-rendered')
+evicted_series = Counter('evicted_series', 'Patient label sets removed after SERIES_TTL_SECONDS without a reading')
+scored_readings = Counter('ingest_scored_readings', 'Readings given an anomaly_score by main_host on ingest')
+scoring_failures = Counter('ingest_scoring_failures', 'Ingest requests whose readings could not be scored')
+
+# Patients with no reading for this long are dropped from the store and /metrics (0 keeps them forever)
+DEFAULT_SERIES_TTL_SECONDS = 3600
+
+
+# In-memory data store for the dashboard: a fixed-depth ring buffer per patient
+patient_data_store = create_patient_store()
+logger.info("Patient store ready", extra={'fields': {
+    'shared': isinstance(patient_data_store, SharedPatientStore),
+    'history_depth': patient_data_store.depth,
+    'bytes_per_patient': patient_data_store.bytes_per_patient,
+}})
+
+
+# Long-term history: every reading, kept for TSDB_RETENTION_DAYS
+history_db = create_tsdb()
+
+
+def start_tsdb_flusher():
+    """Background thread that writes finished chunks to disk and applies retention"""
+    if history_db is None:
+        return None
+
+    def flush_forever():
+        last_retention = 0.0
+        while True:
+            time.sleep(CHUNK_SECONDS / 4)
+            try:
+                history_db.flush(time.time())
+                if time.time() - last_retention >= 3600:
+                    removed = history_db.apply_retention()
+                    if removed:
+                        logger.info("Deleted expired history", extra={'fields': {'days': removed}})
+                    last_retention = time.time()
+            except Exception:
+                logger.exception("History flush failed")
+
+    thread = threading.Thread(target=flush_forever, name='tsdb-flusher', daemon=True)
+    thread.start()
+    # Chunks of the current window are written out on a clean shutdown too
+    atexit.register(history_db.flush)
+    logger.info("History store ready", extra={'fields': {
+        'root': history_db.root, 'retention_days': history_db.retention_days,
+    }})
+    return thread
+
+
+tsdb_flusher = start_tsdb_flusher()
+
+
+def start_wal():
+    """Recover the store from WAL_DIR, then log every reading there and snapshot periodically
+
+    Under gunicorn the master has already recovered the shared store before
+    forking (see gunicorn.conf.py), so workers only start logging.
+    """
+    directory = wal_dir()
+    if not directory:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    snapshot_seconds = float(os.environ.get('WAL_SNAPSHOT_SECONDS', DEFAULT_SNAPSHOT_SECONDS))
+    if not os.environ.get('MAIN_HOST_RECOVERED'):
+        stats = recover(patient_data_store, directory, history_db)
+        logger.info("Recovered patient store", extra={'fields': stats})
+    log = WriteAheadLog(directory, fsync_seconds=float(os.environ.get('WAL_FSYNC_SECONDS', DEFAULT_FSYNC_SECONDS)),
+                        segment_seconds=snapshot_seconds)
+    log.start()
+    atexit.register(log.close)
+    Checkpointer(patient_data_store, directory, interval=snapshot_seconds).start()
+    return log
+
+
+# Write-ahead log of every stored reading, replayed at startup
+wal = start_wal()
+
+
+# Anomaly scoring on ingest (INGEST_SCORING=off|remote|local, see scoring.py)
+scorer = create_scorer()
+if scorer is not None:
+    logger.info("Scoring readings on ingest", extra={'fields': {'mode': scorer.mode}})
+
+
+def score_readings(readings):
+    """Attach anomaly_score to readings with one scorer call; they keep the sender's score if it fails"""
+    if scorer is None or not readings:
+        return
+    try:
+        scores = scorer.score(readings)
+    except Exception as e:
+        scoring_failures.inc()
+        logger.warning("Ingest scoring failed", extra={'fields': {
+            'mode': scorer.mode, 'readings': len(readings), 'error': str(e),
+        }})
+        return
+    for data, score in zip(readings, scores):
+        data['anomaly_score'] = score
+    scored_readings.inc(len(readings))
+
+
+def registry_metrics(use_openmetrics):
+    """Everything in the prometheus_client registry, merged across gunicorn workers when needed"""
+    registry = REGISTRY
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    if use_openmetrics:
+        return openmetrics.generate_latest(registry)
+    return generate_latest(registry)
+
+
+exposition = VitalsExposition(patient_data_store, metrics, registry_metrics, series_rendered)
+
+
+def sweep_idle_patients(ttl_seconds):
+    """Evict patients (and so their exported series) with no reading in the last ttl_seconds"""
+    removed = patient_data_store.evict_idle(ttl_seconds)
+    if removed:
+        evicted_series.inc(len(removed))
+        logger.info("Evicted idle patients", extra={'fields': {
+            'count': len(removed), 'ttl_seconds': ttl_seconds, 'patients': removed[:20],
+        }})
+    return removed
+
+
+def start_eviction_sweeper():
+    """Background thread that sweeps idle patients every SERIES_SWEEP_SECONDS"""
+    ttl_seconds = float(os.environ.get('SERIES_TTL_SECONDS', DEFAULT_SERIES_TTL_SECONDS))
+    if ttl_seconds <= 0:
+        return None
+    interval = float(os.environ.get('SERIES_SWEEP_SECONDS', min(60.0, ttl_seconds / 4)))
+
+    def sweep_forever():
+        while True:
+            time.sleep(interval)
+            try:
+                sweep_idle_patients(ttl_seconds)
+            except Exception:
+                logger.exception("Idle patient sweep failed")
+
+    thread = threading.Thread(target=sweep_forever, name='series-sweeper', daemon=True)
+    thread.start()
+    logger.info("Idle patient sweeper started", extra={'fields': {
+        'ttl_seconds': ttl_seconds, 'interval_seconds': interval,
+    }})
+    return thread
+
+
+eviction_sweeper = start_eviction_sweeper()
 
 @app.route('/track', methods=['POST'])
 def track_traffic():
-    data = request.get_json()
-    print("💡 Received Payload:", data)  # 👈 Add this
-    
+    data = request.get_json(silent=True)
+    error = validate_reading(data)
+    if error:
+        return jsonify({'status': 'error', 'message': error}), 400
+    score_readings([data])
+    ingest_reading(data)
+
+    return jsonify({'status': 'success'}), 200
+
+
+def store_reading(patient_key, data):
+    """Append a reading to the in-memory dashboard store and the on-disk history"""
+    # The ring buffer overwrites the oldest slot, so memory per patient stays fixed
+    seq = patient_data_store.append(patient_key, data)
+    if wal is not None:
+        wal.append(seq, patient_key, data)
+    if history_db is not None:
+        history_db.append(patient_key, parse_timestamp(data.get('timestamp')), data)
+
+
+def validate_reading(data):
+    """Return an error message for a malformed reading, or None if it is usable
+
+    Vitals sent as numeric strings ("72") are accepted, as they always were,
+    and converted to numbers in place.
+    """
+    if not isinstance(data, dict):
+        return "reading must be a JSON object"
+    for key in metrics:
+        value = data.get(key)
+        if value is None or isinstance(value, (int, float)) and not isinstance(value, bool):
+            continue
+        if not isinstance(value, str):
+            return f"{key} must be a number"
+        try:
+            data[key] = float(value)
+        except ValueError:
+            return f"{key} must be a number"
+    return None
+
+
+def ingest_reading(data):
+    """Record one validated reading; /metrics picks it up from the store on the next scrape"""
+    # Stamped once here, so the store, the WAL and the history all keep the same
+    # time; otherwise WAL recovery would date the reading to the restart
+    if math.isnan(parse_timestamp(data.get('timestamp'), default=float('nan'))):
+        data['timestamp'] = format_timestamp(time.time())
     hospital = data.get('hospital', 'unknown')
     dept = data.get('dept', 'unknown')
     ward = data.get('ward', 'unknown')
     patient = data.get('patient', 'unknown')
 
-    labels = dict(hospital=hospital, department=dept, ward=ward, patient=patient)
+    if trace_sampler.should_trace(patient):
+        trace_sampler.trace(
+            "Received reading", patient,
+            hospital=hospital, dept=dept, ward=ward, payload=data,
+            missing=[key for key in metrics if data.get(key) is None],
+        )
+
+    store_reading(f"{hospital}|{dept}|{ward}|{patient}", data)
+
+
+def parse_batch_body():
+    """Read a batch body as either a JSON array or NDJSON (one reading per line)"""
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        readings = []
+        for line in request.get_data(as_text=True).splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                readings.append(json.loads(line))
+            except ValueError as e:
+                readings.append(ValueError(f"invalid JSON line: {e}"))
+        return readings
+
+    body = request.get_json(silent=True)
+    if isinstance(body, dict):
+        body = body.get('readings')
+    if not isinstance(body, list):
+        raise ValueError("expected a JSON array of readings, {\"readings\": [...]} or NDJSON")
+    return body
+
+
+@app.route('/track/batch', methods=['POST'])
+def track_batch():
+    """Ingest many readings in one request and report a status per item"""
+    try:
+        readings = parse_batch_body()
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
 
-    for key, gauge in metrics.items():
-        if key in data:
-            print(f"📌 Setting {key} = {data[key]} for labels {labels}")  # 👈 Add this
-            gauge.labels(**labels).set(data[key])
+    results = []
+    valid = []
+    for index, data in enumerate(readings):
+        error = str(data) if isinstance(data, ValueError) else validate_reading(data)
+        if error:
+            results.append({'index': index, 'status': 'error', 'message': error})
         else:
-            print(f"⚠️ {key} missing in payload")
-    
-    # Store the data for the dashboard
-    patient_key = f"{hospital}|{dept}|{ward}|{patient}"
-    patient_data_store[patient_key].append(data)
-    
-    # Keep only the latest 100 data points per patient to prevent memory bloat
-    if len(patient_data_store[patient_key]) > 100:
-        patient_data_store[patient_key] = patient_data_store[patient_key][-100:]
+            valid.append(data)
+            results.append({'index': index, 'status': 'success'})
 
-    return jsonify({'status': 'success'}), 200
+    # The whole batch is scored in one go before any of it reaches the store
+    score_readings(valid)
+    for data in valid:
+        ingest_reading(data)
+    accepted = len(valid)
+
+    if accepted == len(readings):
+        status = 'success'
+    elif accepted == 0:
+        status = 'error'
+    else:
+        status = 'partial'
+
+    return jsonify({
+        'status': status,
+        'accepted': accepted,
+        'rejected': len(readings) - accepted,
+        'results': results
+    }), 200
+
+
+@app.route('/debug/trace', methods=['GET', 'POST'])
+def trace_patients():
+    """Show or replace the patients whose every reading is logged ({"patients": ["3"]}, "*" for all)
+
+    The list belongs to the worker that serves the request; under gunicorn the
+    others keep theirs, so "worker" tells which one answered. TRACE_PATIENTS
+    sets a list for every worker.
+    """
+    if request.method == 'POST':
+        body = request.get_json(silent=True) or {}
+        patients = body.get('patients', [])
+        if not isinstance(patients, list):
+            return jsonify({'status': 'error', 'message': 'patients must be a list'}), 400
+        trace_sampler.set_traced(patients)
+        logger.info("Trace list updated", extra={'fields': {'traced': sorted(trace_sampler.traced)}})
+    return jsonify({
+        'status': 'success',
+        'traced': sorted(trace_sampler.traced),
+        'sample_seconds': trace_sampler.sample_seconds,
+        'dropped_log_records': dropped_records(),
+        'worker': os.getpid(),
+    })
 
 
 @app.route('/metrics')
 def metrics_endpoint():
-    return generate_latest(), 200, {'Content-Type': CONTENT_TYPE_LATEST}
+    """Prometheus text by default, OpenMetrics when asked for, gzipped when accepted"""
+    use_openmetrics = 'application/openmetrics-text' in request.headers.get('Accept', '')
+    gzipped = 'gzip' in request.headers.get('Accept-Encoding', '')
+    body, content_type = exposition.render(use_openmetrics, gzipped)
+    headers = {'Content-Type': content_type}
+    if gzipped:
+        headers['Content-Encoding'] = 'gzip'
+    return body, 200, headers
 
 @app.route('/')
 def root():
     return "Hospital Monitoring Service is Running. Use /track (POST JSON) or /metrics."
 
+def label_filters():
+    """Optional ?hospital=&dept=&ward= query filters"""
+    return {field: request.args.get(field) for field in ('hospital', 'dept', 'ward')}
+
+
 @app.route('/api/patients', methods=['GET'])
 def get_patients():
-    """Get list of all patients"""
+    """Get list of all patients, optionally filtered by hospital, dept and ward"""
     try:
-        patients = []
-        for key in patient_data_store.keys():
-            hospital, dept, ward, patient = key.split('|')
-            if patient not in patients:
-                patients.append(patient)
+        patients = patient_data_store.find_patients(**label_filters())
         
         return jsonify({
             "status": "success",
@@ -88,14 +385,11 @@ def get_patient_data(patient_id):
     try:
         result = {}
         
-        for key, data_list in patient_data_store.items():
-            hospital, dept, ward, patient = key.split('|')
-            
-            if patient == patient_id:
-                for idx, data_point in enumerate(data_list):
-                    # Create a unique key for each data point
-                    point_key = f"{key}|{idx}"
-                    result[point_key] = data_point
+        for key in patient_data_store.find_keys(patient=patient_id):
+            for idx, data_point in enumerate(patient_data_store.history(key)):
+                # Create a unique key for each data point
+                point_key = f"{key}|{idx}"
+                result[point_key] = data_point
         
         return jsonify({
             "status": "success",
@@ -104,21 +398,216 @@ def get_patient_data(patient_id):
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+# Longest range a history query may cover, and the bucket count it aims for without ?step=
+MAX_HISTORY_DAYS = 31
+HISTORY_TARGET_POINTS = 1440
+
+
+def parse_time_arg(name, default):
+    """Epoch seconds from an epoch number or ISO-8601 query parameter"""
+    value = request.args.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        parsed = parse_timestamp(value, default=float('nan'))
+    if parsed != parsed:
+        raise ValueError(f"{name} must be epoch seconds or an ISO-8601 timestamp")
+    return parsed
+
+
+def default_step(seconds):
+    """Raw readings for short ranges, otherwise whole chunks per bucket so no chunk is decoded"""
+    if seconds <= HISTORY_TARGET_POINTS:
+        return 0
+    chunks = -(-seconds // (HISTORY_TARGET_POINTS * CHUNK_SECONDS))
+    return chunks * CHUNK_SECONDS
+
+
+@app.route('/api/patient/<patient_id>/history', methods=['GET'])
+def get_patient_history(patient_id):
+    """Stored readings for a patient between ?from= and ?to=, downsampled to ?step= seconds
+
+    Defaults to the last hour. Without step, ranges longer than
+    HISTORY_TARGET_POINTS seconds are averaged into whole-chunk buckets.
+    ?agg=min|max picks another per-bucket aggregate than the mean.
+    """
+    if history_db is None:
+        return jsonify({"status": "error", "message": "history store is disabled (TSDB_DIR is empty)"}), 404
+    try:
+        end = parse_time_arg('to', time.time())
+        start = parse_time_arg('from', end - 3600)
+        if start > end:
+            raise ValueError("from must not be after to")
+        if end - start > MAX_HISTORY_DAYS * 86400:
+            raise ValueError(f"range must not exceed {MAX_HISTORY_DAYS} days")
+        step = request.args.get('step', type=float)
+        if step is None:
+            step = default_step(end - start)
+        if step < 0:
+            raise ValueError("step must not be negative")
+        agg = request.args.get('agg', 'mean')
+        if agg not in AGGREGATIONS:
+            raise ValueError(f"agg must be one of {', '.join(AGGREGATIONS)}")
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    try:
+        # Keys come from the history itself, so patients evicted from memory or seen before a restart are found
+        filters = dict(label_filters(), patient=patient_id)
+        keys = [key for key in history_db.keys(start, end) if matches_filters(key, filters)]
+        data = {key: history_db.query(key, start, end, step, agg) for key in keys}
+        return jsonify({
+            "status": "success",
+            "from": format_timestamp(start),
+            "to": format_timestamp(end),
+            "step": step,
+            "agg": agg,
+            "data": data,
+        })
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
 @app.route('/api/dashboard-data', methods=['GET'])
 def get_dashboard_data():
-    """Get all data for the dashboard"""
+    """Latest reading per patient, optionally filtered by hospital, dept and ward
+
+    With ?since=<seq> only patients updated after that cursor are returned,
+    plus the keys removed since then. The response carries the current seq to
+    pass next time, and an ETag; If-None-Match with that ETag gets a 304 while
+    nothing has changed.
+    """
     try:
-        # Convert defaultdict to regular dict for JSON serialization
-        result = {}
-        for key, data_list in patient_data_store.items():
-            result[key] = data_list[-1]  # Get the latest data point for each patient
-        
-        return jsonify({
+        seq = patient_data_store.current_seq()
+        if request.if_none_match.contains(str(seq)):
+            response = Response(status=304)
+            response.set_etag(str(seq))
+            return response
+
+        filters = label_filters()
+        since = request.args.get('since', type=int)
+        removed = None
+        if since is not None:
+            seq, keys, removed = patient_data_store.changes_since(since)
+            if removed is not None and any(filters.values()):
+                wanted = set(patient_data_store.find_keys(**filters))
+                keys = [key for key in keys if key in wanted]
+                removed = [key for key in removed if matches_filters(key, filters)]
+        if removed is None:
+            # First request, a cursor older than the removals still remembered,
+            # or one from before a restart that is ahead of the store
+            keys = patient_data_store.find_keys(**filters)
+
+        response = jsonify({
             "status": "success",
-            "data": result
+            "seq": seq,
+            "full": removed is None,
+            "data": latest_readings(keys),
+            "removed": removed or [],
         })
+        response.set_etag(str(seq))
+        return response
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+
+def matches_filters(key, filters):
+    """Whether a 'hospital|dept|ward|patient' key matches ?hospital=&dept=&ward= filters"""
+    labels = dict(zip(('hospital', 'dept', 'ward', 'patient'), key.split('|')))
+    return all(value is None or labels.get(field) == str(value) for field, value in filters.items())
+
+
+def latest_readings(keys):
+    """Latest reading per key, skipping keys removed in the meantime"""
+    result = {}
+    for key in keys:
+        latest = patient_data_store.latest(key)
+        if latest is not None:
+            result[key] = latest
+    return result
+
+
+# How often each /stream connection checks the store for new readings
+STREAM_POLL_SECONDS = float(os.environ.get('STREAM_POLL_SECONDS', 0.5))
+# Comment line sent on idle streams so proxies keep the connection open
+STREAM_KEEPALIVE_SECONDS = 15
+# Open /stream connections per process. Each one holds a server thread for as long as it is
+# open, so under gunicorn this must stay below MAIN_HOST_THREADS or /track stops being served.
+# The web dashboard relays one connection to all browsers, so it needs only one.
+STREAM_MAX_CLIENTS = int(os.environ.get(
+    'STREAM_MAX_CLIENTS', max(1, int(os.environ.get('MAIN_HOST_THREADS', 4)) // 2)))
+stream_clients = 0
+stream_clients_lock = threading.Lock()
+
+
+def release_stream_client():
+    global stream_clients
+    with stream_clients_lock:
+        stream_clients -= 1
+
+
+def sse_event(event, seq, payload):
+    return f"id: {seq}\nevent: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+@app.route('/stream')
+def stream_readings():
+    """Server-sent events: a snapshot of every patient's latest reading, then only what changed
+
+    Events carry the store sequence number as their id, so a client that
+    reconnects with Last-Event-ID (or ?since=) resumes without a new snapshot.
+    Past STREAM_MAX_CLIENTS open streams in this process the answer is 503.
+    """
+    global stream_clients
+    with stream_clients_lock:
+        full = stream_clients >= STREAM_MAX_CLIENTS
+        if not full:
+            stream_clients += 1
+    if full:
+        response = jsonify({'status': 'error', 'message': f'Too many open streams (limit {STREAM_MAX_CLIENTS})'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+
+    cursor = request.args.get('since', type=int)
+    if cursor is None:
+        cursor = request.headers.get('Last-Event-ID', type=int)
+
+    def snapshot():
+        seq = patient_data_store.current_seq()
+        return seq, sse_event('snapshot', seq, {'seq': seq, 'data': latest_readings(patient_data_store.keys())})
+
+    def events():
+        position = cursor
+        if position is None:
+            position, event = snapshot()
+            yield event
+        last_sent = time.monotonic()
+        while True:
+            seq, changed, removed = patient_data_store.changes_since(position)
+            if removed is None:
+                # Removals since the cursor were forgotten; start the client over
+                position, event = snapshot()
+                yield event
+                last_sent = time.monotonic()
+            elif changed or removed:
+                yield sse_event('update', seq, {'seq': seq, 'data': latest_readings(changed), 'removed': removed})
+                position = seq
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= STREAM_KEEPALIVE_SECONDS:
+                yield ": keepalive\n\n"
+                last_sent = time.monotonic()
+            time.sleep(STREAM_POLL_SECONDS)
+
+    response = Response(events(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+    # Runs when the server closes the response, including a client that disconnects before the first event
+    response.call_on_close(release_stream_client)
+    return response
+
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8000)
\ No newline at end of file
+    # Development server; production runs `gunicorn -c gunicorn.conf.py app:app` (see start.sh)
+    app.run(host='0.0.0.0', port=int(os.environ.get('MAIN_HOST_PORT', 8000)))
\ No newline at end of file
@@ -0,0 +1,244 @@
+"""
+Flattened, NumPy-only scorer for a trained sklearn IsolationForest.
+
+The export step packs every tree of the forest into shared node arrays
+(feature index, threshold, children and the path length contributed by each
+leaf), so scoring a batch is a handful of vectorized array lookups per tree
+level instead of Python-level dispatch through 100 estimator objects. Scores
+match IsolationForest.decision_function within float tolerance and sklearn is
+only needed at export time.
+
+Export from the command line:
+    python compiled_forest.py anomaly_model.pkl anomaly_model_compiled
+
+The same file lives in services/ml_service, which exports the model, and in
+services/main_host, which loads the export for INGEST_SCORING=local. Each
+Docker image is built from its own service directory only, so the two
+services cannot import one shared copy. Keep both copies identical, and bump
+FORMAT_VERSION whenever the files an export writes change: load() refuses
+exports of another version instead of misreading them.
+"""
+
+import json
+import os
+import uuid
+
+import numpy as np
+
+# Arrays written to the compiled model directory, one .npy file each
+ARRAY_NAMES = ("feature", "threshold", "children", "leaf_value", "roots")
+META_FILENAME = "meta.json"
+# Layout of an export (arrays and meta.json fields); exports without one are version 1
+FORMAT_VERSION = 1
+
+
+def array_filename(name, generation=None):
+    """File of one array of an export; exports from before generations used bare names"""
+    return f"{name}-{generation}.npy" if generation else f"{name}.npy"
+
+
+def average_path_length(n_samples):
+    """Expected path length of an unsuccessful BST search over n samples (c(n) in the paper)"""
+    n_samples = np.asarray(n_samples, dtype=np.float64)
+    result = np.zeros_like(n_samples)
+    result[n_samples == 2] = 1.0
+    large = n_samples > 2
+    n = n_samples[large]
+    result[large] = 2.0 * (np.log(n - 1.0) + np.euler_gamma) - 2.0 * (n - 1.0) / n
+    return result
+
+
+class CompiledForest:
+    """IsolationForest evaluated from packed node arrays"""
+
+    # Rows scored per pass; keeps the (rows x trees) working arrays cache-sized
+    CHUNK_ROWS = 2048
+
+    def __init__(self, feature, threshold, children, leaf_value, roots,
+                 max_depth, denominator, offset, n_features):
+        self.feature = feature
+        self.threshold = threshold
+        # children[2 * node] is the left child, children[2 * node + 1] the right one
+        self.children = children
+        self.leaf_value = leaf_value
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.denominator = float(denominator)
+        self.offset = float(offset)
+        self.n_features = int(n_features)
+
+    @classmethod
+    def from_sklearn(cls, model):
+        """Flatten a fitted sklearn IsolationForest"""
+        features, thresholds, lefts, rights, leaf_values, roots = [], [], [], [], [], []
+        node_offset = 0
+        max_depth = 0
+
+        for estimator, estimator_features in zip(model.estimators_, model.estimators_features_):
+            tree = estimator.tree_
+            n_nodes = tree.node_count
+            left = tree.children_left.astype(np.int64)
+            right = tree.children_right.astype(np.int64)
+            is_leaf = left == -1
+
+            # Depth of every node; children always have a larger index than their parent
+            depth = np.zeros(n_nodes, dtype=np.int64)
+            for node in range(n_nodes):
+                if not is_leaf[node]:
+                    depth[left[node]] = depth[node] + 1
+                    depth[right[node]] = depth[node] + 1
+            max_depth = max(max_depth, int(depth.max()))
+
+            # Leaves loop back to themselves so every row can take max_depth steps
+            own_index = np.arange(n_nodes, dtype=np.int64)
+            left = np.where(is_leaf, own_index, left) + node_offset
+            right = np.where(is_leaf, own_index, right) + node_offset
+
+            # Tree features index the estimator's feature subset; map them back to input columns
+            subset = np.asarray(estimator_features, dtype=np.int64)
+            feature = np.where(is_leaf, 0, subset[np.maximum(tree.feature, 0)])
+
+            # Path length of a leaf: its depth plus c(n) for the training samples left in it
+            leaf_value = np.where(
+                is_leaf, depth + average_path_length(tree.n_node_samples), 0.0
+            )
+
+            features.append(feature)
+            thresholds.append(tree.threshold.astype(np.float64))
+            lefts.append(left)
+            rights.append(right)
+            leaf_values.append(leaf_value)
+            roots.append(node_offset)
+            node_offset += n_nodes
+
+        denominator = len(model.estimators_) * average_path_length([model.max_samples_])[0]
+        return cls(
+            feature=np.concatenate(features).astype(np.int32),
+            threshold=np.concatenate(thresholds),
+            children=np.stack([np.concatenate(lefts), np.concatenate(rights)], axis=1).ravel().astype(np.int32),
+            leaf_value=np.concatenate(leaf_values),
+            roots=np.asarray(roots, dtype=np.int32),
+            max_depth=max_depth,
+            denominator=denominator,
+            offset=model.offset_,
+            n_features=model.n_features_in_,
+        )
+
+    def save(self, directory, source_mtime=None):
+        """Write each array as a raw .npy file plus a small JSON header
+
+        Running processes keep the previous export mapped, so nothing they use is
+        rewritten in place: the arrays go to new files named after this export's
+        generation, then meta.json (which names the generation) is swapped in with
+        os.replace. A reader sees either the old export or the new one, never a mix.
+        """
+        os.makedirs(directory, exist_ok=True)
+        try:
+            previous = self.read_meta(directory).get("generation")
+        except (OSError, ValueError):
+            previous = None
+        generation = uuid.uuid4().hex[:12]
+        for name in ARRAY_NAMES:
+            path = os.path.join(directory, array_filename(name, generation))
+            with open(f"{path}.tmp", "wb") as f:
+                np.save(f, np.ascontiguousarray(getattr(self, name)))
+            os.replace(f"{path}.tmp", path)
+        meta = {
+            "max_depth": self.max_depth,
+            "denominator": self.denominator,
+            "offset": self.offset,
+            "n_features": self.n_features,
+            "source_mtime": source_mtime,
+            "generation": generation,
+            "format_version": FORMAT_VERSION,
+        }
+        meta_path = os.path.join(directory, META_FILENAME)
+        with open(f"{meta_path}.tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(f"{meta_path}.tmp", meta_path)
+
+        # Keep the previous generation for readers that have just read the old
+        # meta.json; older files go (unlinking never disturbs an existing mapping)
+        keep = {array_filename(name, g) for name in ARRAY_NAMES for g in (generation, previous)}
+        for filename in os.listdir(directory):
+            if filename.endswith(".npy") and filename not in keep:
+                try:
+                    os.remove(os.path.join(directory, filename))
+                except OSError:
+                    pass
+
+    @staticmethod
+    def read_meta(directory):
+        with open(os.path.join(directory, META_FILENAME)) as f:
+            return json.load(f)
+
+    @classmethod
+    def load(cls, directory, mmap_mode=None):
+        meta = cls.read_meta(directory)
+        version = meta.pop("format_version", 1)
+        if version != FORMAT_VERSION:
+            raise ValueError(
+                f"{directory} holds export format {version}, this copy of compiled_forest.py "
+                f"reads format {FORMAT_VERSION}; update it to match the exporter"
+            )
+        generation = meta.pop("generation", None)
+        arrays = {
+            name: np.load(os.path.join(directory, array_filename(name, generation)), mmap_mode=mmap_mode)
+            for name in ARRAY_NAMES
+        }
+        meta.pop("source_mtime", None)
+        return cls(**arrays, **meta)
+
+    @property
+    def n_estimators(self):
+        return len(self.roots)
+
+    def path_lengths(self, X):
+        """Summed path length over all trees for each row"""
+        # sklearn evaluates trees on float32 input; cast the same way so splits agree exactly
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f"Expected input with {self.n_features} features")
+
+        n_rows, n_features = X.shape
+        n_trees = len(self.roots)
+        result = np.empty(n_rows, dtype=np.float64)
+        for start in range(0, n_rows, self.CHUNK_ROWS):
+            chunk = X[start:start + self.CHUNK_ROWS]
+            rows = chunk.shape[0]
+            values = chunk.astype(np.float64).ravel()
+            # One flat (row, tree) cursor per pair, advanced one level per step
+            row_base = np.repeat(np.arange(rows, dtype=np.intp) * n_features, n_trees)
+            nodes = np.tile(self.roots, rows)
+            for _ in range(self.max_depth):
+                go_right = values.take(row_base + self.feature.take(nodes)) > self.threshold.take(nodes)
+                nodes = self.children.take(2 * nodes + go_right)
+            result[start:start + rows] = self.leaf_value.take(nodes).reshape(rows, n_trees).sum(axis=1)
+        return result
+
+    def score_samples(self, X):
+        return -(2.0 ** (-self.path_lengths(X) / self.denominator))
+
+    def decision_function(self, X):
+        return self.score_samples(X) - self.offset
+
+
+def export_model(model_path, output_dir):
+    """Compile a pickled IsolationForest into output_dir"""
+    import joblib
+
+    compiled = CompiledForest.from_sklearn(joblib.load(model_path))
+    compiled.save(output_dir, source_mtime=os.path.getmtime(model_path))
+    return compiled
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Flatten a pickled IsolationForest into NumPy arrays")
+    parser.add_argument("model_path", help="joblib pickle of a fitted IsolationForest")
+    parser.add_argument("output_dir", help="directory to write the .npy arrays to")
+    args = parser.parse_args()
+
+    compiled = export_model(args.model_path, args.output_dir)
+    print(f"✅ Compiled {compiled.n_estimators} trees ({len(compiled.feature)} nodes) into {args.output_dir}")
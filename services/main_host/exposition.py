@@ -0,0 +1,126 @@
+"""
+Incremental Prometheus exposition of the latest vitals held in the patient store.
+
+A scrape used to re-render every gauge for every label set. Here each patient's
+sample lines are rendered once and cached together with the store seq of the
+patient's latest reading. On the next scrape only patients whose seq moved are
+rendered again, and an unchanged store reuses the whole body (and its gzip) as
+is. The other patients cost one integer comparison each, so scrape work follows
+churn rather than the number of patients.
+
+Both the Prometheus text format (0.0.4) and OpenMetrics 1.0 text are
+supported; both use the same sample line syntax for gauges.
+"""
+
+import gzip
+import threading
+
+from prometheus_client import CONTENT_TYPE_LATEST
+from prometheus_client.openmetrics import exposition as openmetrics
+from prometheus_client.utils import floatToGoString
+
+OPENMETRICS_CONTENT_TYPE = openmetrics.CONTENT_TYPE_LATEST
+
+# Store label field -> exported label name, in export order
+EXPORTED_LABELS = (('hospital', 'hospital'), ('dept', 'department'), ('ward', 'ward'), ('patient', 'patient'))
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def escape_help(text, use_openmetrics=False):
+    text = text.replace('\\', r'\\').replace('\n', r'\n')
+    # OpenMetrics escapes quotes in HELP as well
+    return text.replace('"', r'\"') if use_openmetrics else text
+
+
+class VitalsExposition:
+    """Renders one gauge family per vital from the store, re-rendering only changed patients"""
+
+    def __init__(self, store, families, registry_output=None, rendered_counter=None):
+        """families: reading field -> (metric name, help text)
+
+        registry_output(use_openmetrics) returns the exposition of any other
+        metrics (counters, process metrics) to append after the vitals, and
+        rendered_counter is a Counter incremented for every re-rendered patient.
+        """
+        self.store = store
+        self.families = list(families.items())
+        self.registry_output = registry_output
+        self.rendered_counter = rendered_counter
+        self._series = {}  # key -> (seq, one rendered block per family)
+        self._bodies = {}  # (openmetrics, gzipped) -> vitals body for the current generation
+        self._lock = threading.Lock()
+        self.series_rendered = 0
+        self.scrapes = 0
+
+    def _label_string(self, key):
+        labels = self.store.labels(key)
+        return ','.join(
+            f'{name}="{escape_label_value(labels.get(field, "unknown"))}"' for field, name in EXPORTED_LABELS
+        )
+
+    def _render_series(self, key):
+        values = self.store.latest_values(key)
+        label_string = self._label_string(key)
+        return tuple(
+            f'{name}{{{label_string}}} {floatToGoString(values[field])}\n' if field in values else ''
+            for field, (name, _) in self.families
+        )
+
+    def _refresh(self):
+        """Re-render patients whose readings changed; True if anything did"""
+        versions = self.store.versions()
+        rendered = 0
+        for key, seq in versions.items():
+            cached = self._series.get(key)
+            if cached is None or cached[0] != seq:
+                self._series[key] = (seq, self._render_series(key))
+                rendered += 1
+        if rendered:
+            self.series_rendered += rendered
+            if self.rendered_counter is not None:
+                self.rendered_counter.inc(rendered)
+        changed = rendered > 0
+        removed = self._series.keys() - versions.keys()
+        if removed:
+            # Keys evicted from the store stop being exported
+            for key in removed:
+                del self._series[key]
+            changed = True
+        return changed
+
+    def _vitals_body(self, use_openmetrics):
+        parts = []
+        for index, (_, (name, help_text)) in enumerate(self.families):
+            samples = ''.join(blocks[index] for _, blocks in self._series.values())
+            if not samples:
+                continue
+            parts.append(f'# HELP {name} {escape_help(help_text, use_openmetrics)}\n# TYPE {name} gauge\n')
+            parts.append(samples)
+        return ''.join(parts).encode('utf-8')
+
+    def render(self, use_openmetrics=False, gzipped=False):
+        """Return (body, content type); gzipped bodies are concatenated gzip members"""
+        with self._lock:
+            self.scrapes += 1
+            if self._refresh():
+                self._bodies.clear()
+            cache_key = (use_openmetrics, gzipped)
+            vitals = self._bodies.get(cache_key)
+            if vitals is None:
+                vitals = self._bodies.get((use_openmetrics, False))
+                if vitals is None:
+                    vitals = self._bodies[(use_openmetrics, False)] = self._vitals_body(use_openmetrics)
+                if gzipped:
+                    vitals = self._bodies[cache_key] = gzip.compress(vitals, compresslevel=6)
+
+        tail = self.registry_output(use_openmetrics) if self.registry_output else b''
+        if use_openmetrics and not tail.endswith(b'# EOF\n'):
+            tail += b'# EOF\n'
+        if gzipped:
+            tail = gzip.compress(tail, compresslevel=6)
+        content_type = OPENMETRICS_CONTENT_TYPE if use_openmetrics else CONTENT_TYPE_LATEST
+        return vitals + tail, content_type
+
@@ -0,0 +1,61 @@
+"""
+gunicorn settings for running main_host with several worker processes.
+
+Workers share patient state through a memory-mapped store under
+MAIN_HOST_SHARED_DIR (see shared_store.py), history not yet written to disk
+through a second map there (see shared_tsdb.py), and Prometheus values through
+per-worker files under PROMETHEUS_MULTIPROC_DIR that /metrics merges.
+Both directories are wiped when the server starts; the master then refills
+the shared store from the write-ahead log (see wal.py) before forking workers.
+
+Run with:
+    gunicorn -c gunicorn.conf.py app:app
+"""
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+# Set before any worker imports app.py (and with it prometheus_client)
+default_shm = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+os.environ.setdefault('MAIN_HOST_SHARED_DIR', os.path.join(default_shm, 'main_host'))
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(default_shm, 'main_host_metrics'))
+
+bind = f"0.0.0.0:{os.environ.get('MAIN_HOST_PORT', 8000)}"
+workers = int(os.environ.get('MAIN_HOST_WORKERS', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.environ.get('MAIN_HOST_THREADS', 4))
+keepalive = 30
+# Every worker must open the shared store itself; flock does not work across a fork
+preload_app = False
+
+
+def on_starting(server):
+    """Start from empty shared state and recover it from the WAL once, before any worker runs"""
+    for variable in ('MAIN_HOST_SHARED_DIR', 'PROMETHEUS_MULTIPROC_DIR'):
+        directory = os.environ[variable]
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+
+    from storage import create_patient_store, create_tsdb, wal_dir
+    from wal import recover
+
+    directory = wal_dir()
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        store = create_patient_store()
+        history_db = create_tsdb()
+        stats = recover(store, directory, history_db)
+        store.close()
+        if history_db is not None:
+            history_db.close()
+        server.log.info("Recovered patient store: %s", stats)
+    # Workers (including ones restarted later) must not replay the log again
+    os.environ['MAIN_HOST_RECOVERED'] = '1'
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,456 @@
+"""
+Fixed-size, column-oriented history store for patient vitals.
+
+Each patient gets a ring buffer of preallocated float columns (one per vital
+plus a timestamp column), so appending a reading is O(1), never reallocates and
+the memory used per patient is a fixed number of bytes that only depends on the
+configured depth.
+"""
+
+import math
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from contextlib import nullcontext
+from datetime import datetime, timezone
+
+# Numeric fields kept per reading - mirrors the gauges exported by app.py
+VITAL_FIELDS = (
+    'heart_rate', 'bp_systolic', 'bp_diastolic', 'respiratory_rate', 'spo2',
+    'etco2', 'fio2', 'temperature', 'wbc_count', 'lactate', 'blood_glucose',
+    'anomaly_score',
+)
+
+# Label fields that identify where a reading came from
+LABEL_FIELDS = ('hospital', 'dept', 'ward', 'patient')
+
+DEFAULT_DEPTH = 100
+
+# Removed keys remembered for changes_since()
+MAX_TOMBSTONES = 10000
+
+NAN = float('nan')
+
+
+def parse_timestamp(value, default=None):
+    """Convert an ISO-8601 string or epoch number to epoch seconds (naive ISO is treated as UTC)"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            parsed = None
+        if parsed is not None:
+            if parsed.tzinfo is None:
+                parsed = parsed.replace(tzinfo=timezone.utc)
+            return parsed.timestamp()
+    return time.time() if default is None else default
+
+
+def format_timestamp(epoch_seconds):
+    """Render epoch seconds in the naive UTC ISO format the simulator sends"""
+    return datetime.fromtimestamp(epoch_seconds, timezone.utc).replace(tzinfo=None).isoformat()
+
+
+class PatientRingBuffer:
+    """Fixed-depth history of one patient's readings, stored column-wise
+
+    All columns plus the write position live in one contiguous buffer, so the
+    same ring can sit in private memory or in a slot of a shared memory map.
+    """
+
+    # Write position, fill count, total appends, last append time (epoch ms) and
+    # store sequence number of the last append, kept in front of the columns
+    STATE_BYTES = 40
+
+    def __init__(self, depth=DEFAULT_DEPTH, storage=None):
+        if depth < 1:
+            raise ValueError("depth must be at least 1")
+        self.depth = depth
+        fresh = storage is None
+        if fresh:
+            storage = bytearray(self.storage_size(depth))
+        view = memoryview(storage)
+        if len(view) < self.storage_size(depth):
+            raise ValueError("storage is too small for this depth")
+
+        self._view = view[:self.storage_size(depth)]
+        self._state = view[:self.STATE_BYTES].cast('q')  # [next slot, count, writes, last seen ms, seq]
+        column_bytes = depth * array('d').itemsize
+        offset = self.STATE_BYTES
+        self.timestamps = view[offset:offset + column_bytes].cast('d')
+        self.columns = {}
+        for field in VITAL_FIELDS:
+            offset += column_bytes
+            self.columns[field] = view[offset:offset + column_bytes].cast('d')
+        if fresh:
+            self.clear()
+
+    @staticmethod
+    def storage_size(depth):
+        """Bytes needed for the state header and depth slots of every column"""
+        return PatientRingBuffer.STATE_BYTES + depth * array('d').itemsize * (len(VITAL_FIELDS) + 1)
+
+    def clear(self):
+        empty = array('d', [NAN]) * self.depth
+        self.timestamps[:] = empty
+        for column in self.columns.values():
+            column[:] = empty
+        self._state[0] = 0
+        self._state[1] = 0
+        self._state[2] = 0
+        self._state[3] = 0
+        self._state[4] = 0
+
+    def __len__(self):
+        return self._state[1]
+
+    @property
+    def writes(self):
+        """Readings appended since the buffer was created; changes whenever the latest reading does"""
+        return self._state[2]
+
+    @property
+    def last_seen(self):
+        """Wall-clock time of the last append (reading timestamps can be replayed or in the future)"""
+        return self._state[3] / 1000.0
+
+    @property
+    def seq(self):
+        """Store-wide sequence number of the latest reading"""
+        return self._state[4]
+
+    @property
+    def nbytes(self):
+        """Bytes held by the preallocated columns and the state header"""
+        return self.storage_size(self.depth)
+
+    def append(self, timestamp, data, seq=0):
+        """Overwrite the oldest slot with a new reading; missing vitals are stored as NaN"""
+        state = self._state
+        slot = state[0]
+        self.timestamps[slot] = timestamp
+        for field, column in self.columns.items():
+            value = data.get(field)
+            column[slot] = NAN if value is None else float(value)
+        state[0] = (slot + 1) % self.depth
+        if state[1] < self.depth:
+            state[1] += 1
+        state[2] += 1
+        state[3] = int(time.time() * 1000)
+        state[4] = seq
+
+    def to_bytes(self):
+        """Copy of the whole ring (state header and columns), for snapshots"""
+        return self._view.tobytes()
+
+    def load(self, raw, seq=0):
+        """Replace the whole ring with bytes from to_bytes() of a buffer of the same depth"""
+        if len(raw) != len(self._view):
+            raise ValueError("snapshot ring has a different size")
+        self._view[:] = raw
+        self._state[4] = seq
+
+    def _slots(self):
+        """Slot indexes from oldest to newest"""
+        next_slot, count = self._state[0], self._state[1]
+        start = (next_slot - count) % self.depth
+        return [(start + i) % self.depth for i in range(count)]
+
+    def reading_at(self, slot):
+        """Vitals and timestamp stored in one slot, skipping vitals that were not sent"""
+        reading = {}
+        for field, column in self.columns.items():
+            value = column[slot]
+            if not math.isnan(value):
+                reading[field] = value
+        reading['timestamp'] = format_timestamp(self.timestamps[slot])
+        return reading
+
+    def latest(self):
+        if not self._state[1]:
+            return None
+        return self.reading_at((self._state[0] - 1) % self.depth)
+
+    def readings(self):
+        """All buffered readings, oldest first"""
+        return [self.reading_at(slot) for slot in self._slots()]
+
+    def latest_values(self):
+        """Most recent value of every vital that has one, looking back past readings that omitted it"""
+        values = {}
+        for slot in reversed(self._slots()):
+            for field, column in self.columns.items():
+                if field not in values:
+                    value = column[slot]
+                    if not math.isnan(value):
+                        values[field] = value
+            if len(values) == len(self.columns):
+                break
+        return values
+
+
+class PatientStore:
+    """Ring buffers keyed by 'hospital|dept|ward|patient', indexed by each label
+
+    Subclasses can keep the ring buffers somewhere else (see shared_store.py)
+    by overriding _new_buffer, _sync and _guard.
+    """
+
+    def __init__(self, depth=DEFAULT_DEPTH):
+        self.depth = depth
+        self._buffers = {}
+        self._labels = {}
+        # label field -> label value -> keys (dicts keep insertion order, unlike sets)
+        self._indexes = {field: {} for field in LABEL_FIELDS}
+        self._lock = threading.Lock()
+        # Every append and removal gets the next sequence number, so readers can ask what changed
+        self._seq = 0
+        # Removed key -> seq of the removal, oldest first; removals at or before _tombstone_floor are forgotten
+        self._tombstones = OrderedDict()
+        self._tombstone_floor = 0
+
+    def __len__(self):
+        with self._lock:
+            self._sync()
+            return len(self._buffers)
+
+    def __contains__(self, key):
+        with self._lock:
+            self._sync()
+            return key in self._buffers
+
+    def keys(self):
+        with self._lock:
+            self._sync()
+            return list(self._buffers)
+
+    @property
+    def bytes_per_patient(self):
+        return PatientRingBuffer.storage_size(self.depth)
+
+    def _new_buffer(self, key, labels):
+        """Allocate the ring buffer for a key seen for the first time"""
+        return PatientRingBuffer(self.depth)
+
+    def _sync(self):
+        """Pick up keys added outside this store object; nothing to do for private memory"""
+
+    def _guard(self, key, exclusive):
+        """Context that keeps other writers out of one key's buffer while it is used"""
+        return nullcontext()
+
+    def _write(self, key, buffer, update):
+        """Run update(seq) on a buffer under the next sequence number and return it; the caller holds self._lock"""
+        self._seq += 1
+        with self._guard(key, exclusive=True):
+            update(self._seq)
+        return self._seq
+
+    def current_seq(self):
+        """Sequence number of the latest change; every change up to it is visible"""
+        with self._lock:
+            return self._current_seq()
+
+    def _current_seq(self):
+        """current_seq for callers that already hold self._lock"""
+        return self._seq
+
+    def advance_seq(self, seq):
+        """Continue numbering after seq (used after recovery, so new changes sort after logged ones)"""
+        with self._lock:
+            if seq > self._seq:
+                self._seq = seq
+                # Removals before this point are unknown; older cursors get a full snapshot
+                self._tombstone_floor = seq
+
+    def _register(self, key, labels, buffer):
+        self._tombstones.pop(key, None)
+        self._buffers[key] = buffer
+        self._labels[key] = labels
+        for field, value in labels.items():
+            self._indexes[field].setdefault(str(value), {})[key] = None
+
+    def _remove(self, key, seq=None):
+        """Drop a key from this store object and its indexes; the caller holds self._lock"""
+        if self._buffers.pop(key, None) is None:
+            return False
+        if seq is None:
+            self._seq += 1
+            seq = self._seq
+        self._tombstones[key] = seq
+        while len(self._tombstones) > MAX_TOMBSTONES:
+            _, self._tombstone_floor = self._tombstones.popitem(last=False)
+        labels = self._labels.pop(key)
+        for field, value in labels.items():
+            index = self._indexes[field]
+            group = index.get(str(value))
+            if group is not None:
+                group.pop(key, None)
+                if not group:
+                    del index[str(value)]
+        return True
+
+    def _evict(self, key, cutoff):
+        """Remove a key if it still has no reading after cutoff; the caller holds self._lock"""
+        if self._buffers[key].last_seen >= cutoff:
+            return False
+        return self._remove(key)
+
+    def remove(self, key):
+        with self._lock:
+            return self._remove(key)
+
+    def evict_idle(self, ttl_seconds, now=None):
+        """Remove every key with no reading in the last ttl_seconds and return the removed keys"""
+        cutoff = (time.time() if now is None else now) - ttl_seconds
+        with self._lock:
+            self._sync()
+            stale = [key for key, buffer in self._buffers.items() if buffer.last_seen < cutoff]
+            return [key for key in stale if key in self._buffers and self._evict(key, cutoff)]
+
+    def _buffer_for(self, key, labels):
+        """Ring buffer of a key, allocated on first use; the caller holds self._lock"""
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            self._sync()
+            buffer = self._buffers.get(key)
+        if buffer is None:
+            labels = labels()
+            buffer = self._new_buffer(key, labels)
+            self._register(key, labels, buffer)
+        return buffer
+
+    def append(self, key, data):
+        """Record a reading and return its sequence number
+
+        The labels of the first reading for a key are kept for rendering.
+        """
+        timestamp = parse_timestamp(data.get('timestamp'))
+        with self._lock:
+            buffer = self._buffer_for(key, lambda: {field: data.get(field, 'unknown') for field in LABEL_FIELDS})
+            return self._write(key, buffer, lambda seq: buffer.append(timestamp, data, seq))
+
+    def restore(self, key, labels, raw):
+        """Put back a whole ring saved with dump() (same depth) under a new sequence number"""
+        with self._lock:
+            buffer = self._buffer_for(key, lambda: dict(labels))
+            return self._write(key, buffer, lambda seq: buffer.load(raw, seq))
+
+    def dump(self):
+        """(key, labels, seq of its latest reading, ring bytes) for every key, one key at a time"""
+        for key in self.keys():
+            with self._lock:
+                buffer = self._buffers.get(key)
+                if buffer is None:
+                    continue
+                with self._guard(key, exclusive=False):
+                    seq, raw = buffer.seq, buffer.to_bytes()
+                labels = dict(self._labels[key])
+            yield key, labels, seq, raw
+
+    def find_keys(self, **filters):
+        """Keys matching every given label (hospital, dept, ward, patient), in insertion order
+
+        Only the index entries for the requested labels are touched, so the cost
+        is proportional to the smallest matching group rather than to all keys.
+        """
+        filters = {field: str(value) for field, value in filters.items() if value is not None}
+        if not filters:
+            return self.keys()
+        with self._lock:
+            self._sync()
+            groups = []
+            for field, value in filters.items():
+                if field not in self._indexes:
+                    raise ValueError(f"unknown label filter: {field}")
+                group = self._indexes[field].get(value)
+                if not group:
+                    return []
+                groups.append(group)
+            groups.sort(key=len)
+            smallest, others = groups[0], groups[1:]
+            return [key for key in smallest if all(key in group for group in others)]
+
+    def find_patients(self, **filters):
+        """Distinct patient ids matching the filters, in first-seen order"""
+        if not any(value is not None for value in filters.values()):
+            with self._lock:
+                self._sync()
+                return list(self._indexes['patient'])
+        keys = self.find_keys(**filters)
+        with self._lock:
+            return list(dict.fromkeys(self._labels[key]['patient'] for key in keys))
+
+    def _with_labels(self, key, reading):
+        reading.update(self._labels[key])
+        return reading
+
+    def latest(self, key):
+        """Most recent reading for a key, or None"""
+        with self._lock:
+            buffer = self._buffers.get(key)
+            if buffer is None:
+                self._sync()
+                buffer = self._buffers.get(key)
+            if buffer is None:
+                return None
+            with self._guard(key, exclusive=False):
+                reading = buffer.latest()
+            return None if reading is None else self._with_labels(key, reading)
+
+    def labels(self, key):
+        with self._lock:
+            return dict(self._labels.get(key, {}))
+
+    def versions(self):
+        """Key -> store seq of its latest reading; a changed number means a changed latest reading
+
+        Unlike the buffer's write count, the seq keeps growing when a key is
+        evicted and appears again, so the new buffer never looks unchanged.
+        """
+        with self._lock:
+            self._sync()
+            return {key: buffer.seq for key, buffer in self._buffers.items()}
+
+    def latest_values(self, key):
+        """Most recent value of every vital for a key (what a gauge per vital would hold)"""
+        with self._lock:
+            buffer = self._buffers.get(key)
+            if buffer is None:
+                return {}
+            with self._guard(key, exclusive=False):
+                return buffer.latest_values()
+
+    def changes_since(self, cursor):
+        """(seq, keys with a reading after cursor, keys removed after cursor)
+
+        The removed list is None when removals that old have been forgotten, or
+        when the cursor is ahead of this store (it came from before a restart
+        that lost the store); the caller should then start over from a full snapshot.
+        """
+        with self._lock:
+            self._sync()
+            # Read the cursor first: anything appended while scanning is simply reported again next time
+            seq = self._current_seq()
+            changed = [key for key, buffer in self._buffers.items() if buffer.seq > cursor]
+            if cursor < self._tombstone_floor or cursor > seq:
+                removed = None
+            else:
+                removed = [key for key, removed_seq in self._tombstones.items() if removed_seq > cursor]
+        return seq, changed, removed
+
+    def history(self, key):
+        """All buffered readings for a key, oldest first"""
+        with self._lock:
+            buffer = self._buffers.get(key)
+            if buffer is None:
+                self._sync()
+                buffer = self._buffers.get(key)
+            if buffer is None:
+                return []
+            with self._guard(key, exclusive=False):
+                readings = buffer.readings()
+            return [self._with_labels(key, reading) for reading in readings]
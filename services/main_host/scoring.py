@@ -0,0 +1,139 @@
+"""
+Optional anomaly scoring of readings as main_host ingests them.
+
+INGEST_SCORING picks where the score comes from:
+
+    off     readings keep whatever anomaly_score the sender attached (default)
+    remote  one POST to ml_service /predict/batch per ingest request, over a
+            pooled keep-alive session
+    local   the compiled forest that ml_service exports, read from
+            LOCAL_MODEL_DIR and evaluated in this process with main_host's
+            own copy of compiled_forest.py
+
+Either way the score replaces the one sent, so every stored reading carries a
+score from the same model and senders no longer need their own /predict call.
+If scoring fails the readings are stored with the score they came with.
+"""
+
+import importlib
+import logging
+import os
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger('main_host')
+
+# Model inputs, in the column order ml_service was trained on
+FEATURE_NAMES = (
+    'heart_rate', 'bp_systolic', 'bp_diastolic', 'respiratory_rate', 'spo2',
+    'etco2', 'fio2', 'temperature', 'wbc_count', 'lactate', 'blood_glucose',
+)
+
+# Stand-in for a vital a reading does not carry: the centre of the normal
+# range ml_service's fallback model is trained on, so it does not look anomalous
+NORMAL_VALUES = {
+    'heart_rate': 75.0, 'bp_systolic': 120.0, 'bp_diastolic': 80.0, 'respiratory_rate': 18.0,
+    'spo2': 97.0, 'etco2': 37.0, 'fio2': 21.0, 'temperature': 36.6, 'wbc_count': 7.0,
+    'lactate': 1.2, 'blood_glucose': 95.0,
+}
+
+# decision_function bounds mapped onto 0-1, as in ml_service/model.py
+MIN_SCORE = -0.5
+MAX_SCORE = 0.5
+
+
+def feature_rows(readings):
+    """Model input rows for readings, with missing vitals filled in from NORMAL_VALUES"""
+    rows = []
+    for reading in readings:
+        row = []
+        for field in FEATURE_NAMES:
+            value = reading.get(field)
+            row.append(NORMAL_VALUES[field] if value is None else float(value))
+        rows.append(row)
+    return rows
+
+
+def normalized_score(raw_score):
+    """0-1 anomaly score (higher = more anomalous) from a decision_function value"""
+    normalized = min(1.0, max(0.0, (raw_score - MIN_SCORE) / (MAX_SCORE - MIN_SCORE)))
+    return round(1.0 - normalized, 4)
+
+
+class RemoteScorer:
+    """Scores a batch of readings with one /predict/batch call to ml_service"""
+
+    mode = 'remote'
+
+    def __init__(self, url, timeout=(1, 3), pool_size=8):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def score(self, readings):
+        response = self.session.post(self.url, json={'instances': feature_rows(readings)}, timeout=self.timeout)
+        response.raise_for_status()
+        results = response.json()['results']
+        if len(results) != len(readings):
+            raise ValueError(f"ml_service returned {len(results)} scores for {len(readings)} readings")
+        return [result['normalized_score'] for result in results]
+
+
+class LocalScorer:
+    """Scores readings in-process with the compiled forest exported by ml_service
+
+    The model is (re)loaded when its export on disk changes, so retraining in
+    ml_service reaches main_host without a restart. meta.json is written last
+    and replaced whole on every export, so only its inode and mtime are
+    checked, at most once every check_seconds. An export in a format this
+    copy of compiled_forest.py does not read fails to load, so scoring fails
+    (and readings keep their sent score) until the copies match again.
+    """
+
+    mode = 'local'
+
+    def __init__(self, model_dir, check_seconds=5.0):
+        self.model_dir = model_dir
+        self.check_seconds = check_seconds
+        # numpy is only needed for local scoring
+        self._compiled_forest = importlib.import_module('compiled_forest')
+        self._meta_path = os.path.join(self.model_dir, self._compiled_forest.META_FILENAME)
+        self._model = None
+        self._loaded_version = None
+        self._next_check = 0.0
+
+    def _current_model(self):
+        now = time.monotonic()
+        if self._model is not None and now < self._next_check:
+            return self._model
+        self._next_check = now + self.check_seconds
+        stat = os.stat(self._meta_path)
+        version = (stat.st_ino, stat.st_mtime_ns)
+        if self._model is None or version != self._loaded_version:
+            self._model = self._compiled_forest.CompiledForest.load(self.model_dir, mmap_mode='r')
+            self._loaded_version = version
+            logger.info("Loaded compiled anomaly model", extra={'fields': {'path': self.model_dir}})
+        return self._model
+
+    def score(self, readings):
+        raw_scores = self._current_model().decision_function(feature_rows(readings))
+        return [normalized_score(float(raw)) for raw in raw_scores]
+
+
+def create_scorer():
+    """Scorer selected by INGEST_SCORING, or None when scoring on ingest is off"""
+    mode = os.environ.get('INGEST_SCORING', 'off').lower()
+    if mode == 'off':
+        return None
+    if mode == 'remote':
+        url = os.environ.get('ML_SERVICE_URL', 'http://ml_service:6000').rstrip('/')
+        return RemoteScorer(f"{url}/predict/batch")
+    if mode == 'local':
+        return LocalScorer(os.environ.get('LOCAL_MODEL_DIR', '/ml_model'),
+                           check_seconds=float(os.environ.get('LOCAL_MODEL_CHECK_SECONDS', 5)))
+    raise ValueError(f"INGEST_SCORING must be off, remote or local, not {mode!r}")
@@ -0,0 +1,302 @@
+"""
+PatientStore variant whose ring buffers live in a shared memory-mapped file.
+
+With several gunicorn workers every process maps the same file (on /dev/shm
+by default), so a reading ingested by one worker is visible to the /api/*
+reads served by any other worker. The file is a small header followed by
+fixed-size patient slots:
+
+    header   magic, depth, number of vitals, capacity, slot size, slots in use,
+             layout changes, sequence number of the latest change
+    slot     generation, label length, seq of its removal, labels of the patient
+             (JSON) + PatientRingBuffer storage
+
+Slots are allocated under an exclusive flock on the whole file, at the end
+while there is room and otherwise by reusing a slot freed by eviction. Each
+worker keeps its own key -> slot dict and label indexes and catches up with
+slots added by other workers by comparing the "slots in use" counter with the
+number it has already loaded. Freeing or reusing a slot bumps its generation
+and the header's "layout changes" counter, which makes every worker recheck
+the generations of the slots it knows about. Reads and writes of one slot take a
+POSIX byte-range lock on that slot, so a reader never sees a half-written
+reading. Appends also hold a lock on the header's sequence number while they
+write, so once a reader has seen sequence number N every change up to N is
+visible in the slots. Byte-range locks are per process, so every one is taken
+under the store's thread lock (self._lock) as well.
+
+The file must be opened in each worker after the fork (gunicorn's default
+preload_app = False does that), because flock is shared across a fork.
+"""
+
+import fcntl
+import json
+import mmap
+import os
+import struct
+from contextlib import contextmanager
+
+from patient_store import DEFAULT_DEPTH, LABEL_FIELDS, PatientRingBuffer, PatientStore, VITAL_FIELDS
+
+SHARED_STORE_FILENAME = 'patient_store.bin'
+
+DEFAULT_CAPACITY = 5000
+
+MAGIC = b'PSTORE04'
+# magic, depth, vitals per reading, capacity, slot size, slots in use, layout changes, seq
+HEADER = struct.Struct('<8sIIIIQQQ')
+HEADER_BYTES = 64
+USED_OFFSET = HEADER.size - 24
+CHANGES_OFFSET = HEADER.size - 16
+SEQ_OFFSET = HEADER.size - 8
+
+# Each slot starts with its generation, the length of its JSON labels (0 marks a
+# free slot), the seq at which it was freed and then the labels themselves
+LABEL_BYTES = 256
+SLOT_HEADER = struct.Struct('<IIQ')
+
+
+class SharedPatientStore(PatientStore):
+    """PatientStore backed by a memory-mapped file shared between worker processes"""
+
+    def __init__(self, path, depth=DEFAULT_DEPTH, capacity=DEFAULT_CAPACITY):
+        super().__init__(depth=depth)
+        self.path = path
+        self.capacity = capacity
+        self.slot_size = LABEL_BYTES + PatientRingBuffer.storage_size(depth)
+        self._slots = {}
+        self._slot_keys = {}  # slot -> (key, generation) as loaded by this process
+        self._loaded = 0
+        self._changes_seen = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            size = HEADER_BYTES + capacity * self.slot_size
+            if os.fstat(self._fd).st_size == 0:
+                # First worker to get here lays out the file; pages stay unallocated until touched
+                os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, HEADER.pack(MAGIC, depth, len(VITAL_FIELDS), capacity, self.slot_size, 0, 0, 0), 0)
+            self._check_header(size)
+            self._map = mmap.mmap(self._fd, size)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _check_header(self, size):
+        magic, depth, fields, capacity, slot_size, _, _, _ = HEADER.unpack(os.pread(self._fd, HEADER.size, 0))
+        expected = (MAGIC, self.depth, len(VITAL_FIELDS), self.capacity, self.slot_size)
+        if (magic, depth, fields, capacity, slot_size) != expected or os.fstat(self._fd).st_size != size:
+            raise ValueError(
+                f"{self.path} was created with a different layout "
+                f"(depth={depth}, capacity={capacity}); remove it or match its settings"
+            )
+
+    def _slot_offset(self, slot):
+        return HEADER_BYTES + slot * self.slot_size
+
+    def _used(self):
+        return struct.unpack_from('<Q', self._map, USED_OFFSET)[0]
+
+    def _changes(self):
+        return struct.unpack_from('<Q', self._map, CHANGES_OFFSET)[0]
+
+    def _bump_changes(self):
+        struct.pack_into('<Q', self._map, CHANGES_OFFSET, self._changes() + 1)
+
+    def _seq_lock(self, command):
+        fcntl.lockf(self._fd, command, 8, SEQ_OFFSET)
+
+    def _read_seq(self):
+        return struct.unpack_from('<Q', self._map, SEQ_OFFSET)[0]
+
+    def _take_seq(self):
+        """Next sequence number; the caller holds the seq lock exclusively"""
+        seq = self._read_seq() + 1
+        struct.pack_into('<Q', self._map, SEQ_OFFSET, seq)
+        return seq
+
+    def _current_seq(self):
+        # Appends hold the seq lock while writing, so a shared lock waits for them to finish.
+        # The caller holds self._lock: lockf locks belong to the process, so a thread
+        # taking and releasing this one would drop the exclusive lock of a writing thread
+        self._seq_lock(fcntl.LOCK_SH)
+        try:
+            return self._read_seq()
+        finally:
+            self._seq_lock(fcntl.LOCK_UN)
+
+    def _write(self, key, buffer, update):
+        self._seq_lock(fcntl.LOCK_EX)
+        try:
+            seq = self._take_seq()
+            with self._guard(key, exclusive=True):
+                update(seq)
+            return seq
+        finally:
+            self._seq_lock(fcntl.LOCK_UN)
+
+    def advance_seq(self, seq):
+        with self._lock:
+            self._seq_lock(fcntl.LOCK_EX)
+            try:
+                if seq > self._read_seq():
+                    struct.pack_into('<Q', self._map, SEQ_OFFSET, seq)
+            finally:
+                self._seq_lock(fcntl.LOCK_UN)
+
+    def close(self):
+        """Unmap the file (the object is unusable afterwards)"""
+        with self._lock:
+            self._buffers.clear()
+            self._map.close()
+            os.close(self._fd)
+
+    def _slot_header(self, slot):
+        """(generation, label length, removal seq) of a slot; length 0 means free"""
+        return SLOT_HEADER.unpack_from(self._map, self._slot_offset(slot))
+
+    def _attach(self, slot):
+        """Labels and ring buffer stored in one slot"""
+        offset = self._slot_offset(slot)
+        _, length, _ = SLOT_HEADER.unpack_from(self._map, offset)
+        start = offset + SLOT_HEADER.size
+        labels = json.loads(bytes(self._map[start:start + length]).decode('utf-8'))
+        storage = memoryview(self._map)[offset + LABEL_BYTES:offset + self.slot_size]
+        return labels, PatientRingBuffer(self.depth, storage=storage)
+
+    @staticmethod
+    def _key_for(labels):
+        return '|'.join(str(labels[field]) for field in LABEL_FIELDS)
+
+    def _load_slot(self, slot):
+        generation, length, _ = self._slot_header(slot)
+        if not length:
+            return
+        labels, buffer = self._attach(slot)
+        key = self._key_for(labels)
+        self._slots[key] = slot
+        self._slot_keys[slot] = (key, generation)
+        self._register(key, labels, buffer)
+
+    def _forget(self, key, seq):
+        slot = self._slots.pop(key, None)
+        if slot is not None:
+            self._slot_keys.pop(slot, None)
+        self._remove(key, seq)
+
+    def _sync(self):
+        """Load the slots other workers have added, freed or reused since the last call"""
+        changes = self._changes()
+        if changes != self._changes_seen:
+            # Rare (only after evictions): recheck every slot this process has loaded
+            for slot in range(self._loaded):
+                generation, length, removed_seq = self._slot_header(slot)
+                known = self._slot_keys.get(slot)
+                if known is not None and (known[1] != generation or not length):
+                    # A slot that was already reused no longer has its removal seq
+                    self._forget(known[0], removed_seq if not length else self._read_seq())
+                    known = None
+                if known is None and length:
+                    self._load_slot(slot)
+            self._changes_seen = changes
+        used = self._used()
+        while self._loaded < used:
+            self._load_slot(self._loaded)
+            self._loaded += 1
+
+    def _free_slot(self):
+        """Index of a slot to allocate, reusing an evicted one once the end of the file is reached
+
+        A slot at the end is only counted in "slots in use" by _new_buffer once it
+        is written: _sync does not take the flock, and a worker that read the new
+        count before the labels would skip the slot for good.
+        """
+        used = self._used()
+        if used < self.capacity:
+            return used
+        for slot in range(self.capacity):
+            if not self._slot_header(slot)[1]:
+                return slot
+        raise RuntimeError(
+            f"shared patient store is full ({self.capacity} patients); raise MAIN_HOST_MAX_PATIENTS"
+        )
+
+    def _new_buffer(self, key, labels):
+        encoded = json.dumps(labels).encode('utf-8')
+        if len(encoded) > LABEL_BYTES - SLOT_HEADER.size:
+            raise ValueError("hospital/dept/ward/patient labels are too long for the shared store")
+
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            # Another worker may have added this key while we waited for the lock
+            self._sync()
+            if key in self._buffers:
+                return self._buffers.pop(key)
+            used = self._used()
+            slot = self._free_slot()
+            offset = self._slot_offset(slot)
+            generation = self._slot_header(slot)[0] + 1
+            storage = memoryview(self._map)[offset + LABEL_BYTES:offset + self.slot_size]
+            buffer = PatientRingBuffer(self.depth, storage=storage)
+            buffer.clear()
+            start = offset + SLOT_HEADER.size
+            self._map[start:start + len(encoded)] = encoded
+            # Writing the length publishes the fully initialised slot, and only then is
+            # a slot at the end counted in "slots in use" for other workers to load
+            SLOT_HEADER.pack_into(self._map, offset, generation, len(encoded), 0)
+            if slot == used:
+                struct.pack_into('<Q', self._map, USED_OFFSET, used + 1)
+            else:
+                # Reused an evicted slot; we have just synced, so only other workers need to rescan
+                self._bump_changes()
+                self._changes_seen = self._changes()
+            self._slots[key] = slot
+            self._slot_keys[slot] = (key, generation)
+            self._loaded = max(self._loaded, slot + 1)
+            return buffer
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _evict(self, key, cutoff):
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            # Another worker may already have evicted (or even reused) the slot
+            self._sync()
+            slot = self._slots.get(key)
+            if slot is None:
+                return False
+            # Same lock order as _write: seq, then slot
+            self._seq_lock(fcntl.LOCK_EX)
+            try:
+                with self._guard(key, exclusive=True):
+                    if self._buffers[key].last_seen >= cutoff:
+                        return False
+                    seq = self._take_seq()
+                    generation = self._slot_header(slot)[0]
+                    SLOT_HEADER.pack_into(self._map, self._slot_offset(slot), generation + 1, 0, seq)
+            finally:
+                self._seq_lock(fcntl.LOCK_UN)
+            self._bump_changes()
+            self._changes_seen = self._changes()
+            self._forget(key, seq)
+            return True
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def remove(self, key):
+        """Free a key's slot for every worker"""
+        with self._lock:
+            self._sync()
+            return key in self._buffers and self._evict(key, cutoff=float('inf'))
+
+    @contextmanager
+    def _guard(self, key, exclusive):
+        # Byte-range locks belong to the process, not the thread, so they only keep
+        # other workers out; every caller holds self._lock, which keeps out the other
+        # threads of this worker (and stops them unlocking a range this thread holds)
+        offset = self._slot_offset(self._slots[key])
+        fcntl.lockf(self._fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH, self.slot_size, offset)
+        try:
+            yield
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, self.slot_size, offset)
@@ -0,0 +1,284 @@
+"""
+TimeSeriesDB variant whose unwritten head chunks live in a shared memory-mapped file.
+
+A head chunk holds the readings of the current window until the flusher writes
+it to disk. With several gunicorn workers each one used to keep its own heads,
+so /api/history answered with different recent readings depending on which
+worker served it. Here the heads sit in one file under MAIN_HOST_SHARED_DIR
+that every worker maps:
+
+    header   magic, vitals per reading, capacity, readings per head, slot size,
+             chunk length in ms, slots in use
+    slot     key length, readings held, window start (epoch ms), key (UTF-8),
+             then the timestamps (ms) and one column per vital
+
+Any worker appends to, flushes and reads any head, under a POSIX byte-range
+lock on its slot (and self._lock, since those locks are per process). A flush
+writes the chunk to disk and empties the head under the same exclusive lock,
+and a query reads the chunk files and the head under a shared one, so every
+reading is seen exactly once: on disk or in the head. A head that fills up
+before its window ends is written out early as a chunk of its own.
+
+Slots are allocated under an flock on the whole file and only counted in
+"slots in use" once their key is written. When every slot is taken an empty
+head is reused for another key; workers notice because the key stored in the
+slot no longer matches and look the key up again. If no head is free at all,
+readings go straight to disk as one-reading chunks.
+"""
+
+import fcntl
+import mmap
+import os
+import struct
+from array import array
+from contextlib import contextmanager
+
+from patient_store import VITAL_FIELDS
+from tsdb import CHUNK_SECONDS, DEFAULT_RETENTION_DAYS, NAN, TimeSeriesDB
+
+SHARED_HEADS_FILENAME = 'tsdb_heads.bin'
+
+DEFAULT_HEAD_CAPACITY = 5000
+DEFAULT_HEAD_POINTS = 128
+
+MAGIC = b'TSHEAD01'
+# magic, vitals per reading, capacity, readings per head, slot size, chunk ms, slots in use
+HEADER = struct.Struct('<8sIIIIQQ')
+HEADER_BYTES = 64
+USED_OFFSET = HEADER.size - 8
+
+# key length, readings held, window start (epoch ms); the key follows
+SLOT_HEADER = struct.Struct('<IIq')
+KEY_BYTES = 240
+SLOT_FRONT = SLOT_HEADER.size + KEY_BYTES
+
+
+class SharedTimeSeriesDB(TimeSeriesDB):
+    """TimeSeriesDB whose head chunks are shared by every worker process through heads_path"""
+
+    def __init__(self, root, heads_path, chunk_seconds=CHUNK_SECONDS, retention_days=DEFAULT_RETENTION_DAYS,
+                 capacity=DEFAULT_HEAD_CAPACITY, points=DEFAULT_HEAD_POINTS):
+        super().__init__(root, chunk_seconds=chunk_seconds, retention_days=retention_days)
+        self.heads_path = heads_path
+        self.capacity = capacity
+        self.points = points
+        self.slot_size = SLOT_FRONT + points * array('d').itemsize * (len(VITAL_FIELDS) + 1)
+        self._slots = {}  # key -> slot as last seen by this process; checked under the slot lock
+        self._loaded = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(heads_path)), exist_ok=True)
+        self._fd = os.open(heads_path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            size = HEADER_BYTES + capacity * self.slot_size
+            if os.fstat(self._fd).st_size == 0:
+                os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, HEADER.pack(MAGIC, len(VITAL_FIELDS), capacity, points, self.slot_size,
+                                                self.chunk_ms, 0), 0)
+            self._check_header(size)
+            self._map = mmap.mmap(self._fd, size)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _check_header(self, size):
+        magic, fields, capacity, points, slot_size, chunk_ms, _ = HEADER.unpack(os.pread(self._fd, HEADER.size, 0))
+        expected = (MAGIC, len(VITAL_FIELDS), self.capacity, self.points, self.slot_size, self.chunk_ms)
+        if (magic, fields, capacity, points, slot_size, chunk_ms) != expected or os.fstat(self._fd).st_size != size:
+            raise ValueError(
+                f"{self.heads_path} was created with a different layout "
+                f"(capacity={capacity}, points={points}); remove it or match its settings"
+            )
+
+    def close(self):
+        """Unmap the heads file (the object is unusable afterwards)"""
+        with self._lock:
+            self._map.close()
+            os.close(self._fd)
+
+    def _slot_offset(self, slot):
+        return HEADER_BYTES + slot * self.slot_size
+
+    def _used(self):
+        return struct.unpack_from('<Q', self._map, USED_OFFSET)[0]
+
+    def _slot_header(self, slot):
+        """(key length, readings held, window start) of a slot"""
+        return SLOT_HEADER.unpack_from(self._map, self._slot_offset(slot))
+
+    def _slot_key(self, slot):
+        offset = self._slot_offset(slot)
+        length = SLOT_HEADER.unpack_from(self._map, offset)[0]
+        start = offset + SLOT_HEADER.size
+        return bytes(self._map[start:start + min(length, KEY_BYTES)]).decode('utf-8', errors='replace')
+
+    def _columns(self, slot):
+        """Timestamp column and one column per vital of a slot, as views into the map"""
+        column_bytes = self.points * array('d').itemsize
+        offset = self._slot_offset(slot) + SLOT_FRONT
+        view = memoryview(self._map)
+        timestamps = view[offset:offset + column_bytes].cast('q')
+        columns = []
+        for _ in VITAL_FIELDS:
+            offset += column_bytes
+            columns.append(view[offset:offset + column_bytes].cast('d'))
+        return timestamps, columns
+
+    @contextmanager
+    def _slot_lock(self, slot, exclusive):
+        # Per process like the patient store's; the caller holds self._lock
+        offset = self._slot_offset(slot)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH, self.slot_size, offset)
+        try:
+            yield
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, self.slot_size, offset)
+
+    def _scan(self, full=False):
+        """Learn the keys of slots added by other workers (of every slot when full is set)"""
+        if full:
+            self._slots.clear()
+            self._loaded = 0
+        used = self._used()
+        for slot in range(self._loaded, used):
+            if self._slot_header(slot)[0]:
+                self._slots[self._slot_key(slot)] = slot
+        self._loaded = max(self._loaded, used)
+
+    def _find(self, key):
+        """Slot that last held key's head, or None; the caller holds self._lock"""
+        slot = self._slots.get(key)
+        if slot is None:
+            self._scan()
+            slot = self._slots.get(key)
+        if slot is None and self._used() >= self.capacity:
+            # Slots are reused once all are taken, so the key may sit in an older one
+            self._scan(full=True)
+            slot = self._slots.get(key)
+        return slot
+
+    def _allocate(self, key, encoded):
+        """Slot for a key seen for the first time, or None when every head is in use"""
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            # Another worker may have added this key while we waited for the lock
+            slot = self._find(key)
+            if slot is not None:
+                return slot
+            used = self._used()
+            if used < self.capacity:
+                slot = used
+                self._write_key(slot, encoded)
+                # Counted only now, so no worker scans the slot before its key is there
+                struct.pack_into('<Q', self._map, USED_OFFSET, used + 1)
+                self._loaded = max(self._loaded, used + 1)
+            else:
+                slot = self._reuse(encoded)
+                if slot is None:
+                    return None
+                self._slots = {known: index for known, index in self._slots.items() if index != slot}
+            self._slots[key] = slot
+            return slot
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _reuse(self, encoded):
+        for slot in range(self.capacity):
+            if self._slot_header(slot)[1]:
+                continue
+            with self._slot_lock(slot, exclusive=True):
+                if not self._slot_header(slot)[1]:
+                    self._write_key(slot, encoded)
+                    return slot
+        return None
+
+    def _write_key(self, slot, encoded):
+        offset = self._slot_offset(slot)
+        start = offset + SLOT_HEADER.size
+        self._map[start:start + len(encoded)] = encoded
+        SLOT_HEADER.pack_into(self._map, offset, len(encoded), 0, 0)
+
+    def _write_slot(self, key, slot, count, window_start):
+        """Write a slot's readings to disk as one chunk; the caller holds its lock exclusively"""
+        timestamps, columns = self._columns(slot)
+        self._write_chunk(key, window_start, timestamps[:count].tolist(), [c[:count].tolist() for c in columns])
+
+    def append(self, key, timestamp, data):
+        timestamp_ms = int(round(timestamp * 1000))
+        window_start = timestamp_ms - timestamp_ms % self.chunk_ms
+        encoded = key.encode('utf-8')
+        if len(encoded) > KEY_BYTES:
+            raise ValueError("hospital/dept/ward/patient labels are too long for the shared history heads")
+        with self._lock:
+            # A second try after the slot turned out to be reused for another key
+            for _ in range(2):
+                slot = self._find(key)
+                if slot is None:
+                    slot = self._allocate(key, encoded)
+                if slot is None:
+                    values = [[NAN if data.get(field) is None else float(data[field])] for field in VITAL_FIELDS]
+                    self._write_chunk(key, window_start, [timestamp_ms], values)
+                    return
+                with self._slot_lock(slot, exclusive=True):
+                    if self._slot_key(slot) != key:
+                        del self._slots[key]
+                        continue
+                    length, count, head_window = self._slot_header(slot)
+                    if count and (head_window != window_start or count >= self.points):
+                        self._write_slot(key, slot, count, head_window)
+                        count = 0
+                    timestamps, columns = self._columns(slot)
+                    timestamps[count] = timestamp_ms
+                    for field, column in zip(VITAL_FIELDS, columns):
+                        value = data.get(field)
+                        column[count] = NAN if value is None else float(value)
+                    # Counting the reading last publishes it to readers
+                    SLOT_HEADER.pack_into(self._map, self._slot_offset(slot), length, count + 1, window_start)
+                    return
+            raise RuntimeError(f"no shared history head for {key}")
+
+    def flush(self, now=None):
+        """Write out the heads of windows that have ended, whichever worker filled them"""
+        cutoff = None if now is None else int(now * 1000) - self.chunk_ms
+        written = 0
+        with self._lock:
+            for slot in range(self._used()):
+                _, count, window_start = self._slot_header(slot)
+                if not count or (cutoff is not None and window_start > cutoff):
+                    continue
+                with self._slot_lock(slot, exclusive=True):
+                    length, count, window_start = self._slot_header(slot)
+                    if count and (cutoff is None or window_start <= cutoff):
+                        self._write_slot(self._slot_key(slot), slot, count, window_start)
+                        SLOT_HEADER.pack_into(self._map, self._slot_offset(slot), length, 0, window_start)
+                        written += 1
+        return written
+
+    def _head_keys(self):
+        keys = []
+        with self._lock:
+            for slot in range(self._used()):
+                if not self._slot_header(slot)[1]:
+                    continue
+                with self._slot_lock(slot, exclusive=False):
+                    if self._slot_header(slot)[1]:
+                        keys.append(self._slot_key(slot))
+        return keys
+
+    def _snapshot(self, key, start, end):
+        with self._lock:
+            for _ in range(2):
+                slot = self._find(key)
+                if slot is None:
+                    break
+                with self._slot_lock(slot, exclusive=False):
+                    if self._slot_key(slot) != key:
+                        del self._slots[key]
+                        continue
+                    # Chunk files and head under one lock: a flush moves readings from one to the other
+                    chunks = self._stored_chunks(key, start, end)
+                    _, count, _ = self._slot_header(slot)
+                    if not count:
+                        return chunks, None
+                    timestamps, columns = self._columns(slot)
+                    return chunks, (timestamps[:count].tolist(), [c[:count].tolist() for c in columns])
+            return self._stored_chunks(key, start, end), None
@@ -0,0 +1,10 @@
+#!/bin/sh
+# Starts main_host on the Flask development server, or on gunicorn workers with MAIN_HOST_SERVER=gunicorn
+
+if [ "${MAIN_HOST_SERVER:-flask}" = "gunicorn" ]; then
+    echo "🚀 Starting main_host on gunicorn (${MAIN_HOST_WORKERS:-one per CPU} workers)..."
+    exec gunicorn -c gunicorn.conf.py app:app
+fi
+
+echo "🌐 Starting main_host on the Flask development server..."
+exec python app.py
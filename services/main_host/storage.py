@@ -0,0 +1,52 @@
+"""
+Where main_host keeps patient data, configured from the environment.
+
+Shared by app.py (every worker) and gunicorn.conf.py (the master, which
+recovers the store once before any worker starts).
+"""
+
+import os
+
+from patient_store import PatientStore, DEFAULT_DEPTH
+from shared_store import SharedPatientStore, SHARED_STORE_FILENAME, DEFAULT_CAPACITY
+from shared_tsdb import SharedTimeSeriesDB, SHARED_HEADS_FILENAME, DEFAULT_HEAD_POINTS
+from tsdb import TimeSeriesDB, DEFAULT_RETENTION_DAYS
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+def create_patient_store():
+    """Private ring buffers for one process, or a shared memory map when MAIN_HOST_SHARED_DIR is set"""
+    depth = int(os.environ.get('PATIENT_HISTORY_DEPTH', DEFAULT_DEPTH))
+    shared_dir = os.environ.get('MAIN_HOST_SHARED_DIR')
+    if shared_dir:
+        return SharedPatientStore(
+            os.path.join(shared_dir, SHARED_STORE_FILENAME), depth=depth,
+            capacity=int(os.environ.get('MAIN_HOST_MAX_PATIENTS', DEFAULT_CAPACITY)),
+        )
+    return PatientStore(depth=depth)
+
+
+def create_tsdb():
+    """Compressed on-disk history under TSDB_DIR (an empty TSDB_DIR turns it off)
+
+    With MAIN_HOST_SHARED_DIR set the chunks not yet on disk are shared by
+    every worker too, so each one answers history queries with the same data.
+    """
+    root = os.environ.get('TSDB_DIR', os.path.join(DATA_DIR, 'tsdb'))
+    if not root:
+        return None
+    retention_days = float(os.environ.get('TSDB_RETENTION_DAYS', DEFAULT_RETENTION_DAYS))
+    shared_dir = os.environ.get('MAIN_HOST_SHARED_DIR')
+    if shared_dir:
+        return SharedTimeSeriesDB(
+            root, os.path.join(shared_dir, SHARED_HEADS_FILENAME), retention_days=retention_days,
+            capacity=int(os.environ.get('MAIN_HOST_MAX_PATIENTS', DEFAULT_CAPACITY)),
+            points=int(os.environ.get('TSDB_HEAD_POINTS', DEFAULT_HEAD_POINTS)),
+        )
+    return TimeSeriesDB(root, retention_days=retention_days)
+
+
+def wal_dir():
+    """Directory of the write-ahead log and snapshots (an empty WAL_DIR turns them off)"""
+    return os.environ.get('WAL_DIR', os.path.join(DATA_DIR, 'wal'))
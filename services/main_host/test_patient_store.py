@@ -0,0 +1,65 @@
+"""
+Checks for PatientStore.changes_since cursors.
+
+Run from services/main_host with:
+    python -m unittest test_patient_store
+"""
+
+import unittest
+
+from patient_store import PatientStore
+
+
+def reading(patient, heart_rate):
+    return {'hospital': '1', 'dept': 'A', 'ward': '1', 'patient': patient, 'heart_rate': heart_rate}
+
+
+class ChangesSinceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = PatientStore(depth=4)
+        self.store.append('1|A|1|1', reading('1', 70))
+        self.store.append('1|A|1|2', reading('2', 80))
+
+    def test_cursor_returns_only_later_changes(self):
+        cursor = self.store.current_seq()
+        self.store.append('1|A|1|2', reading('2', 85))
+        seq, changed, removed = self.store.changes_since(cursor)
+        self.assertEqual(seq, cursor + 1)
+        self.assertEqual(changed, ['1|A|1|2'])
+        self.assertEqual(removed, [])
+
+    def test_removal_is_reported(self):
+        cursor = self.store.current_seq()
+        self.store.remove('1|A|1|1')
+        _, changed, removed = self.store.changes_since(cursor)
+        self.assertEqual(changed, [])
+        self.assertEqual(removed, ['1|A|1|1'])
+
+    def test_cursor_ahead_of_store_asks_for_full_snapshot(self):
+        # e.g. a dashboard still holding a cursor from before main_host restarted without its WAL
+        seq, changed, removed = self.store.changes_since(99999)
+        self.assertEqual(seq, 2)
+        self.assertIsNone(removed)
+
+    def test_cursor_before_recovery_asks_for_full_snapshot(self):
+        self.store.advance_seq(100)
+        _, _, removed = self.store.changes_since(50)
+        self.assertIsNone(removed)
+
+
+class VersionsTest(unittest.TestCase):
+
+    def test_recreated_key_gets_a_new_version(self):
+        # The exposition cache is keyed on versions(); a key evicted and seen again
+        # between two scrapes must not look unchanged
+        store = PatientStore(depth=4)
+        store.append('1|A|1|1', reading('1', 70))
+        before = store.versions()['1|A|1|1']
+        store.remove('1|A|1|1')
+        store.append('1|A|1|1', reading('1', 140))
+        self.assertNotEqual(store.versions()['1|A|1|1'], before)
+
+
+if __name__ == '__main__':
+    unittest.main()
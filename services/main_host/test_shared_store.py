@@ -0,0 +1,73 @@
+"""
+Checks for SharedPatientStore with several processes mapping the same file.
+
+Run from services/main_host with:
+    python -m unittest test_shared_store
+"""
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+import shared_store
+from shared_store import SharedPatientStore
+
+KEY = '1|A|1|1'
+
+
+def reading(heart_rate):
+    return {'hospital': '1', 'dept': 'A', 'ward': '1', 'patient': '1', 'heart_rate': heart_rate}
+
+
+def allocate_paused(path, allocating, synced):
+    """Add KEY, stopping halfway through setting up its slot until the other process has synced"""
+
+    class PausedRingBuffer(shared_store.PatientRingBuffer):
+        def clear(self):
+            allocating.set()
+            synced.wait(10)
+            super().clear()
+
+    shared_store.PatientRingBuffer = PausedRingBuffer
+    store = SharedPatientStore(path, depth=4, capacity=8)
+    store.append(KEY, reading(70))
+    store.close()
+
+
+class SlotAllocationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'store.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_sync_during_allocation_still_loads_the_slot(self):
+        # Opened first: opening takes the flock the writer holds while it allocates
+        store = SharedPatientStore(self.path, depth=4, capacity=8)
+        context = multiprocessing.get_context('fork')
+        allocating, synced = context.Event(), context.Event()
+        writer = context.Process(target=allocate_paused, args=(self.path, allocating, synced))
+        writer.start()
+        try:
+            self.assertTrue(allocating.wait(10))
+            # The slot is being written; this sync must not skip past it
+            self.assertEqual(store.keys(), [])
+        finally:
+            synced.set()
+            writer.join(10)
+        self.assertEqual(writer.exitcode, 0)
+
+        self.assertEqual(store.keys(), [KEY])
+        self.assertEqual(store.latest(KEY)['heart_rate'], 70)
+        # Both processes use the one slot for the key
+        store.append(KEY, reading(75))
+        self.assertEqual(store._used(), 1)
+        store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+"""
+Checks for SharedTimeSeriesDB with several processes sharing the head chunks.
+
+Run from services/main_host with:
+    python -m unittest test_shared_tsdb
+"""
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+from shared_tsdb import SharedTimeSeriesDB
+
+KEY = '1|A|1|1'
+# Start of a one-minute window
+WINDOW = 1_700_000_040
+
+
+def open_db(directory):
+    return SharedTimeSeriesDB(os.path.join(directory, 'tsdb'), os.path.join(directory, 'heads.bin'),
+                              capacity=8, points=16)
+
+
+def append_readings(directory, first, count):
+    """Worker process: append count readings one second apart, without flushing"""
+    db = open_db(directory)
+    for i in range(first, first + count):
+        db.append(KEY, WINDOW + i, {'heart_rate': 60 + i})
+    db.close()
+
+
+class SharedHeadsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.db = open_db(self.directory)
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def run_worker(self, first, count):
+        context = multiprocessing.get_context('fork')
+        worker = context.Process(target=append_readings, args=(self.directory, first, count))
+        worker.start()
+        worker.join(10)
+        self.assertEqual(worker.exitcode, 0)
+
+    def heart_rates(self):
+        return [reading['heart_rate'] for reading in self.db.query(KEY, WINDOW - 60, WINDOW + 120)]
+
+    def test_unflushed_readings_of_other_workers_are_visible(self):
+        self.run_worker(0, 5)
+        self.db.append(KEY, WINDOW + 5, {'heart_rate': 65})
+        self.run_worker(6, 4)
+        self.assertEqual(self.db.keys(WINDOW - 60, WINDOW + 120), [KEY])
+        self.assertEqual(self.heart_rates(), [60 + i for i in range(10)])
+
+    def test_flush_moves_readings_to_disk_once(self):
+        self.run_worker(0, 5)
+        # Any worker writes out the heads of ended windows, including other workers' readings
+        self.assertEqual(self.db.flush(WINDOW + 120), 1)
+        self.assertEqual(self.db.flush(WINDOW + 120), 0)
+        self.assertEqual(self.heart_rates(), [60 + i for i in range(5)])
+        self.assertEqual(self.db.query(KEY, WINDOW - 60, WINDOW + 120, step=60)[0]['count'], 5)
+
+    def test_full_head_is_written_early(self):
+        self.run_worker(0, 20)
+        self.assertEqual(self.heart_rates(), [60 + i for i in range(20)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,537 @@
+"""
+Append-only, compressed time-series history for patient vitals.
+
+The ring buffers in patient_store.py only hold the last readings of each
+patient. Everything is also written here, so days of history survive restarts.
+
+Readings are grouped into chunks, one per patient and aligned CHUNK_SECONDS
+window. Inside a chunk the timestamps are delta-of-delta encoded and every
+vital is XOR encoded against its previous value (the Gorilla scheme), so a
+steady vital costs a few bits per reading. Each chunk header also stores the
+count, sum, min and max of every vital. Downsampled queries merge those
+summaries and only decode the chunks at the edges of the requested range.
+
+Chunks are appended to one file per patient and UTC day:
+
+    <root>/2025-01-01/1%7C1%7C1%7C4.chunks
+
+Retention deletes whole day directories.
+"""
+
+import math
+import os
+import shutil
+import struct
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote, unquote
+
+from patient_store import VITAL_FIELDS, format_timestamp
+
+CHUNK_SECONDS = 60
+DEFAULT_RETENTION_DAYS = 7
+CHUNK_FILE_SUFFIX = '.chunks'
+
+# Per-file chunk indexes kept in memory for queries
+MAX_CACHED_INDEXES = 512
+
+CHUNK_MAGIC = b'GCK1'
+# magic, points, vitals, window start ms, first timestamp ms, last timestamp ms, payload bytes
+CHUNK_HEADER = struct.Struct('<4sHHqqqI')
+# count, sum, min, max of one vital over a chunk (NaN readings are not counted)
+FIELD_SUMMARY = struct.Struct('<Iddd')
+# Length of the whole record, repeated at its end so a file can be read backwards
+CHUNK_TRAILER = struct.Struct('<I')
+
+AGGREGATIONS = ('mean', 'min', 'max')
+
+NAN = float('nan')
+_DOUBLE = struct.Struct('<d')
+_BITS = struct.Struct('<Q')
+
+# Delta-of-delta tiers after the '0' (unchanged) case: (prefix, prefix bits, value bits)
+_DOD_TIERS = ((0b10, 2, 7), (0b110, 3, 9), (0b1110, 4, 12), (0b1111, 4, 64))
+
+
+def float_to_bits(value):
+    return _BITS.unpack(_DOUBLE.pack(value))[0]
+
+
+def bits_to_float(bits):
+    return _DOUBLE.unpack(_BITS.pack(bits))[0]
+
+
+class BitWriter:
+    """Big-endian bit stream, flushed to bytes every 64 bits"""
+
+    def __init__(self):
+        self._bytes = bytearray()
+        self._acc = 0
+        self._nbits = 0
+
+    def write(self, value, nbits):
+        self._acc = (self._acc << nbits) | (value & ((1 << nbits) - 1))
+        self._nbits += nbits
+        if self._nbits >= 64:
+            keep = self._nbits % 8
+            self._bytes += (self._acc >> keep).to_bytes((self._nbits - keep) // 8, 'big')
+            self._acc &= (1 << keep) - 1
+            self._nbits = keep
+
+    def getvalue(self):
+        pad = -self._nbits % 8
+        return bytes(self._bytes) + (self._acc << pad).to_bytes((self._nbits + pad) // 8, 'big')
+
+
+class BitReader:
+    """Reads what BitWriter wrote; each read touches at most 9 bytes"""
+
+    def __init__(self, data):
+        self._data = bytes(data) + bytes(9)
+        self._pos = 0
+
+    def read(self, nbits):
+        if nbits == 0:
+            return 0
+        start, offset = self._pos >> 3, self._pos & 7
+        span = (offset + nbits + 7) >> 3
+        word = int.from_bytes(self._data[start:start + span], 'big')
+        self._pos += nbits
+        return (word >> (span * 8 - offset - nbits)) & ((1 << nbits) - 1)
+
+
+def encode_timestamps(writer, timestamps):
+    """First timestamp in full, then delta-of-deltas in the smallest tier that fits"""
+    writer.write(timestamps[0], 64)
+    previous, delta = timestamps[0], 0
+    for timestamp in timestamps[1:]:
+        new_delta = timestamp - previous
+        dod = new_delta - delta
+        previous, delta = timestamp, new_delta
+        if dod == 0:
+            writer.write(0, 1)
+            continue
+        for prefix, prefix_bits, value_bits in _DOD_TIERS:
+            if -(1 << (value_bits - 1)) <= dod < (1 << (value_bits - 1)):
+                writer.write(prefix, prefix_bits)
+                writer.write(dod, value_bits)
+                break
+
+
+def decode_timestamps(reader, count):
+    timestamp = reader.read(64)
+    if timestamp >= 1 << 63:
+        timestamp -= 1 << 64
+    timestamps, delta = [timestamp], 0
+    for _ in range(count - 1):
+        ones = 0
+        while ones < 4 and reader.read(1):
+            ones += 1
+        if ones:
+            value_bits = _DOD_TIERS[ones - 1][2]
+            dod = reader.read(value_bits)
+            if dod >= 1 << (value_bits - 1):
+                dod -= 1 << value_bits
+            delta += dod
+        timestamp += delta
+        timestamps.append(timestamp)
+    return timestamps
+
+
+def encode_floats(writer, values):
+    """First value in full, then each value XORed with the previous one
+
+    '0' repeats the previous value; '10' reuses the previous window of
+    meaningful bits; '11' starts a new window (5 bits of leading zeros, 6 bits
+    of length).
+    """
+    previous = float_to_bits(values[0])
+    writer.write(previous, 64)
+    leading = trailing = -1
+    for value in values[1:]:
+        bits = float_to_bits(value)
+        xor = bits ^ previous
+        previous = bits
+        if xor == 0:
+            writer.write(0, 1)
+            continue
+        new_leading = min(64 - xor.bit_length(), 31)
+        new_trailing = (xor & -xor).bit_length() - 1
+        if leading >= 0 and new_leading >= leading and new_trailing >= trailing:
+            writer.write(0b10, 2)
+            writer.write(xor >> trailing, 64 - leading - trailing)
+        else:
+            leading, trailing = new_leading, new_trailing
+            meaningful = 64 - leading - trailing
+            writer.write(0b11, 2)
+            writer.write(leading, 5)
+            writer.write(meaningful & 63, 6)  # 64 meaningful bits is written as 0
+            writer.write(xor >> trailing, meaningful)
+
+
+def decode_floats(reader, count):
+    previous = reader.read(64)
+    values = [bits_to_float(previous)]
+    leading = trailing = 0
+    for _ in range(count - 1):
+        if reader.read(1):
+            if reader.read(1):
+                leading = reader.read(5)
+                meaningful = reader.read(6) or 64
+                trailing = 64 - leading - meaningful
+            previous ^= reader.read(64 - leading - trailing) << trailing
+        values.append(bits_to_float(previous))
+    return values
+
+
+def summarize(values):
+    """(count, sum, min, max) of the non-NaN values"""
+    present = [value for value in values if not math.isnan(value)]
+    if not present:
+        return 0, 0.0, NAN, NAN
+    return len(present), math.fsum(present), min(present), max(present)
+
+
+def encode_chunk(window_start, timestamps, columns):
+    """One chunk record: header, a summary per vital, the compressed payload and the record length"""
+    writer = BitWriter()
+    encode_timestamps(writer, timestamps)
+    for values in columns:
+        encode_floats(writer, values)
+    payload = writer.getvalue()
+    header = CHUNK_HEADER.pack(CHUNK_MAGIC, len(timestamps), len(columns), window_start,
+                               min(timestamps), max(timestamps), len(payload))
+    summaries = b''.join(FIELD_SUMMARY.pack(*summarize(values)) for values in columns)
+    record = header + summaries + payload
+    return record + CHUNK_TRAILER.pack(len(record) + CHUNK_TRAILER.size)
+
+
+def decode_payload(payload, count, fields):
+    reader = BitReader(payload)
+    timestamps = decode_timestamps(reader, count)
+    return timestamps, [decode_floats(reader, count) for _ in range(fields)]
+
+
+class ChunkInfo:
+    """Where one chunk is and what its header says; the payload is read on demand"""
+
+    __slots__ = ('path', 'offset', 'count', 'fields', 'window_start', 'first', 'last',
+                 'summaries', 'payload_len')
+
+    def __init__(self, path, offset, count, fields, window_start, first, last, summaries, payload_len):
+        self.path = path
+        self.offset = offset
+        self.count = count
+        self.fields = fields
+        self.window_start = window_start
+        self.first = first
+        self.last = last
+        self.summaries = summaries
+        self.payload_len = payload_len
+
+    @property
+    def payload_offset(self):
+        return self.offset + CHUNK_HEADER.size + self.fields * FIELD_SUMMARY.size
+
+    def field_summaries(self):
+        return [FIELD_SUMMARY.unpack_from(self.summaries, i * FIELD_SUMMARY.size) for i in range(self.fields)]
+
+
+class FileIndex:
+    """Chunk headers of one file, extended as the file grows (other workers append too)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.size = 0
+        self.chunks = []
+
+    def refresh(self):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = 0
+        if size < self.size:
+            # Rewritten or deleted: start over
+            self.size, self.chunks = 0, []
+        if size == self.size:
+            return self.chunks
+        with open(self.path, 'rb') as f:
+            f.seek(self.size)
+            data = f.read(size - self.size)
+        position = 0
+        while position + CHUNK_HEADER.size <= len(data):
+            magic, count, fields, window_start, first, last, payload_len = CHUNK_HEADER.unpack_from(data, position)
+            if magic != CHUNK_MAGIC:
+                break
+            end = position + CHUNK_HEADER.size + fields * FIELD_SUMMARY.size + payload_len + CHUNK_TRAILER.size
+            if end > len(data):
+                # Record still being written by another process; pick it up next time
+                break
+            summaries = data[position + CHUNK_HEADER.size:end - payload_len - CHUNK_TRAILER.size]
+            self.chunks.append(ChunkInfo(self.path, self.size + position, count, fields, window_start,
+                                         first, last, summaries, payload_len))
+            position = end
+        self.size += position
+        return self.chunks
+
+
+class HeadChunk:
+    """Readings of the current window for one patient, not yet written to disk"""
+
+    def __init__(self, window_start):
+        self.window_start = window_start
+        self.timestamps = []
+        self.columns = [[] for _ in VITAL_FIELDS]
+
+    def append(self, timestamp_ms, data):
+        self.timestamps.append(timestamp_ms)
+        for field, column in zip(VITAL_FIELDS, self.columns):
+            value = data.get(field)
+            column.append(NAN if value is None else float(value))
+
+
+class TimeSeriesDB:
+    """Per-patient compressed history on disk with range queries and downsampling"""
+
+    def __init__(self, root, chunk_seconds=CHUNK_SECONDS, retention_days=DEFAULT_RETENTION_DAYS):
+        self.root = root
+        self.chunk_ms = int(chunk_seconds * 1000)
+        self.retention_days = retention_days
+        os.makedirs(root, exist_ok=True)
+        self._heads = {}
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, key, window_start):
+        day = datetime.fromtimestamp(window_start / 1000, timezone.utc).strftime('%Y-%m-%d')
+        return os.path.join(self.root, day, quote(key, safe='') + CHUNK_FILE_SUFFIX)
+
+    def append(self, key, timestamp, data):
+        """Record one reading (timestamp in epoch seconds)"""
+        timestamp_ms = int(round(timestamp * 1000))
+        window_start = timestamp_ms - timestamp_ms % self.chunk_ms
+        with self._lock:
+            head = self._heads.get(key)
+            if head is not None and head.window_start != window_start:
+                self._write_head(key, self._heads.pop(key))
+                head = None
+            if head is None:
+                head = self._heads[key] = HeadChunk(window_start)
+            head.append(timestamp_ms, data)
+
+    def flush(self, now=None):
+        """Write out the head chunks of windows that have ended (all of them when now is None)"""
+        cutoff = None if now is None else int(now * 1000) - self.chunk_ms
+        with self._lock:
+            done = [key for key, head in self._heads.items() if cutoff is None or head.window_start <= cutoff]
+            for key in done:
+                self._write_head(key, self._heads.pop(key))
+        return len(done)
+
+    def close(self):
+        """Release the head storage; private heads need nothing (write them out with flush first)"""
+
+    def _write_head(self, key, head):
+        self._write_chunk(key, head.window_start, head.timestamps, head.columns)
+
+    def _write_chunk(self, key, window_start, timestamps, columns):
+        path = self._path(key, window_start)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        record = encode_chunk(window_start, timestamps, columns)
+        # One write() on an O_APPEND file, so records from several workers never interleave
+        with open(path, 'ab') as f:
+            f.write(record)
+
+    def _file_chunks(self, path):
+        index = self._indexes.pop(path, None) or FileIndex(path)
+        self._indexes[path] = index
+        while len(self._indexes) > MAX_CACHED_INDEXES:
+            self._indexes.popitem(last=False)
+        return index.refresh()
+
+    def _days(self, start, end):
+        day = datetime.fromtimestamp(start / 1000, timezone.utc).date()
+        last_day = datetime.fromtimestamp(end / 1000, timezone.utc).date()
+        while day <= last_day:
+            yield day.isoformat()
+            day += timedelta(days=1)
+
+    def keys(self, start, end):
+        """Keys with history between start and end (epoch seconds), including unwritten chunks"""
+        found = set()
+        for day in self._days(int(start * 1000), int(end * 1000)):
+            try:
+                names = os.listdir(os.path.join(self.root, day))
+            except OSError:
+                continue
+            found.update(unquote(name[:-len(CHUNK_FILE_SUFFIX)]) for name in names
+                         if name.endswith(CHUNK_FILE_SUFFIX))
+        found.update(self._head_keys())
+        return sorted(found)
+
+    def _head_keys(self):
+        """Keys with readings not yet written to disk"""
+        with self._lock:
+            return list(self._heads)
+
+    def _stored_chunks(self, key, start, end):
+        """Chunks of a key on disk that overlap [start, end] (epoch ms); the caller holds self._lock"""
+        chunks = []
+        for day in self._days(start, end):
+            path = os.path.join(self.root, day, quote(key, safe='') + CHUNK_FILE_SUFFIX)
+            chunks.extend(chunk for chunk in self._file_chunks(path) if chunk.last >= start and chunk.first <= end)
+        return chunks
+
+    def _snapshot(self, key, start, end):
+        """(stored chunks overlapping [start, end] in epoch ms, (timestamps, columns) of the head or None)"""
+        with self._lock:
+            chunks = self._stored_chunks(key, start, end)
+            head = self._heads.get(key)
+            return chunks, None if head is None else (list(head.timestamps), [list(c) for c in head.columns])
+
+    def last_persisted(self, key, since, now=None, tail_chunks=8):
+        """Timestamp (epoch seconds) of the newest reading of a key on disk since `since`, or None
+
+        Only the last tail_chunks records of the newest day file are read
+        (walking back over their trailers), enough to cover the chunks several
+        workers flush at the end of the same window.
+        """
+        end = int((time.time() if now is None else now) * 1000)
+        for day in reversed(list(self._days(int(since * 1000), end))):
+            path = os.path.join(self.root, day, quote(key, safe='') + CHUNK_FILE_SUFFIX)
+            try:
+                f = open(path, 'rb')
+            except OSError:
+                continue
+            with f:
+                position = f.seek(0, os.SEEK_END)
+                newest = None
+                for _ in range(tail_chunks):
+                    if position < CHUNK_HEADER.size + CHUNK_TRAILER.size:
+                        break
+                    f.seek(position - CHUNK_TRAILER.size)
+                    length, = CHUNK_TRAILER.unpack(f.read(CHUNK_TRAILER.size))
+                    position -= length
+                    f.seek(position)
+                    magic, _, _, _, _, last, _ = CHUNK_HEADER.unpack(f.read(CHUNK_HEADER.size))
+                    if magic != CHUNK_MAGIC:
+                        break
+                    newest = last if newest is None else max(newest, last)
+                if newest is not None:
+                    return newest / 1000
+        return None
+
+    @staticmethod
+    def _read_points(chunk):
+        with open(chunk.path, 'rb') as f:
+            f.seek(chunk.payload_offset)
+            payload = f.read(chunk.payload_len)
+        return decode_payload(payload, chunk.count, chunk.fields)
+
+    def query(self, key, start, end, step=0, agg='mean'):
+        """Readings of a key between start and end (epoch seconds), oldest first
+
+        With step > 0 readings are grouped into step-second buckets (aligned to
+        the epoch) and each vital is aggregated (mean, min or max) per bucket.
+        Chunks that fall inside one bucket are merged from their header
+        summaries without decoding, which is every chunk when step is a
+        multiple of CHUNK_SECONDS.
+        """
+        if agg not in AGGREGATIONS:
+            raise ValueError(f"agg must be one of {', '.join(AGGREGATIONS)}")
+        start_ms, end_ms = int(start * 1000), int(end * 1000)
+        step_ms = int(step * 1000)
+        chunks, head_points = self._snapshot(key, start_ms, end_ms)
+
+        if step_ms <= 0:
+            points = []
+            for timestamps, columns in self._decoded(chunks, head_points):
+                for i, timestamp in enumerate(timestamps):
+                    if start_ms <= timestamp <= end_ms:
+                        points.append((timestamp, [column[i] for column in columns]))
+            points.sort(key=lambda point: point[0])
+            return [self._reading(timestamp, values) for timestamp, values in points]
+
+        buckets = {}
+        decode = []
+        for chunk in chunks:
+            bucket = chunk.first - chunk.first % step_ms
+            if chunk.first >= start_ms and chunk.last <= end_ms and chunk.last < bucket + step_ms:
+                self._merge(buckets, bucket, chunk.count, chunk.field_summaries())
+            else:
+                decode.append(chunk)
+        for timestamps, columns in self._decoded(decode, head_points):
+            for i, timestamp in enumerate(timestamps):
+                if start_ms <= timestamp <= end_ms:
+                    bucket = timestamp - timestamp % step_ms
+                    self._merge(buckets, bucket, 1, [summarize((column[i],)) for column in columns])
+        return [self._aggregate(bucket, buckets[bucket], agg) for bucket in sorted(buckets)]
+
+    def _decoded(self, chunks, head_points):
+        for chunk in chunks:
+            yield self._read_points(chunk)
+        if head_points is not None:
+            yield head_points
+
+    @staticmethod
+    def _merge(buckets, bucket, count, summaries):
+        entry = buckets.get(bucket)
+        if entry is None:
+            entry = buckets[bucket] = [0, [[0, 0.0, math.inf, -math.inf] for _ in VITAL_FIELDS]]
+        entry[0] += count
+        for totals, (n, total, low, high) in zip(entry[1], summaries):
+            if n:
+                totals[0] += n
+                totals[1] += total
+                totals[2] = min(totals[2], low)
+                totals[3] = max(totals[3], high)
+
+    @staticmethod
+    def _aggregate(bucket, entry, agg):
+        reading = {'timestamp': format_timestamp(bucket / 1000), 'count': entry[0]}
+        for field, (n, total, low, high) in zip(VITAL_FIELDS, entry[1]):
+            if not n:
+                reading[field] = None
+            elif agg == 'mean':
+                reading[field] = total / n
+            else:
+                reading[field] = low if agg == 'min' else high
+        return reading
+
+    @staticmethod
+    def _reading(timestamp, values):
+        reading = {'timestamp': format_timestamp(timestamp / 1000)}
+        for field, value in zip(VITAL_FIELDS, values):
+            reading[field] = None if math.isnan(value) else value
+        return reading
+
+    def apply_retention(self, now=None):
+        """Delete day directories older than retention_days and return their names"""
+        if self.retention_days <= 0:
+            return []
+        oldest = (datetime.fromtimestamp(time.time() if now is None else now, timezone.utc).date()
+                  - timedelta(days=self.retention_days))
+        removed = []
+        for name in sorted(os.listdir(self.root)):
+            try:
+                day = datetime.strptime(name, '%Y-%m-%d').date()
+            except ValueError:
+                continue
+            if day < oldest:
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+                removed.append(name)
+        if removed:
+            with self._lock:
+                prefixes = tuple(os.path.join(self.root, name) + os.sep for name in removed)
+                for path in [path for path in self._indexes if path.startswith(prefixes)]:
+                    del self._indexes[path]
+        return removed
+
+    def disk_usage(self):
+        """Total bytes of chunk files under the root"""
+        total = 0
+        for directory, _, files in os.walk(self.root):
+            total += sum(os.path.getsize(os.path.join(directory, name)) for name in files)
+        return total
@@ -0,0 +1,378 @@
+"""
+Write-ahead log and snapshots, so main_host restarts with its patient store intact.
+
+Every stored reading is appended to a log segment together with the store
+sequence number it got. Appends go to the page cache and a background thread
+fsyncs them every WAL_FSYNC_SECONDS, so many readings share one fsync. Each
+process writes its own segments:
+
+    wal-<pid>-<n>.open                  segment still being written
+    wal-<pid>-<n>-<last seq>.log        closed segment (rotated by size or age)
+
+Every WAL_SNAPSHOT_SECONDS one process writes snapshot.bin: the raw bytes of
+every ring buffer, plus the sequence number up to which it covers the log.
+Closed segments that end at or before that cut are deleted; the open segment of
+a worker that died is closed first, so it goes too. A restart loads the
+snapshot and replays only the records after the cut, so recovery takes about
+as long as loading one snapshot and at most two snapshot intervals of log,
+however long the process had been running.
+"""
+
+import fcntl
+import glob
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+
+from patient_store import LABEL_FIELDS, PatientRingBuffer, VITAL_FIELDS, parse_timestamp
+
+logger = logging.getLogger('main_host')
+
+DEFAULT_FSYNC_SECONDS = 0.1
+DEFAULT_SNAPSHOT_SECONDS = 60
+DEFAULT_SEGMENT_BYTES = 64 * 1024 * 1024
+
+SNAPSHOT_FILENAME = 'snapshot.bin'
+SNAPSHOT_LOCK_FILENAME = 'snapshot.lock'
+
+# payload length, crc32 of the payload, store seq; the payload is JSON [key, reading]
+RECORD = struct.Struct('<IIQ')
+
+SNAPSHOT_MAGIC = b'PSNAP001'
+# magic, ring depth, vitals per reading, seq cut, patients
+SNAPSHOT_HEADER = struct.Struct('<8sIIQQ')
+# label JSON length, seq of the patient's latest reading, ring bytes
+SNAPSHOT_ENTRY = struct.Struct('<IQI')
+
+
+class WriteAheadLog:
+    """Append-only log of this process's readings, fsynced in batches"""
+
+    def __init__(self, directory, fsync_seconds=DEFAULT_FSYNC_SECONDS,
+                 segment_bytes=DEFAULT_SEGMENT_BYTES, segment_seconds=DEFAULT_SNAPSHOT_SECONDS):
+        self.directory = directory
+        self.fsync_seconds = fsync_seconds
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._file = None
+        self._path = None
+        self._number = 0
+        self._size = 0
+        self._last_seq = 0
+        self._opened_at = 0.0
+        self._dirty = False
+        self._thread = None
+
+    def append(self, seq, key, data):
+        payload = json.dumps([key, data], separators=(',', ':')).encode('utf-8')
+        record = RECORD.pack(len(payload), zlib.crc32(payload), seq) + payload
+        with self._lock:
+            if self._file is None:
+                self._open_segment()
+            self._file.write(record)
+            self._size += len(record)
+            self._last_seq = max(self._last_seq, seq)
+            self._dirty = True
+            if self.fsync_seconds <= 0:
+                self._sync()
+            if self._size >= self.segment_bytes:
+                self._close_segment()
+
+    def _open_segment(self):
+        self._number += 1
+        self._path = os.path.join(self.directory, f'wal-{os.getpid()}-{self._number:06d}.open')
+        self._file = open(self._path, 'ab')
+        self._size = 0
+        self._last_seq = 0
+        self._opened_at = time.monotonic()
+
+    def _sync(self):
+        if self._dirty:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._dirty = False
+
+    def _close_segment(self):
+        """fsync, close and rename the segment so snapshots can delete it once they cover it"""
+        self._sync()
+        self._file.close()
+        os.replace(self._path, self._path[:-len('.open')] + f'-{self._last_seq:020d}.log')
+        self._file = None
+
+    def sync(self):
+        """fsync what has been appended; closes the segment once it is segment_seconds old"""
+        with self._lock:
+            if self._file is None:
+                return
+            self._sync()
+            if time.monotonic() - self._opened_at >= self.segment_seconds:
+                self._close_segment()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._close_segment()
+
+    def start(self):
+        """Background group commit: one fsync every fsync_seconds"""
+        def sync_forever():
+            while True:
+                time.sleep(max(self.fsync_seconds, 0.01))
+                try:
+                    self.sync()
+                except OSError:
+                    logger.exception("WAL fsync failed")
+
+        self._thread = threading.Thread(target=sync_forever, name='wal-sync', daemon=True)
+        self._thread.start()
+        return self._thread
+
+
+def read_segment(path):
+    """(seq, key, reading) records of a segment, stopping at a torn or corrupt tail"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    position = 0
+    while position + RECORD.size <= len(data):
+        length, crc, seq = RECORD.unpack_from(data, position)
+        start = position + RECORD.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            break
+        key, reading = json.loads(payload)
+        yield seq, key, reading
+        position = start + length
+
+
+def segment_paths(directory):
+    return sorted(glob.glob(os.path.join(directory, 'wal-*.open')) + glob.glob(os.path.join(directory, 'wal-*.log')))
+
+
+def closed_segment_seq(path):
+    """Last seq recorded in a closed segment's name"""
+    return int(os.path.basename(path)[:-len('.log')].rsplit('-', 1)[1])
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def close_orphaned_segments(directory):
+    """Close the open segments of processes that have died, as they would have on exit
+
+    A worker killed by gunicorn (timeout, crash) leaves its .open segment
+    behind. Once it is renamed after its last record, the next snapshot whose
+    cut covers that record deletes it.
+    """
+    for path in glob.glob(os.path.join(directory, 'wal-*.open')):
+        pid = int(os.path.basename(path).split('-')[1])
+        if pid == os.getpid() or process_alive(pid):
+            continue
+        last_seq = max((seq for seq, _, _ in read_segment(path)), default=0)
+        os.replace(path, path[:-len('.open')] + f'-{last_seq:020d}.log')
+
+
+def write_snapshot(store, directory):
+    """Write every ring buffer to snapshot.bin and delete the closed segments it covers
+
+    Returns (seq cut, patients). Keys changed while the snapshot is written are
+    saved with their newer readings; the seq of each key's latest reading is
+    stored so replay skips what the snapshot already has.
+    """
+    # Dead workers append nothing more, so the cut below covers all they logged
+    close_orphaned_segments(directory)
+    # Every change up to the cut is in the store before the first ring is copied
+    cut = store.current_seq()
+    path = os.path.join(directory, SNAPSHOT_FILENAME)
+    temporary = path + '.tmp'
+    patients = 0
+    with open(temporary, 'wb') as f:
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, store.depth, len(VITAL_FIELDS), cut, 0))
+        for key, labels, seq, raw in store.dump():
+            encoded = json.dumps(labels).encode('utf-8')
+            f.write(SNAPSHOT_ENTRY.pack(len(encoded), seq, len(raw)))
+            f.write(encoded)
+            f.write(raw)
+            patients += 1
+        f.seek(0)
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, store.depth, len(VITAL_FIELDS), cut, patients))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+    directory_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(directory_fd)
+    finally:
+        os.close(directory_fd)
+
+    for segment in glob.glob(os.path.join(directory, 'wal-*.log')):
+        if closed_segment_seq(segment) <= cut:
+            os.remove(segment)
+    return cut, patients
+
+
+def read_snapshot(directory):
+    """(depth, seq cut, [(key, labels, seq, ring bytes)]) from snapshot.bin, or None if there is none"""
+    path = os.path.join(directory, SNAPSHOT_FILENAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, depth, fields, cut, patients = SNAPSHOT_HEADER.unpack_from(data, 0)
+    if magic != SNAPSHOT_MAGIC or fields != len(VITAL_FIELDS):
+        raise ValueError(f"{path} is not a snapshot of this version; move it away to start empty")
+    entries = []
+    position = SNAPSHOT_HEADER.size
+    for _ in range(patients):
+        label_length, seq, ring_length = SNAPSHOT_ENTRY.unpack_from(data, position)
+        position += SNAPSHOT_ENTRY.size
+        labels = json.loads(data[position:position + label_length])
+        position += label_length
+        raw = data[position:position + ring_length]
+        position += ring_length
+        key = '|'.join(str(labels[field]) for field in LABEL_FIELDS)
+        entries.append((key, labels, seq, raw))
+    return depth, cut, entries
+
+
+def recover(store, directory, history_db=None):
+    """Load the snapshot and replay the log tail into an empty store; returns timing stats
+
+    Must run before anything else writes to the store or the log directory.
+    Recent readings are also added to history_db when they are newer than
+    what it has on disk (the last minute before a crash is only in
+    the log, see backfill_history). Afterwards a fresh snapshot replaces the
+    replayed segments.
+    """
+    started = time.perf_counter()
+    snapshot = read_snapshot(directory)
+    cut, key_seqs, entries = 0, {}, []
+    if snapshot is not None:
+        depth, cut, entries = snapshot
+        key_seqs = {key: seq for key, _, seq, _ in entries}
+
+    segments = segment_paths(directory)
+    records = []
+    last_seq = cut
+    for path in segments:
+        for seq, key, reading in read_segment(path):
+            last_seq = max(last_seq, seq)
+            if seq > cut and seq > key_seqs.get(key, 0):
+                records.append((seq, key, reading))
+    records.sort(key=lambda record: record[0])
+    read = time.perf_counter()
+
+    # Restored readings are numbered after everything logged, so dashboards
+    # holding a cursor from before the restart see every patient as changed
+    store.advance_seq(last_seq)
+    for key, labels, _, raw in entries:
+        if depth == store.depth:
+            store.restore(key, labels, raw)
+        else:
+            # History depth changed since the snapshot: re-append the readings that fit
+            for reading in PatientRingBuffer(depth, storage=bytearray(raw)).readings()[-store.depth:]:
+                store.append(key, dict(reading, **labels))
+    loaded = time.perf_counter()
+
+    for _, key, reading in records:
+        store.append(key, reading)
+    replayed = time.perf_counter()
+
+    if history_db is not None:
+        backfill_history(history_db, entries, depth if entries else store.depth, records)
+
+    # Start over from a snapshot of the result; its cut is above every replayed record
+    write_snapshot(store, directory)
+    for path in segments:
+        if os.path.exists(path):
+            os.remove(path)
+    return {
+        'seconds': round(time.perf_counter() - started, 3),
+        'read_seconds': round(read - started, 3),
+        'restore_seconds': round(loaded - read, 3),
+        'replay_seconds': round(replayed - loaded, 3),
+        'patients_restored': len(entries),
+        'segments': len(segments),
+        'records_replayed': len(records),
+    }
+
+
+def backfill_history(history_db, entries, depth, records):
+    """Add to history_db the readings it lost with its unflushed chunks
+
+    Those are the newest readings of each patient: the ones in the snapshot's
+    rings and the replayed log records that are newer than the last chunk on disk.
+    """
+    readings = {}
+    for key, labels, _, raw in entries:
+        ring = PatientRingBuffer(depth, storage=bytearray(raw))
+        readings[key] = [(parse_timestamp(reading['timestamp']), reading) for reading in ring.readings()]
+    for _, key, reading in records:
+        readings.setdefault(key, []).append((parse_timestamp(reading.get('timestamp')), reading))
+    for key, timed in readings.items():
+        if not timed:
+            continue
+        newest = max(timestamp for timestamp, _ in timed)
+        persisted = history_db.last_persisted(key, newest - 86400)
+        for timestamp, reading in timed:
+            if persisted is None or timestamp > persisted:
+                history_db.append(key, timestamp, reading)
+    history_db.flush()
+
+
+class Checkpointer:
+    """Writes a snapshot every interval seconds, from whichever worker gets there first"""
+
+    def __init__(self, store, directory, interval=DEFAULT_SNAPSHOT_SECONDS):
+        self.store = store
+        self.directory = directory
+        self.interval = interval
+        self._thread = None
+
+    def checkpoint(self):
+        """Write a snapshot unless another process holds the lock or wrote one recently"""
+        lock_fd = os.open(os.path.join(self.directory, SNAPSHOT_LOCK_FILENAME), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+            try:
+                path = os.path.join(self.directory, SNAPSHOT_FILENAME)
+                if os.path.exists(path) and time.time() - os.path.getmtime(path) < self.interval * 0.9:
+                    return None
+                started = time.perf_counter()
+                cut, patients = write_snapshot(self.store, self.directory)
+                logger.info("Snapshot written", extra={'fields': {
+                    'seq': cut, 'patients': patients, 'seconds': round(time.perf_counter() - started, 3),
+                }})
+                return cut
+            finally:
+                fcntl.flock(lock_fd, fcntl.LOCK_UN)
+        finally:
+            os.close(lock_fd)
+
+    def start(self):
+        def checkpoint_forever():
+            while True:
+                time.sleep(self.interval)
+                try:
+                    self.checkpoint()
+                except Exception:
+                    logger.exception("Snapshot failed")
+
+        self._thread = threading.Thread(target=checkpoint_forever, name='wal-checkpoint', daemon=True)
+        self._thread.start()
+        return self._thread
@@ -1,3 +1,26 @@
+"""
+Train the Isolation Forest anomaly model from recorded or generated readings.
+
+The data is streamed in chunks, so the input can be far larger than memory:
+each chunk is labelled against the vital-sign thresholds with vectorized
+comparisons and folds into a uniform random sample of at most `sample_rows`
+readings. Only that sample is used to fit the model. Isolation Forest sees at
+most `max_samples` rows per tree anyway, and setting the contamination
+threshold means scoring every row it is fitted on, so fitting on the full
+input would cost time without changing the model. Trees are built on
+`n_jobs` cores.
+
+Usage:
+    python m.py patients_data.xlsx
+    python m.py history/*.parquet --sample-rows 500000 --n-jobs 4
+
+Inputs can be .xlsx (every sheet), .parquet, .csv or .ndjson/.jsonl.
+"""
+
+import argparse
+import os
+import time
+
 import pandas as pd
 import numpy as np
 from sklearn.ensemble import IsolationForest
@@ -18,49 +41,163 @@ thresholds = {
     "blood_glucose": {"normal": (70, 120), "anomalous": [50, 180]},
 }
 
+# Model inputs, in the order the model is trained on
+feature_columns = [
+    "heart_rate", "bp_systolic", "bp_diastolic", "respiratory_rate", "spo2",
+    "etco2", "fio2", "temperature", "wbc_count", "lactate", "blood_glucose"
+]
+
+# Normal range of every feature as arrays, for labelling whole chunks at once
+normal_low = np.array([thresholds[feature]["normal"][0] for feature in feature_columns], dtype=float)
+normal_high = np.array([thresholds[feature]["normal"][1] for feature in feature_columns], dtype=float)
+
+DEFAULT_CHUNK_ROWS = 500_000
+DEFAULT_SAMPLE_ROWS = 200_000
+
+
+def read_chunks(path, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Yield DataFrames of at most chunk_rows readings from one input file"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".xlsx":
+        import openpyxl
+
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        for sheet in workbook.worksheets:
+            rows = sheet.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                continue
+            batch = []
+            for values in rows:
+                batch.append(values)
+                if len(batch) >= chunk_rows:
+                    yield pd.DataFrame(batch, columns=header)
+                    batch = []
+            if batch:
+                yield pd.DataFrame(batch, columns=header)
+    elif extension == ".parquet":
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows, columns=feature_columns):
+            yield batch.to_pandas()
+    elif extension == ".csv":
+        yield from pd.read_csv(path, chunksize=chunk_rows, usecols=feature_columns)
+    elif extension in (".ndjson", ".jsonl"):
+        yield from pd.read_json(path, lines=True, chunksize=chunk_rows)
+    else:
+        raise ValueError(f"Unsupported training file '{path}' (expected .xlsx, .parquet, .csv or .ndjson)")
+
+
+def label_readings(X):
+    """1 where every vital is inside its normal range, -1 (anomalous) otherwise"""
+    normal = ((X >= normal_low) & (X <= normal_high)).all(axis=1)
+    return np.where(normal, 1, -1)
+
+
+class ReservoirSample:
+    """Uniform random sample of at most `size` rows from a stream of chunks
+
+    Every row gets a random key and the rows with the smallest keys are kept,
+    so the sample does not depend on how the input was chunked.
+    """
+
+    def __init__(self, size, seed=None):
+        self.size = size
+        self.rng = np.random.default_rng(seed)
+        self.keys = np.empty(0)
+        self.X = np.empty((0, len(feature_columns)))
+        self.y = np.empty(0, dtype=int)
+
+    def add(self, X, y):
+        keys = np.concatenate([self.keys, self.rng.random(len(X))])
+        X = np.concatenate([self.X, X])
+        y = np.concatenate([self.y, y])
+        if len(keys) > self.size:
+            keep = np.argpartition(keys, self.size - 1)[:self.size]
+            keys, X, y = keys[keep], X[keep], y[keep]
+        self.keys, self.X, self.y = keys, X, y
+
+
 # Function to generate labeled data based on thresholds
-def generate_labeled_data(excel_path):
-    all_data = pd.concat(
-        pd.read_excel(excel_path, sheet_name=None),
-        ignore_index=True
-    )
-    
-    # Select only feature columns
-    feature_columns = [
-        "heart_rate", "bp_systolic", "bp_diastolic", "respiratory_rate", "spo2",
-        "etco2", "fio2", "temperature", "wbc_count", "lactate", "blood_glucose"
-    ]
-    data = all_data[feature_columns].dropna()
-
-    labeled_data = []
-    
-    for _, row in data.iterrows():
-        label = 1  # Assume normal
-        for feature, limits in thresholds.items():
-            if row[feature] < limits["normal"][0] or row[feature] > limits["normal"][1]:
-                label = -1  # Anomalous
-                break
-        labeled_data.append(row.tolist() + [label])  # Add the label at the end
-    
-    labeled_df = pd.DataFrame(labeled_data, columns=feature_columns + ["label"])
-    return labeled_df
-
-# 1. Load and label data based on thresholds
-excel_path = "patients_data.xlsx"  # 👈 change this
-labeled_data = generate_labeled_data(excel_path)
-
-# 2. Split features (X) and labels (y)
-X = labeled_data.drop(columns=["label"])  # Features
-y = labeled_data["label"]  # Labels (1 for normal, -1 for anomalous)
-
-# 3. Train Isolation Forest
-model = IsolationForest(n_estimators=100, contamination=0.05, random_state=42)
-model.fit(X)
-
-# 4. Save the model
-joblib.dump(model, "iforest_model.pkl")
-print("✅ Model trained and saved as iforest_model.pkl")
-
-# Optional: Check the first few rows of labeled data
-print(labeled_data.head())
+def generate_labeled_data(paths, chunk_rows=DEFAULT_CHUNK_ROWS, sample_rows=DEFAULT_SAMPLE_ROWS, seed=None):
+    """Stream, clean and label every input; returns the training sample and overall counts"""
+    sample = ReservoirSample(sample_rows, seed)
+    total = anomalous = 0
+    for path in paths:
+        for chunk in read_chunks(path, chunk_rows):
+            # Select only feature columns, dropping readings with a missing vital
+            X = chunk[feature_columns].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float)
+            X = X[~np.isnan(X).any(axis=1)]
+            y = label_readings(X)
+            total += len(X)
+            anomalous += int((y == -1).sum())
+            sample.add(X, y)
+    labeled_df = pd.DataFrame(sample.X, columns=feature_columns)
+    labeled_df["label"] = sample.y
+    return labeled_df, total, anomalous
+
+
+def train(paths, output="iforest_model.pkl", chunk_rows=DEFAULT_CHUNK_ROWS, sample_rows=DEFAULT_SAMPLE_ROWS,
+          max_samples="auto", n_estimators=100, contamination=0.05, n_jobs=-1, seed=42):
+    """Run the training pipeline and return {stage: seconds}"""
+    timings = {}
+
+    # 1. Load and label data based on thresholds
+    started = time.perf_counter()
+    labeled_data, total, anomalous = generate_labeled_data(paths, chunk_rows, sample_rows, seed)
+    timings["load_and_label"] = time.perf_counter() - started
+    if total == 0:
+        raise ValueError("No complete readings found in the training data")
+    print(f"⏱ Loaded and labelled {total} readings in {timings['load_and_label']:.1f}s "
+          f"({total / max(timings['load_and_label'], 1e-9):.0f}/s); "
+          f"{anomalous / total:.1%} outside the normal thresholds")
+
+    # 2. Split features (X) and labels (y)
+    X = labeled_data[feature_columns]  # Features (the sample the model is fitted on)
+    y = labeled_data["label"]  # Labels (1 for normal, -1 for anomalous)
+
+    # 3. Train Isolation Forest
+    started = time.perf_counter()
+    model = IsolationForest(n_estimators=n_estimators, contamination=contamination, max_samples=max_samples,
+                            n_jobs=n_jobs, random_state=seed)
+    model.fit(X)
+    timings["fit"] = time.perf_counter() - started
+    print(f"⏱ Fitted {n_estimators} trees on a sample of {len(X)} readings in {timings['fit']:.1f}s "
+          f"(n_jobs={n_jobs}); {(y == -1).mean():.1%} of the sample outside the thresholds")
+
+    # 4. Save the model
+    started = time.perf_counter()
+    joblib.dump(model, output)
+    timings["save"] = time.perf_counter() - started
+    print(f"✅ Model trained and saved as {output} in {sum(timings.values()):.1f}s")
+
+    # Optional: Check the first few rows of labeled data
+    print(labeled_data.head())
+    return timings
+
+
+def parse_max_samples(value):
+    if value == "auto":
+        return value
+    return float(value) if "." in value else int(value)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the Isolation Forest anomaly model")
+    parser.add_argument("paths", nargs="*", default=["patients_data.xlsx"],
+                        help=".xlsx, .parquet, .csv or .ndjson files of readings")
+    parser.add_argument("--output", default="iforest_model.pkl")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS, help="readings read at a time")
+    parser.add_argument("--sample-rows", type=int, default=DEFAULT_SAMPLE_ROWS,
+                        help="readings kept (uniformly at random) to fit the model on")
+    parser.add_argument("--max-samples", type=parse_max_samples, default="auto",
+                        help="rows drawn per tree (IsolationForest max_samples)")
+    parser.add_argument("--n-estimators", type=int, default=100)
+    parser.add_argument("--contamination", type=float, default=0.05)
+    parser.add_argument("--n-jobs", type=int, default=-1, help="cores used to build trees (-1 = all)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
 
+    train(args.paths, output=args.output, chunk_rows=args.chunk_rows, sample_rows=args.sample_rows,
+          max_samples=args.max_samples, n_estimators=args.n_estimators, contamination=args.contamination,
+          n_jobs=args.n_jobs, seed=args.seed)
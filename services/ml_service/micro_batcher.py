@@ -0,0 +1,83 @@
+"""
+Server-side micro-batching for single-reading /predict calls.
+
+Concurrent requests put their feature vectors on a queue; one worker thread
+collects up to `max_batch_size` rows (waiting at most `max_wait_ms` after the
+first one arrives), scores them with a single model call and hands each
+waiting request its own result.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class MicroBatcher:
+    """Coalesces concurrent single-row scoring calls into batched model calls"""
+
+    def __init__(self, score_fn, max_batch_size=64, max_wait_ms=5.0):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.score_fn = score_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._worker = None
+        self._start_lock = threading.Lock()
+        # Simple counters, useful when tuning batch size and wait
+        self.batches = 0
+        self.rows = 0
+
+    def _ensure_worker(self):
+        # Started lazily so the thread is created in the process that serves requests
+        if self._worker is None or not self._worker.is_alive():
+            with self._start_lock:
+                if self._worker is None or not self._worker.is_alive():
+                    self._worker = threading.Thread(target=self._run, name="predict-microbatcher", daemon=True)
+                    self._worker.start()
+
+    def submit(self, features):
+        """Queue one feature vector and return a Future for its raw score"""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((features, future))
+        return future
+
+    def score(self, features, timeout=None):
+        """Score one feature vector, blocking until its batch has been evaluated"""
+        return self.submit(features).result(timeout=timeout)
+
+    def _collect(self):
+        """Block for the first item, then gather more until the batch is full or the wait expires"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            futures = [future for _, future in batch]
+            try:
+                X = np.array([features for features, _ in batch], dtype=np.float64)
+                scores = self.score_fn(X)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.rows += len(batch)
+            for future, score in zip(futures, scores):
+                future.set_result(float(score))
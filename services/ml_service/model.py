@@ -3,16 +3,36 @@ Modified model.py with debug information for testing
 """
 
 from flask import Flask, request, jsonify
-from sklearn.ensemble import IsolationForest
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST, REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
 import numpy as np
 import pandas as pd
 import joblib
+import logging
 import os
+import threading
+import time
+
+from compiled_forest import CompiledForest
+from micro_batcher import MicroBatcher
+from prediction_cache import PredictionCache
+from structured_logging import setup_logging, PatientTraceSampler
 
 app = Flask(__name__)
+setup_logging("ml_service")
+logger = logging.getLogger("ml_service")
+
+# Per-request debug output: every request for traced patients, sampled for the rest
+trace_sampler = PatientTraceSampler(logger)
 
 MODEL_FILENAME = "anomaly_model.pkl"  # Updated to match the model name in m.py
 
+# Flattened copy of MODEL_FILENAME served without sklearn (see compiled_forest.py)
+COMPILED_MODEL_DIR = os.environ.get("COMPILED_MODEL_DIR", "anomaly_model_compiled")
+USE_COMPILED_MODEL = os.environ.get("USE_COMPILED_MODEL", "1") != "0"
+# Map the compiled arrays read-only so every worker process shares the same page-cache pages
+MODEL_MMAP = os.environ.get("MODEL_MMAP", "1") != "0"
+
 # Feature columns - matching those used in m.py
 feature_names = [
     "heart_rate", "bp_systolic", "bp_diastolic", "respiratory_rate",
@@ -21,7 +41,10 @@ feature_names = [
 
 # Function to train and save the model
 def train_model():
-    print("Training a new anomaly detection model...")
+    # sklearn is only needed for training; serving uses the compiled forest
+    from sklearn.ensemble import IsolationForest
+
+    logger.info("Training a new anomaly detection model...")
     np.random.seed(42)
     data = pd.DataFrame({
         "heart_rate": np.random.normal(75, 10, 300),
@@ -40,52 +63,283 @@ def train_model():
     model = IsolationForest(n_estimators=100, contamination=0.2, random_state=42)
     model.fit(data)
     joblib.dump(model, MODEL_FILENAME)
-    print(f"Model trained and saved as {MODEL_FILENAME}")
+    logger.info(f"Model trained and saved as {MODEL_FILENAME}")
     return model
 
-# Load or train model
-if __name__ == "__main__":  # Only load the model if running as the main module
+def compile_model():
+    """Flatten MODEL_FILENAME into COMPILED_MODEL_DIR, reusing the export if it is current"""
+    source_mtime = os.path.getmtime(MODEL_FILENAME)
+    mmap_mode = "r" if MODEL_MMAP else None
+    try:
+        if CompiledForest.read_meta(COMPILED_MODEL_DIR).get("source_mtime") == source_mtime:
+            return CompiledForest.load(COMPILED_MODEL_DIR, mmap_mode=mmap_mode)
+    except (OSError, ValueError):
+        pass
+
+    logger.info(f"Compiling {MODEL_FILENAME} into {COMPILED_MODEL_DIR}...")
+    compiled = CompiledForest.from_sklearn(joblib.load(MODEL_FILENAME))
+    try:
+        compiled.save(COMPILED_MODEL_DIR, source_mtime=source_mtime)
+    except OSError as e:
+        logger.warning(f"Could not save compiled model, serving it from memory: {e}")
+        return compiled
+    # Reopen from disk so this process also serves from the shared mapping
+    return CompiledForest.load(COMPILED_MODEL_DIR, mmap_mode=mmap_mode)
+
+
+def load_model():
+    """Load the serving model, training one first if no pickle exists"""
     if not os.path.exists(MODEL_FILENAME):
-        model = train_model()
+        train_model()
+    if USE_COMPILED_MODEL:
+        loaded = compile_model()
     else:
-        model = joblib.load(MODEL_FILENAME)
-        print(f"Model loaded from {MODEL_FILENAME}")
+        loaded = joblib.load(MODEL_FILENAME)
+    logger.info(f"Model loaded from {MODEL_FILENAME} ({type(loaded).__name__})")
+    return loaded
+
+# Bounds used to map decision_function output onto 0-1.
+# A reasonable range for decision_function is typically -0.5 to 0.5
+MIN_SCORE = -0.5
+MAX_SCORE = 0.5
+
+
+# Set once the model is loaded and has scored a warm-up row; /ready reports it
+model_ready = threading.Event()
+model_load_seconds = None
+# Bumped on every (re)load; part of every prediction cache key
+model_version = 0
+_model_lock = threading.Lock()
+
+# Optional LRU of raw scores keyed by quantized vitals (PREDICTION_CACHE_SIZE=0 disables it)
+if int(os.environ.get("PREDICTION_CACHE_SIZE", 10000)) > 0:
+    prediction_cache = PredictionCache(
+        max_size=int(os.environ.get("PREDICTION_CACHE_SIZE", 10000)),
+        decimals=int(os.environ.get("PREDICTION_CACHE_DECIMALS", 1)),
+    )
+else:
+    prediction_cache = None
+
+
+def _load_and_warm():
+    """Load the model, score one row and publish it as the serving model"""
+    global model, model_load_seconds, model_version
+    started = time.perf_counter()
+    loaded = load_model()
+    loaded.decision_function(np.zeros((1, len(feature_names))))
+    model = loaded
+    model_version += 1
+    model_load_seconds = time.perf_counter() - started
+    model_ready.set()
+    logger.info(f"Model v{model_version} warm after {model_load_seconds:.3f}s")
+    return model
+
+
+def warm_model():
+    """Load the model and score one row so the first real request pays no load cost"""
+    with _model_lock:
+        if model_ready.is_set():
+            return model
+        return _load_and_warm()
+
+
+def reload_model():
+    """Swap in the model currently on disk and drop cached scores from the old one"""
+    with _model_lock:
+        loaded = _load_and_warm()
+    if prediction_cache is not None:
+        prediction_cache.clear()
+    return loaded
+
+
+def get_model():
+    """Return the warm model, waiting for the boot-time load if it is still running"""
+    if model_ready.is_set():
+        return model
+    return warm_model()
+
+
+def score_rows(X):
+    """Raw decision scores for a feature matrix, served from the prediction cache where possible"""
+    current = get_model()
+    if prediction_cache is None:
+        return current.decision_function(X)
+    return prediction_cache.score(X, model_version, current.decision_function)
+
+
+@app.route("/reload", methods=["POST"])
+def reload():
+    """Reload the model from disk; cached predictions from the previous model are invalidated"""
+    reload_model()
+    return jsonify({"status": "reloaded", "model_version": model_version})
+
+
+@app.route("/health")
+def health():
+    """Liveness: the process is up, whether or not the model is loaded yet"""
+    return jsonify({"status": "ok"})
+
+
+@app.route("/ready")
+def ready():
+    """Readiness: OK only once the model is loaded and warm"""
+    if not model_ready.is_set():
+        return jsonify({"status": "loading"}), 503
+    return jsonify({
+        "status": "ready",
+        "model": type(model).__name__,
+        "load_seconds": round(model_load_seconds, 4),
+    })
+
+
+def normalize_scores(raw_scores):
+    """Vectorized version of the /predict normalization: higher = more anomalous"""
+    normalized = np.clip((raw_scores - MIN_SCORE) / (MAX_SCORE - MIN_SCORE), 0, 1)
+    return 1 - normalized
+
+
+def feature_values(values, where):
+    """Features as floats, in feature_names order; ValueError naming `where` for a missing,
+    non-numeric or non-finite value (the compiled forest would score NaN without complaint)"""
+    result = []
+    for feat, value in zip(feature_names, values):
+        if value is None:
+            raise ValueError(f"Missing value for {feat} in {where}")
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{feat} in {where} must be a number, not {value!r}")
+        if not np.isfinite(number):
+            raise ValueError(f"{feat} in {where} must be finite, not {value!r}")
+        result.append(number)
+    return result
+
+
+def build_feature_matrix(instances):
+    """Turn a list of feature dicts (or ordered feature lists) into one contiguous float matrix"""
+    X = np.empty((len(instances), len(feature_names)), dtype=np.float64)
+    for row, instance in enumerate(instances):
+        if isinstance(instance, dict):
+            try:
+                values = [instance[feat] for feat in feature_names]
+            except KeyError as e:
+                raise ValueError(f"Missing feature in instance {row}: {str(e)}")
+            X[row] = feature_values(values, f"instance {row}")
+        elif isinstance(instance, (list, tuple)) and len(instance) == len(feature_names):
+            X[row] = feature_values(instance, f"instance {row}")
+        else:
+            raise ValueError(
+                f"Instance {row} must be an object or a list of {len(feature_names)} values"
+            )
+    return X
+
+
+# Coalesce concurrent single /predict calls into micro-batches (set PREDICT_MICROBATCH=0 to disable)
+if os.environ.get("PREDICT_MICROBATCH", "1") != "0":
+    predict_batcher = MicroBatcher(
+        lambda X: get_model().decision_function(X),
+        max_batch_size=int(os.environ.get("PREDICT_MAX_BATCH_SIZE", 64)),
+        max_wait_ms=float(os.environ.get("PREDICT_MAX_WAIT_MS", 5)),
+    )
+else:
+    predict_batcher = None
+
+
+class ServingStatsCollector:
+    """Exposes prediction cache and micro-batcher counters on /metrics"""
+
+    def collect(self):
+        yield GaugeMetricFamily("ml_model_version", "Serving model version (bumped on reload)", value=model_version)
+        if prediction_cache is not None:
+            yield CounterMetricFamily("prediction_cache_hits", "Prediction cache hits", value=prediction_cache.hits)
+            yield CounterMetricFamily("prediction_cache_misses", "Prediction cache misses", value=prediction_cache.misses)
+            yield CounterMetricFamily("prediction_cache_evictions", "Prediction cache LRU evictions", value=prediction_cache.evictions)
+            yield CounterMetricFamily("prediction_cache_invalidations", "Prediction cache clears on model reload",
+                                      value=prediction_cache.invalidations)
+            yield GaugeMetricFamily("prediction_cache_entries", "Entries in the prediction cache", value=len(prediction_cache))
+        if predict_batcher is not None:
+            yield CounterMetricFamily("predict_microbatches", "Micro-batches scored", value=predict_batcher.batches)
+            yield CounterMetricFamily("predict_microbatch_rows", "Rows scored through micro-batches", value=predict_batcher.rows)
+
+
+REGISTRY.register(ServingStatsCollector())
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return generate_latest(), 200, {"Content-Type": CONTENT_TYPE_LATEST}
+
+
+# Batch predict route
+@app.route("/predict/batch", methods=["POST"])
+def predict_batch():
+    """Score N readings with a single decision_function call, in input order"""
+    input_data = request.json
+    instances = input_data.get("instances") if isinstance(input_data, dict) else input_data
+    if not isinstance(instances, list):
+        return jsonify({"error": "Expected a JSON array of readings or {\"instances\": [...]}"}), 400
+    if not instances:
+        return jsonify({"results": []})
+
+    try:
+        X = build_feature_matrix(instances)
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    raw_scores = score_rows(X)
+    original_scores = np.round(1 - raw_scores, 4)
+    normalized_scores = np.round(normalize_scores(raw_scores), 4)
+
+    return jsonify({
+        "results": [
+            {"original_score": float(original), "normalized_score": float(normalized)}
+            for original, normalized in zip(original_scores, normalized_scores)
+        ]
+    })
+
 
 # Predict route
 @app.route("/predict", methods=["POST"])
 def predict():
-    # Load model if not already loaded
-    if 'model' not in globals():
-        global model
-        if os.path.exists(MODEL_FILENAME):
-            model = joblib.load(MODEL_FILENAME)
-        else:
-            model = train_model()
+    model = get_model()
     
     input_data = request.json
-    print(f"DEBUG: Received input data: {input_data}")
+    if not isinstance(input_data, dict):
+        return jsonify({"error": "Expected a JSON object of features"}), 400
 
     try:
-        features = [input_data[feat] for feat in feature_names]
+        features = feature_values([input_data[feat] for feat in feature_names], "input")
     except KeyError as e:
         return jsonify({"error": f"Missing feature in input: {str(e)}"}), 400
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    X = pd.DataFrame([features], columns=feature_names)
-    print(f"DEBUG: Features extracted: {features}")
+    # Get the raw decision function score, from the cache when this reading has been seen before
+    score = None
+    if prediction_cache is not None:
+        features = prediction_cache.quantize(features).tolist()
+        cache_key = prediction_cache.key(features, model_version)
+        score = prediction_cache.get(cache_key)
+    cache_hit = score is not None
+
+    if not cache_hit:
+        if predict_batcher is not None:
+            # Scored together with any other requests that arrive within the batch window
+            score = predict_batcher.score(features)
+        else:
+            X = pd.DataFrame([features], columns=feature_names)
+            score = model.decision_function(X)[0]
 
-    # Get the raw decision function score
-    score = model.decision_function(X)[0]
-    print(f"DEBUG: Raw decision score: {score}")
+        if prediction_cache is not None:
+            prediction_cache.put(cache_key, float(score))
     
     # Original calculation
     original_score = 1 - score
-    print(f"DEBUG: Original calculation (1 - raw): {original_score}")
     
     # Normalize score to 0-1 range - consistent with m.py
     # Since we have only one sample, we need to set reasonable min/max bounds
-    # A reasonable range for decision_function is typically -0.5 to 0.5
-    min_score = -0.5
-    max_score = 0.5
+    min_score = MIN_SCORE
+    max_score = MAX_SCORE
     
     if max_score > min_score:
         normalized_score = (score - min_score) / (max_score - min_score)
@@ -94,21 +348,30 @@ def predict():
     else:
         normalized_score = 0.5  # Default if min=max (unlikely)
     
-    print(f"DEBUG: After normalization: {normalized_score}")
-    
     # Invert so higher = more anomalous
     anomaly_score = 1 - normalized_score
-    print(f"DEBUG: Final normalized score: {anomaly_score}")
     
     # Return both original and normalized scores for comparison
     response = {
         "original_score": round(original_score, 4),
         "normalized_score": round(anomaly_score, 4)
     }
-    print(f"DEBUG: Returning response: {response}")
+
+    patient = input_data.get("patient", "unknown")
+    if trace_sampler.should_trace(patient):
+        trace_sampler.trace(
+            "Scored reading", patient,
+            features=features, raw_score=float(score), cache_hit=cache_hit,
+            normalized_score=float(normalized_score), response=response,
+        )
     
     return jsonify(response)
 
+# Load the model at boot, in the background so /health answers while it warms up
+if os.environ.get("MODEL_EAGER_LOAD", "1") != "0":
+    threading.Thread(target=warm_model, name="model-warmup", daemon=True).start()
+
 if __name__ == "__main__":
-    print("DEBUG: Starting server with normalized scoring...")
-    app.run(host="0.0.0.0", port=6000)
\ No newline at end of file
+    logger.info("Starting server with normalized scoring")
+    # Threaded so concurrent /predict calls can share a micro-batch
+    app.run(host="0.0.0.0", port=int(os.environ.get("ML_SERVICE_PORT", 6000)), threaded=True)
\ No newline at end of file
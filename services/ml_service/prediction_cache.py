@@ -0,0 +1,84 @@
+"""
+Bounded LRU cache of raw anomaly scores keyed by quantized vitals.
+
+Bedside and simulated vitals are integers or one-decimal floats that repeat a
+lot, so rounding the 11-feature vector to a fixed number of decimals gives a
+small key space. Keys also carry the model version, which means a reload can
+never serve a score computed by the previous model.
+"""
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class PredictionCache:
+    """Thread-safe LRU of decision_function scores with hit/miss/eviction counters"""
+
+    def __init__(self, max_size=10000, decimals=1):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        self.max_size = max_size
+        self.decimals = decimals
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def quantize(self, X):
+        """Round features so near-identical readings share a key (and are scored identically)"""
+        return np.round(np.asarray(X, dtype=np.float64), self.decimals)
+
+    @staticmethod
+    def key(row, model_version):
+        return (model_version, tuple(row))
+
+    def get(self, key):
+        with self._lock:
+            score = self._entries.get(key)
+            if score is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return score
+
+    def put(self, key, score):
+        with self._lock:
+            self._entries[key] = score
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop every entry, e.g. after the model has been reloaded"""
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def score(self, X, model_version, score_fn):
+        """Raw scores for a matrix of rows, calling score_fn only for the rows not cached"""
+        X = self.quantize(X)
+        keys = [self.key(row, model_version) for row in X.tolist()]
+        scores = np.empty(len(keys), dtype=np.float64)
+        missing = []
+        for index, key in enumerate(keys):
+            cached = self.get(key)
+            if cached is None:
+                missing.append(index)
+            else:
+                scores[index] = cached
+
+        if missing:
+            fresh = score_fn(X[missing])
+            for index, score in zip(missing, fresh):
+                scores[index] = score
+                self.put(keys[index], float(score))
+        return scores
@@ -0,0 +1,164 @@
+"""
+Non-blocking, structured logging for the hot request paths.
+
+Records go through a bounded in-memory queue to a background listener thread,
+so a request never waits on stdout (when the queue is full, records are
+dropped and counted instead). Output is one JSON object per line by default.
+
+Per-reading debug output goes through PatientTraceSampler. Patients named in
+TRACE_PATIENTS (or added at runtime) are traced on every reading. Every other
+patient is sampled at most once per TRACE_SAMPLE_SECONDS, and only when the
+logger is at DEBUG. Tracing one patient therefore does not slow ingest for all.
+Runtime changes apply to the current process only. Under gunicorn every worker
+keeps its own list, so use TRACE_PATIENTS for a list that all workers share.
+
+The same file lives in services/main_host and services/ml_service. Each
+Docker image is built from its own service directory only, so the two
+services cannot import one shared copy. Keep both copies identical.
+
+Environment:
+    LOG_LEVEL             debug | info | warning | error (default info)
+    LOG_FORMAT            json | text (default json)
+    LOG_QUEUE_SIZE        records buffered before dropping (default 10000)
+    TRACE_PATIENTS        comma-separated patient ids to trace on every reading, or *
+    TRACE_SAMPLE_SECONDS  per-patient sampling interval for everyone else (default 10)
+"""
+
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+
+class JsonLineFormatter(logging.Formatter):
+    """One JSON object per record; structured fields come from extra={'fields': {...}}"""
+
+    def __init__(self, service):
+        super().__init__()
+        self.service = service
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 6),
+            'level': record.levelname.lower(),
+            'service': self.service,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable fallback that still shows the structured fields"""
+
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            line += ' ' + json.dumps(fields, default=str)
+        return line
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener = None
+_queue_handler = None
+
+
+def setup_logging(service, level=None, fmt=None, stream=None):
+    """Route the root logger through a queue to a background writer; safe to call more than once"""
+    global _listener, _queue_handler
+    if _listener is not None:
+        return _queue_handler
+
+    level = (level or os.environ.get('LOG_LEVEL', 'info')).upper()
+    fmt = (fmt or os.environ.get('LOG_FORMAT', 'json')).lower()
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    if fmt == 'json':
+        output.setFormatter(JsonLineFormatter(service))
+    else:
+        output.setFormatter(TextFormatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+
+    log_queue = queue.Queue(maxsize=int(os.environ.get('LOG_QUEUE_SIZE', 10000)))
+    _queue_handler = DroppingQueueHandler(log_queue)
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=False)
+    _listener.start()
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(getattr(logging, level, logging.INFO))
+    return _queue_handler
+
+
+def dropped_records():
+    """Records discarded because the log queue was full"""
+    return _queue_handler.dropped if _queue_handler is not None else 0
+
+
+def parse_patient_list(value):
+    return {patient.strip() for patient in (value or '').split(',') if patient.strip()}
+
+
+class PatientTraceSampler:
+    """Decides which readings get per-reading debug output"""
+
+    def __init__(self, logger, traced=None, sample_seconds=None):
+        self.logger = logger
+        self.traced = set(traced if traced is not None else parse_patient_list(os.environ.get('TRACE_PATIENTS')))
+        self.sample_seconds = float(
+            sample_seconds if sample_seconds is not None else os.environ.get('TRACE_SAMPLE_SECONDS', 10)
+        )
+        self._last_logged = {}
+        self._lock = threading.Lock()
+
+    def set_traced(self, patients):
+        with self._lock:
+            self.traced = set(str(patient) for patient in patients)
+
+    def should_trace(self, patient):
+        """True for traced patients, or once per sampling interval per patient at DEBUG"""
+        patient = str(patient)
+        if patient in self.traced or '*' in self.traced:
+            return True
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return False
+        now = time.monotonic()
+        last = self._last_logged.get(patient)
+        if last is not None and now - last < self.sample_seconds:
+            return False
+        with self._lock:
+            self._last_logged[patient] = now
+        return True
+
+    def trace(self, message, patient, **fields):
+        """Emit a debug-style record for a traced reading, regardless of the logger level"""
+        fields['patient'] = str(patient)
+        # handle() skips the level check, so explicitly traced patients are logged at any level
+        record = self.logger.makeRecord(
+            self.logger.name, logging.DEBUG, '(trace)', 0, message, (), None, extra={'fields': fields}
+        )
+        self.logger.handle(record)
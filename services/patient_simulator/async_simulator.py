@@ -0,0 +1,159 @@
+"""
+Asyncio-based simulator mode: every patient runs on its own schedule.
+
+Each patient produces readings at `interval = patients / target_rate` seconds,
+staggered so the aggregate load is smooth. A reading is scored by ml_service
+and then tracked on main_host in its own task, so the next reading does not
+wait for the previous one to finish (scoring and tracking are pipelined). All
+requests share one pooled aiohttp session, and `max_in_flight` bounds how many
+readings can be outstanding at once. With skip_predict the /predict call is
+left out and main_host scores readings on ingest (INGEST_SCORING).
+
+Run with:
+    python send_data.py --mode async --rate 200
+"""
+
+import asyncio
+import time
+
+import aiohttp
+
+from send_data import (
+    MAIN_HOST, ML_MODEL_URL, generate_updated_patient_data, score_from_response,
+)
+
+
+class SimulatorStats:
+    """Counters shared by all patient tasks"""
+
+    def __init__(self, record_latency=False):
+        self.started = time.monotonic()
+        self.sent = 0
+        self.failed = 0
+        self.score_failures = 0
+        # Per-call latencies in seconds ('predict' and 'track'), kept only when asked for
+        self.latencies = {'predict': [], 'track': []} if record_latency else None
+
+    def record(self, kind, seconds):
+        if self.latencies is not None:
+            self.latencies[kind].append(seconds)
+
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return self.sent / elapsed if elapsed > 0 else 0.0
+
+
+class AsyncSimulator:
+    """Drives all patients concurrently against ml_service and main_host"""
+
+    def __init__(self, sheet_data, target_rate=15.0, max_in_flight=256,
+                 main_host_url=MAIN_HOST, ml_url=ML_MODEL_URL, report_every=5.0,
+                 request_timeout=3.0, record_latency=False, skip_predict=False):
+        self.sheet_data = sheet_data
+        self.target_rate = target_rate
+        self.max_in_flight = max_in_flight
+        self.main_host_url = main_host_url
+        self.ml_url = ml_url
+        self.report_every = report_every
+        self.request_timeout = request_timeout
+        self.skip_predict = skip_predict
+        self.stats = SimulatorStats(record_latency)
+
+    @property
+    def patient_interval(self):
+        """Seconds between two readings of the same patient (0 = as fast as possible)"""
+        if not self.target_rate or self.target_rate <= 0:
+            return 0.0
+        return len(self.sheet_data) / self.target_rate
+
+    async def score(self, session, data):
+        started = time.perf_counter()
+        try:
+            async with session.post(self.ml_url, json=data) as response:
+                if response.status == 200:
+                    score = score_from_response(await response.json())
+                    self.stats.record('predict', time.perf_counter() - started)
+                    return score
+                self.stats.score_failures += 1
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.stats.score_failures += 1
+        return 0.0
+
+    async def process(self, session, data, slots):
+        """Score then track one reading; runs concurrently with the patient's next readings"""
+        try:
+            if not self.skip_predict:
+                data["anomaly_score"] = await self.score(session, data)
+            started = time.perf_counter()
+            async with session.post(self.main_host_url, json=data) as response:
+                await response.read()
+                if response.status == 200:
+                    self.stats.sent += 1
+                    self.stats.record('track', time.perf_counter() - started)
+                else:
+                    self.stats.failed += 1
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.stats.failed += 1
+        finally:
+            slots.release()
+
+    async def run_patient(self, session, rows, offset, slots, in_flight):
+        """Send one patient's rows on a fixed schedule, independent of response latency"""
+        interval = self.patient_interval
+        next_at = time.monotonic() + offset
+        for time_diff_minutes, meta in enumerate(rows, start=1):
+            delay = next_at - time.monotonic()
+            # sleep(0) still yields when running as fast as possible
+            await asyncio.sleep(max(delay, 0))
+            next_at += interval
+
+            await self.dispatch(session, generate_updated_patient_data(meta, time_diff_minutes), slots, in_flight)
+
+    async def dispatch(self, session, data, slots, in_flight):
+        """Start processing one reading without waiting for it to finish"""
+        # Back-pressure: wait for a free slot rather than queueing unbounded work
+        await slots.acquire()
+        task = asyncio.ensure_future(self.process(session, data, slots))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+
+    async def produce(self, session, slots, in_flight):
+        """Start every reading's processing task; returns once all are started"""
+        patient_count = len(self.sheet_data)
+        interval = self.patient_interval
+        patients = [
+            self.run_patient(session, rows, interval * i / patient_count, slots, in_flight)
+            for i, rows in enumerate(self.sheet_data.values())
+        ]
+        await asyncio.gather(*patients)
+
+    async def report(self):
+        while True:
+            await asyncio.sleep(self.report_every)
+            target = f"{self.target_rate:.1f}" if self.target_rate else "max"
+            print(f"📊 {self.stats.rate():.1f} readings/s (target {target}) | sent {self.stats.sent} "
+                  f"| failed {self.stats.failed} | score failures {self.stats.score_failures}")
+
+    async def run(self):
+        connector = aiohttp.TCPConnector(limit=self.max_in_flight, keepalive_timeout=30)
+        timeout = aiohttp.ClientTimeout(total=self.request_timeout)
+        slots = asyncio.Semaphore(self.max_in_flight)
+        in_flight = set()
+
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            reporter = asyncio.ensure_future(self.report())
+            try:
+                await self.produce(session, slots, in_flight)
+                if in_flight:
+                    await asyncio.gather(*list(in_flight))
+            finally:
+                reporter.cancel()
+
+        print(f"All rows processed. Sent {self.stats.sent} readings at {self.stats.rate():.1f}/s "
+              f"({self.stats.failed} failed)")
+        return self.stats
+
+
+def simulate_traffic_async(sheet_data, **options):
+    """Run the async simulator to completion and return its stats"""
+    return asyncio.run(AsyncSimulator(sheet_data, **options).run())
@@ -0,0 +1,304 @@
+"""
+Load-generation benchmark for the ingest path (ml_service /predict + main_host /track).
+
+Starts main_host and ml_service as local processes standing in for the Docker
+services, then ramps synthetic patients (from generate_excel.generate_patient_records)
+through the async simulator stage by stage. For every stage it records the
+achieved readings/s, p50/p95/p99 latency of each call and the CPU and RSS of
+each service, and writes everything to a JSON report tagged with the git
+commit so runs can be compared across commits. The stand-in main_host keeps
+its write-ahead log and history, and both services their logs, in a temporary
+directory that is removed afterwards, so a run leaves the repository alone
+(pass --log-dir to keep the logs). The stand-in ml_service runs with its
+prediction cache off, so repeated synthetic readings are really scored.
+
+Usage:
+    python benchmark.py --stages 10,100,1000,10000 --stage-seconds 20
+    python benchmark.py --compare benchmark_report_old.json
+    python benchmark.py --log-dir /tmp/benchmark-logs
+
+CPU/RSS sampling reads /proc, so it needs Linux (the Docker images are Linux).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime
+
+from async_simulator import AsyncSimulator
+from generate_excel import generate_patient_records
+
+SERVICES_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name -> (directory, entry point, port variable, readiness path)
+STAND_INS = {
+    'main_host': ('main_host', 'app.py', 'MAIN_HOST_PORT', '/'),
+    'ml_service': ('ml_service', 'model.py', 'ML_SERVICE_PORT', '/ready'),
+}
+
+# Where a stand-in would otherwise keep data next to the real service's; these point into a
+# temporary directory removed after the run (an empty value turns the feature off)
+STAND_IN_DATA_VARIABLES = {
+    'main_host': {'WAL_DIR': 'wal', 'TSDB_DIR': 'tsdb', 'MAIN_HOST_SHARED_DIR': None},
+}
+
+# Fixed settings of the stand-ins, recorded in the report
+STAND_IN_SETTINGS = {
+    'ml_service': {'PREDICTION_CACHE_SIZE': '0'},
+}
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def latency_summary(values):
+    values = sorted(values)
+    summary = {'count': len(values)}
+    for pct in (50, 95, 99):
+        value = percentile(values, pct)
+        summary[f'p{pct}_ms'] = round(value * 1000, 3) if value is not None else None
+    return summary
+
+
+class ProcessSampler:
+    """CPU time and RSS of one process, read from /proc"""
+
+    def __init__(self, pid):
+        self.pid = pid
+
+    def cpu_seconds(self):
+        with open(f'/proc/{self.pid}/stat') as f:
+            # Fields after the command name; utime and stime are the 12th and 13th of those
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+    def rss_mb(self):
+        with open(f'/proc/{self.pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024.0
+        return None
+
+
+class StandInServices:
+    """Runs main_host and ml_service locally for the duration of a benchmark"""
+
+    def __init__(self, main_host_port=18000, ml_service_port=16000, log_dir=None):
+        self.ports = {'main_host': main_host_port, 'ml_service': ml_service_port}
+        self.log_dir = log_dir
+        self.processes = {}
+        self.data_dir = None
+
+    def url(self, name, path=''):
+        return f'http://127.0.0.1:{self.ports[name]}{path}'
+
+    def log_path(self, name):
+        return os.path.join(self.log_dir or os.path.join(self.data_dir, 'logs'), f'{name}.log')
+
+    def start(self, timeout=120):
+        self.data_dir = tempfile.mkdtemp(prefix='benchmark-')
+        os.makedirs(os.path.dirname(self.log_path('main_host')), exist_ok=True)
+        for name, (directory, entry_point, port_variable, _) in STAND_INS.items():
+            env = dict(os.environ, **{port_variable: str(self.ports[name])}, **STAND_IN_SETTINGS.get(name, {}))
+            for variable, subdirectory in STAND_IN_DATA_VARIABLES.get(name, {}).items():
+                env[variable] = os.path.join(self.data_dir, name, subdirectory) if subdirectory else ''
+            with open(self.log_path(name), 'w') as log:
+                self.processes[name] = subprocess.Popen(
+                    [sys.executable, entry_point], cwd=os.path.join(SERVICES_DIR, directory),
+                    env=env, stdout=log, stderr=subprocess.STDOUT,
+                )
+
+        deadline = time.monotonic() + timeout
+        for name, (_, _, _, ready_path) in STAND_INS.items():
+            while True:
+                if self.processes[name].poll() is not None:
+                    raise RuntimeError(f'{name} exited during startup:\n{self.log_tail(name)}')
+                try:
+                    with urllib.request.urlopen(self.url(name, ready_path), timeout=1):
+                        break
+                except OSError:
+                    if time.monotonic() > deadline:
+                        raise RuntimeError(f'{name} was not ready after {timeout}s:\n{self.log_tail(name)}')
+                    time.sleep(0.25)
+            print(f'✔ {name} ready on port {self.ports[name]}')
+
+    def log_tail(self, name, lines=20):
+        """Last lines of a stand-in's log, for errors (the default log directory is removed on stop)"""
+        with open(self.log_path(name), errors='replace') as f:
+            return ''.join(f.readlines()[-lines:])
+
+    def samplers(self):
+        return {name: ProcessSampler(process.pid) for name, process in self.processes.items()}
+
+    def stop(self):
+        for process in self.processes.values():
+            process.terminate()
+        for process in self.processes.values():
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        if self.data_dir:
+            shutil.rmtree(self.data_dir, ignore_errors=True)
+            self.data_dir = None
+
+
+def build_sheet_data(patients, records_per_patient):
+    """Synthetic patients in the same shape send_data.load_replay_streams returns"""
+    records = generate_patient_records(num_patients=patients, num_records_per_patient=records_per_patient)
+    return {f'Patient_{patient_id}': rows for patient_id, rows in records.items()}
+
+
+def run_stage(patients, stage_seconds, per_patient_rate, main_host_url, ml_url, samplers, max_in_flight):
+    """Drive one stage and return its measurements"""
+    records_per_patient = max(1, int(round(stage_seconds * per_patient_rate)))
+    sheet_data = build_sheet_data(patients, records_per_patient)
+    target_rate = patients * per_patient_rate if per_patient_rate > 0 else 0
+
+    before = {name: sampler.cpu_seconds() for name, sampler in samplers.items()}
+    started = time.monotonic()
+    simulator = AsyncSimulator(
+        sheet_data, target_rate=target_rate, max_in_flight=max_in_flight,
+        main_host_url=main_host_url, ml_url=ml_url, report_every=max(stage_seconds, 5),
+        record_latency=True,
+    )
+    stats = asyncio.run(simulator.run())
+    elapsed = time.monotonic() - started
+
+    services = {}
+    for name, sampler in samplers.items():
+        cpu = sampler.cpu_seconds() - before[name]
+        services[name] = {
+            'cpu_seconds': round(cpu, 3),
+            'cpu_percent': round(100.0 * cpu / elapsed, 1),
+            'rss_mb': round(sampler.rss_mb(), 1),
+        }
+
+    return {
+        'patients': patients,
+        'target_rate': target_rate,
+        'duration_seconds': round(elapsed, 3),
+        'sent': stats.sent,
+        'failed': stats.failed,
+        'score_failures': stats.score_failures,
+        'achieved_rate': round(stats.sent / elapsed, 2) if elapsed > 0 else 0.0,
+        'latency': {kind: latency_summary(values) for kind, values in stats.latencies.items()},
+        'services': services,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=SERVICES_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_reports(current, previous, tolerance=0.10):
+    """Print per-stage deltas and return the regressions beyond `tolerance`"""
+    regressions = []
+    previous_stages = {stage['patients']: stage for stage in previous.get('stages', [])}
+    print(f"\nComparing against {previous.get('git_commit')}")
+    for stage in current['stages']:
+        old = previous_stages.get(stage['patients'])
+        if not old:
+            continue
+        checks = [('achieved_rate', stage['achieved_rate'], old['achieved_rate'], True)]
+        for kind in ('predict', 'track'):
+            checks.append((f'{kind} p99_ms', stage['latency'][kind]['p99_ms'], old['latency'][kind]['p99_ms'], False))
+        for label, new_value, old_value, higher_is_better in checks:
+            if not new_value or not old_value:
+                continue
+            change = (new_value - old_value) / old_value
+            worse = -change if higher_is_better else change
+            marker = '❌' if worse > tolerance else '✔'
+            print(f"{marker} {stage['patients']:>6} patients | {label}: {old_value} -> {new_value} ({change:+.1%})")
+            if worse > tolerance:
+                regressions.append((stage['patients'], label, old_value, new_value))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the main_host + ml_service ingest path")
+    parser.add_argument('--stages', default='10,100,1000,10000', help="comma-separated patient counts to ramp through")
+    parser.add_argument('--stage-seconds', type=float, default=20.0)
+    parser.add_argument('--per-patient-rate', type=float, default=1.0,
+                        help="readings/s per patient (0 = as fast as possible)")
+    parser.add_argument('--max-in-flight', type=int, default=512)
+    parser.add_argument('--main-host-url', help="benchmark an already running main_host instead of a stand-in")
+    parser.add_argument('--ml-url', help="benchmark an already running ml_service instead of a stand-in")
+    parser.add_argument('--output', default='benchmark_report.json')
+    parser.add_argument('--log-dir', help="keep the stand-ins' logs here (default: removed with their data)")
+    parser.add_argument('--compare', help="previous report to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="relative change that counts as a regression")
+    args = parser.parse_args()
+
+    if bool(args.main_host_url) != bool(args.ml_url):
+        parser.error("--main-host-url and --ml-url must be given together (or neither, to start stand-ins)")
+
+    stages = [int(value) for value in args.stages.split(',') if value.strip()]
+    external = bool(args.main_host_url)
+    services = None if external else StandInServices(log_dir=args.log_dir)
+
+    report = {
+        'git_commit': git_commit(),
+        'created_at': datetime.utcnow().isoformat(),
+        'host': {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count()},
+        'config': {
+            'stages': stages, 'stage_seconds': args.stage_seconds,
+            'per_patient_rate': args.per_patient_rate, 'max_in_flight': args.max_in_flight,
+            'stand_ins': not external,
+            'stand_in_settings': {} if external else STAND_IN_SETTINGS,
+        },
+        'stages': [],
+    }
+
+    try:
+        if services:
+            services.start()
+            main_host_url = services.url('main_host', '/track')
+            ml_url = services.url('ml_service', '/predict')
+            samplers = services.samplers()
+        else:
+            main_host_url, ml_url, samplers = args.main_host_url, args.ml_url, {}
+
+        for patients in stages:
+            print(f"\n🚀 Stage: {patients} patients")
+            result = run_stage(patients, args.stage_seconds, args.per_patient_rate,
+                               main_host_url, ml_url, samplers, args.max_in_flight)
+            report['stages'].append(result)
+            print(json.dumps(result, indent=2))
+    finally:
+        if services:
+            services.stop()
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n📄 Report written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare_reports(report, json.load(f), args.tolerance)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,84 +1,220 @@
+"""
+Synthetic patient cohorts for the simulator, benchmarks and model training.
+
+Readings are drawn with NumPy a chunk at a time as column arrays, so large
+cohorts (10,000 patients x 10,000 readings) can be written without holding
+them in memory:
+
+    python generate_excel.py --patients 10000 --records 10000 --output cohort.parquet --seed 7
+
+Every reading draws its vitals from the normal ranges. With probability
+anomaly_rate it then gets 1-3 of the six core vitals replaced by a value from
+one of that vital's abnormal ranges. Output is ordered reading 0 of every
+patient, then reading 1, ..., which is the order the simulator replays flat
+files in. .parquet and .ndjson are written chunk by chunk; .xlsx keeps the
+original one-sheet-per-patient workbook and is only meant for small cohorts.
+"""
+
+from datetime import datetime
+
+import numpy as np
 import pandas as pd
-import random
-from datetime import datetime, timedelta
-
-def generate_patient_records(num_patients=15, num_records_per_patient=150):
-    all_patient_records = {}
-    
-    for i in range(1, num_patients + 1):
-        # Assign the same hospital, department, and ward for each patient
-        hospital = random.choice(["1", "2"])
-        dept = random.choice(["A", "B"])
-        ward = str(random.randint(1, 4))
-        
-        # Start timestamp for each patient
-        patient_start_time = datetime.utcnow() - timedelta(minutes=random.randint(100, 500))
-        patient_records = []
-        
-        for j in range(num_records_per_patient):
-            # Normal values
-            heart_rate = random.randint(60, 100)
-            bp_systolic = random.randint(100, 130)
-            bp_diastolic = random.randint(60, 90)
-            respiratory_rate = random.randint(12, 20)
-            spo2 = random.randint(85, 98)
-            etco2 = random.randint(30, 45)
-
-            if random.random() < 0.15:  # 5% chance of anomalies
-                anomaly_fields = random.sample(
-                    ["heart_rate", "bp_systolic", "bp_diastolic", "respiratory_rate", "spo2", "etco2"],
-                    k=random.randint(1, 3)
-                )
-                for field in anomaly_fields:
-                    if field == "heart_rate":
-                        heart_rate = random.choice([random.randint(30, 50), random.randint(120, 160)])
-                    elif field == "bp_systolic":
-                        bp_systolic = random.choice([random.randint(70, 90), random.randint(140, 170)])
-                    elif field == "bp_diastolic":
-                        bp_diastolic = random.choice([random.randint(40, 55), random.randint(95, 110)])
-                    elif field == "respiratory_rate":
-                        respiratory_rate = random.choice([random.randint(5, 10), random.randint(25, 35)])
-                    elif field == "spo2":
-                        spo2 = random.randint(70, 84)
-                    elif field == "etco2":
-                        etco2 = random.choice([random.randint(10, 25), random.randint(46, 60)])
-
-            # Increase timestamp by 1 minute for each record
-            record_time = patient_start_time + timedelta(minutes=j)
-
-            record = {
-                "hospital": hospital,
-                "dept": dept,
-                "ward": ward,
-                "patient": str(i),
-                "timestamp": record_time.isoformat(),
-                "heart_rate": heart_rate,
-                "bp_systolic": bp_systolic,
-                "bp_diastolic": bp_diastolic,
-                "respiratory_rate": respiratory_rate,
-                "spo2": spo2,
-                "etco2": etco2,
-                "fio2": 21,
-                "temperature": round(random.uniform(36.5, 38.0), 1),
-                "wbc_count": round(random.uniform(4.0, 12.0), 1),
-                "lactate": round(random.uniform(1.0, 3.0), 1),
-                "blood_glucose": random.randint(70, 180),
-                "ecg_signal": "dummy_waveform_data"
-            }
-            patient_records.append(record)
-        
-        # Store patient records in the dictionary
-        all_patient_records[str(i)] = patient_records
 
+# Normal ranges (inclusive) of the vitals drawn as integers
+NORMAL_RANGES = {
+    'heart_rate': (60, 100),
+    'bp_systolic': (100, 130),
+    'bp_diastolic': (60, 90),
+    'respiratory_rate': (12, 20),
+    'spo2': (85, 98),
+    'etco2': (30, 45),
+}
+
+# Abnormal ranges (inclusive); an anomalous vital picks one of them with equal odds
+ANOMALY_RANGES = {
+    'heart_rate': [(30, 50), (120, 160)],
+    'bp_systolic': [(70, 90), (140, 170)],
+    'bp_diastolic': [(40, 55), (95, 110)],
+    'respiratory_rate': [(5, 10), (25, 35)],
+    'spo2': [(70, 84)],
+    'etco2': [(10, 25), (46, 60)],
+}
+
+COLUMNS = [
+    'hospital', 'dept', 'ward', 'patient', 'timestamp',
+    'heart_rate', 'bp_systolic', 'bp_diastolic', 'respiratory_rate', 'spo2', 'etco2',
+    'fio2', 'temperature', 'wbc_count', 'lactate', 'blood_glucose', 'ecg_signal',
+]
+
+DEFAULT_ANOMALY_RATE = 0.15
+DEFAULT_CHUNK_ROWS = 1_000_000
+
+
+def draw_int(rng, low, high, size):
+    """Integers in [low, high], like random.randint"""
+    return rng.integers(low, high + 1, size=size)
+
+
+def generate_cohort_chunks(num_patients=15, num_records_per_patient=150, anomaly_rate=DEFAULT_ANOMALY_RATE,
+                           seed=None, chunk_rows=DEFAULT_CHUNK_ROWS, reference_time=None):
+    """Yield the cohort as dicts of column arrays of about chunk_rows readings each
+
+    Each patient gets a fixed hospital/dept/ward and a first reading 100-500
+    minutes before reference_time (default now, UTC), then one reading a minute.
+    The same seed and reference_time give the same cohort.
+    """
+    rng = np.random.default_rng(seed)
+    reference_time = np.datetime64(reference_time or datetime.utcnow(), 'us')
+
+    patients = np.array([str(i) for i in range(1, num_patients + 1)], dtype=object)
+    hospitals = rng.choice(np.array(['1', '2'], dtype=object), size=num_patients)
+    depts = rng.choice(np.array(['A', 'B'], dtype=object), size=num_patients)
+    wards = draw_int(rng, 1, 4, num_patients).astype(str).astype(object)
+    starts = reference_time - draw_int(rng, 100, 500, num_patients).astype('timedelta64[m]')
+
+    records_per_chunk = max(1, chunk_rows // max(num_patients, 1))
+    vitals = list(NORMAL_RANGES)
+    for first_record in range(0, num_records_per_patient, records_per_chunk):
+        records = min(records_per_chunk, num_records_per_patient - first_record)
+        size = records * num_patients
+        # Reading-major order: patient index cycles fastest
+        patient_index = np.tile(np.arange(num_patients), records)
+        record_index = np.repeat(np.arange(first_record, first_record + records), num_patients)
+
+        chunk = {
+            'hospital': hospitals[patient_index],
+            'dept': depts[patient_index],
+            'ward': wards[patient_index],
+            'patient': patients[patient_index],
+            'timestamp': starts[patient_index] + record_index.astype('timedelta64[m]'),
+        }
+        for field, (low, high) in NORMAL_RANGES.items():
+            chunk[field] = draw_int(rng, low, high, size)
+
+        # Anomalous readings replace k = 1-3 distinct vitals: ranking random keys
+        # gives each row a random order of the vitals, and the first k are taken
+        anomalous = np.flatnonzero(rng.random(size) < anomaly_rate)
+        k = draw_int(rng, 1, 3, len(anomalous))
+        ranks = rng.random((len(anomalous), len(vitals))).argsort(axis=1).argsort(axis=1)
+        replaced = ranks < k[:, None]
+        for column, field in enumerate(vitals):
+            rows = anomalous[replaced[:, column]]
+            ranges = ANOMALY_RANGES[field]
+            side = rng.integers(0, len(ranges), size=len(rows))
+            values = np.empty(len(rows), dtype=chunk[field].dtype)
+            for choice, (low, high) in enumerate(ranges):
+                picked = side == choice
+                values[picked] = draw_int(rng, low, high, int(picked.sum()))
+            chunk[field][rows] = values
+
+        chunk['fio2'] = np.full(size, 21)
+        chunk['temperature'] = np.round(rng.uniform(36.5, 38.0, size), 1)
+        chunk['wbc_count'] = np.round(rng.uniform(4.0, 12.0, size), 1)
+        chunk['lactate'] = np.round(rng.uniform(1.0, 3.0, size), 1)
+        chunk['blood_glucose'] = draw_int(rng, 70, 180, size)
+        chunk['ecg_signal'] = np.full(size, 'dummy_waveform_data', dtype=object)
+        yield {column: chunk[column] for column in COLUMNS}
+
+
+def timestamp_strings(timestamps):
+    """ISO-8601 strings, as datetime.isoformat() writes them in the workbook"""
+    return np.datetime_as_string(timestamps, unit='us')
+
+
+def generate_patient_records(num_patients=15, num_records_per_patient=150, **options):
+    """Cohort as {patient id: [reading dict, ...]}, for small in-memory uses"""
+    all_patient_records = {str(i): [] for i in range(1, num_patients + 1)}
+    for chunk in generate_cohort_chunks(num_patients, num_records_per_patient, **options):
+        columns = dict(chunk, timestamp=timestamp_strings(chunk['timestamp']))
+        # tolist() gives plain Python values, so the dicts serialize as JSON
+        values = [columns[column].tolist() for column in COLUMNS]
+        for row in zip(*values):
+            record = dict(zip(COLUMNS, row))
+            all_patient_records[record['patient']].append(record)
     return all_patient_records
 
-# Create an Excel writer object
-with pd.ExcelWriter("/app/data/patients_data.xlsx") as writer:
-    patient_data = generate_patient_records()
-    
-    # Write each patient's data to a different sheet
-    for patient_id, records in patient_data.items():
-        df = pd.DataFrame(records)
-        df.to_excel(writer, sheet_name=f"Patient_{patient_id}", index=False)
 
-print("patients_data.xlsx created successfully")
\ No newline at end of file
+def write_parquet(path, chunks):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    written = 0
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pydict(chunk)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema, compression='zstd')
+            # One row group per chunk
+            writer.write_table(table)
+            written += table.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return written
+
+
+def write_ndjson(path, chunks):
+    written = 0
+    with open(path, 'w') as f:
+        for chunk in chunks:
+            frame = pd.DataFrame(dict(chunk, timestamp=timestamp_strings(chunk['timestamp'])))
+            if frame.empty:
+                continue
+            lines = frame.to_json(orient='records', lines=True)
+            # Older pandas leaves off the final newline
+            f.write(lines if lines.endswith('\n') else lines + '\n')
+            written += len(frame)
+    return written
+
+
+def write_excel(path="/app/data/patients_data.xlsx", **options):
+    # Create an Excel writer object
+    with pd.ExcelWriter(path) as writer:
+        patient_data = generate_patient_records(**options)
+
+        # Write each patient's data to a different sheet
+        for patient_id, records in patient_data.items():
+            df = pd.DataFrame(records)
+            df.to_excel(writer, sheet_name=f"Patient_{patient_id}", index=False)
+
+    print("patients_data.xlsx created successfully")
+
+
+def write_cohort(path, num_patients=15, num_records_per_patient=150, **options):
+    """Write a cohort to .parquet, .ndjson/.jsonl or .xlsx, chosen by the file extension"""
+    if path.endswith('.xlsx'):
+        write_excel(path, num_patients=num_patients, num_records_per_patient=num_records_per_patient, **options)
+        return num_patients * num_records_per_patient
+    chunks = generate_cohort_chunks(num_patients, num_records_per_patient, **options)
+    if path.endswith('.parquet'):
+        return write_parquet(path, chunks)
+    if path.endswith(('.ndjson', '.jsonl')):
+        return write_ndjson(path, chunks)
+    raise ValueError(f"Unsupported cohort file '{path}' (expected .parquet, .ndjson, .jsonl or .xlsx)")
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Generate a synthetic patient cohort")
+    parser.add_argument('--output', default="/app/data/patients_data.xlsx",
+                        help=".parquet or .ndjson for large cohorts, .xlsx for the simulator's workbook")
+    parser.add_argument('--patients', type=int, default=15)
+    parser.add_argument('--records', type=int, default=150, help="readings per patient, one a minute")
+    parser.add_argument('--anomaly-rate', type=float, default=DEFAULT_ANOMALY_RATE,
+                        help="share of readings with 1-3 abnormal vitals")
+    parser.add_argument('--seed', type=int, default=None, help="same seed (and --reference-time) = same cohort")
+    parser.add_argument('--reference-time', type=datetime.fromisoformat, default=None,
+                        help="ISO time the first readings are counted back from (default: now, UTC)")
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS,
+                        help="readings generated and written at a time")
+    args = parser.parse_args()
+
+    options = {'anomaly_rate': args.anomaly_rate, 'seed': args.seed, 'reference_time': args.reference_time,
+               'chunk_rows': args.chunk_rows}
+    started = time.perf_counter()
+    count = write_cohort(args.output, args.patients, args.records, **options)
+    elapsed = time.perf_counter() - started
+    print(f"✅ Wrote {count} readings to {args.output} in {elapsed:.1f}s")
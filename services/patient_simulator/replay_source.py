@@ -0,0 +1,187 @@
+"""
+Replay sources: patient rows read lazily from the file being replayed.
+
+open_replay_source(path) picks a reader from the file extension:
+
+    .xlsx              one stream per sheet (the original one-sheet-per-patient
+                       layout), read with openpyxl in read-only mode
+    .parquet           one stream of rows in file order, read a record batch
+                       at a time (needs pyarrow)
+    .csv               one stream of rows in file order, read in chunks
+    .ndjson / .jsonl   one stream of rows in file order, a line at a time
+
+Nothing is read up front beyond what the first row needs, so the first reading
+goes out immediately and memory does not grow with the file. Flat files are
+replayed in file order, so write them row 0 of every patient, then row 1, ...
+(convert_to_parquet does that for a workbook).
+
+Convert the workbook once with:
+    python replay_source.py /app/data/patients_data.xlsx /app/data/patients_data.parquet
+"""
+
+import itertools
+import json
+import os
+from datetime import datetime
+
+import pandas as pd
+
+# Rows per Parquet record batch / CSV chunk read at a time
+BATCH_ROWS = 4096
+
+# Location labels, kept as strings whatever type the reader infers
+LABEL_COLUMNS = ('hospital', 'dept', 'ward', 'patient')
+
+
+def normalize_row(row):
+    """Row dict with location labels and timestamp as strings, the way the workbook stores them"""
+    if isinstance(row.get('timestamp'), datetime):
+        row['timestamp'] = row['timestamp'].isoformat()
+    for column in LABEL_COLUMNS:
+        value = row.get(column)
+        if value is not None and not isinstance(value, str):
+            row[column] = str(int(value)) if isinstance(value, float) and value.is_integer() else str(value)
+    return row
+
+
+class ExcelSource:
+    """One stream per sheet of an .xlsx workbook"""
+
+    def __init__(self, path):
+        import openpyxl
+
+        self.workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+
+    def _sheet_rows(self, sheet):
+        rows = sheet.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        for values in rows:
+            if all(value is None for value in values):
+                continue
+            yield normalize_row(dict(zip(header, values)))
+
+    def streams(self):
+        return {sheet.title: self._sheet_rows(sheet) for sheet in self.workbook.worksheets}
+
+
+class ParquetSource:
+    """Rows of a Parquet file, one record batch at a time"""
+
+    def __init__(self, path):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Replaying Parquet files needs pyarrow (pip install pyarrow)")
+        self.path = path
+        self.file = pq.ParquetFile(path)
+
+    def _rows(self):
+        for batch in self.file.iter_batches(batch_size=BATCH_ROWS):
+            for row in batch.to_pylist():
+                yield normalize_row(row)
+
+    def streams(self):
+        return {os.path.basename(self.path): self._rows()}
+
+
+class CsvSource:
+    """Rows of a CSV file, read in chunks"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def _rows(self):
+        chunks = pd.read_csv(self.path, chunksize=BATCH_ROWS, dtype={column: str for column in LABEL_COLUMNS})
+        for chunk in chunks:
+            # None instead of NaN for empty cells, as the other readers give
+            chunk = chunk.astype(object).where(chunk.notna(), None)
+            for row in chunk.to_dict(orient='records'):
+                yield row
+
+    def streams(self):
+        return {os.path.basename(self.path): self._rows()}
+
+
+class NdjsonSource:
+    """Rows of a newline-delimited JSON file, a line at a time"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def _rows(self):
+        with open(self.path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield normalize_row(json.loads(line))
+
+    def streams(self):
+        return {os.path.basename(self.path): self._rows()}
+
+
+SOURCES = {
+    '.xlsx': ExcelSource,
+    '.parquet': ParquetSource,
+    '.csv': CsvSource,
+    '.ndjson': NdjsonSource,
+    '.jsonl': NdjsonSource,
+}
+
+
+def open_replay_source(path):
+    """Reader for a replay file, chosen by its extension"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in SOURCES:
+        raise ValueError(f"Unsupported replay file '{path}' (expected one of {', '.join(sorted(SOURCES))})")
+    return SOURCES[extension](path)
+
+
+def interleave(streams):
+    """Row 0 of every stream, then row 1, ... until all streams run out"""
+    iterators = [iter(rows) for rows in streams.values()]
+    while iterators:
+        remaining = []
+        for rows in iterators:
+            row = next(rows, None)
+            if row is not None:
+                remaining.append(rows)
+                yield row
+        iterators = remaining
+
+
+def convert_to_parquet(source_path, parquet_path, batch_rows=50000):
+    """Rewrite a replay file as Parquet, interleaved the way the sync simulator sends it"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    rows = interleave(open_replay_source(source_path).streams())
+    writer = None
+    written = 0
+    try:
+        while True:
+            batch = list(itertools.islice(rows, batch_rows))
+            if not batch:
+                break
+            table = pa.Table.from_pylist(batch)
+            if writer is None:
+                writer = pq.ParquetWriter(parquet_path, table.schema, compression='zstd')
+            writer.write_table(table.cast(writer.schema))
+            written += len(batch)
+    finally:
+        if writer is not None:
+            writer.close()
+    return written
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert a replay file (e.g. patients_data.xlsx) to Parquet")
+    parser.add_argument('source')
+    parser.add_argument('target')
+    args = parser.parse_args()
+
+    count = convert_to_parquet(args.source, args.target)
+    print(f"✅ Wrote {count} rows to {args.target}")
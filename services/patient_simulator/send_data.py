@@ -1,30 +1,16 @@
 import requests
 import time
-import pandas as pd
 from datetime import datetime, timedelta
 import os
 import random
-import numpy as np
 import json
 
+from replay_source import open_replay_source, interleave
+
 # URLs
 MAIN_HOST = 'http://main_host:8000/track'
 ML_MODEL_URL = 'http://ml_service:6000/predict'  # Change 'ml_service' based on your Docker network
 
-# Read Excel file with multiple sheets
-def read_patient_data_from_excel(file_path):
-    if not os.path.exists(file_path):
-        print(f"Error: The file '{file_path}' does not exist.")
-        return []
-    
-    try:
-        df_sheets = pd.read_excel(file_path, sheet_name=None)
-    except Exception as e:
-        print(f"Error reading the Excel file: {e}")
-        return []
-    
-    return df_sheets
-
 # Generate slightly updated vitals
 def generate_updated_patient_data(meta, time_diff_minutes=1):
     heart_rate = meta['heart_rate'] + random.randint(-5, 5)
@@ -60,6 +46,15 @@ def generate_updated_patient_data(meta, time_diff_minutes=1):
         "ecg_signal": "dummy_waveform_data"
     }
 
+# Pull the anomaly score out of an ML service response
+def score_from_response(response_data):
+    # Handle both old and new response formats
+    if "normalized_score" in response_data:
+        return float(response_data.get("normalized_score", 0.0))
+    if "anomaly_score" in response_data:
+        return float(response_data.get("anomaly_score", 0.0))
+    return 0.0
+
 # Get anomaly score from ML service
 def get_anomaly_score(data):
     try:
@@ -68,16 +63,8 @@ def get_anomaly_score(data):
             response_data = response.json()
             print(f"DEBUG: ML service response: {response_data}")
             
-            # Handle both old and new response formats
-            if "normalized_score" in response_data:
-                anomaly_score = float(response_data.get("normalized_score", 0.0))
-                print(f"DEBUG: Using normalized score: {anomaly_score}")
-            elif "anomaly_score" in response_data:
-                anomaly_score = float(response_data.get("anomaly_score", 0.0))
-                print(f"DEBUG: Using legacy anomaly score: {anomaly_score}")
-            else:
-                print("DEBUG: No valid score found in response")
-                anomaly_score = 0.0
+            anomaly_score = score_from_response(response_data)
+            print(f"DEBUG: Using anomaly score: {anomaly_score}")
                 
             return anomaly_score
         else:
@@ -87,53 +74,97 @@ def get_anomaly_score(data):
         print(f"Error contacting ML service: {e}")
         return 0.0
 
-# Simulate traffic
-def simulate_traffic(file_path):
-    sheets = read_patient_data_from_excel(file_path)
-    if not sheets:
-        return
-
-    sheet_names = list(sheets.keys())
-    sheet_data = {name: sheets[name].to_dict(orient='records') for name in sheet_names}
+# Open a replay file as lazily read row streams keyed by sheet / file name (see replay_source.py)
+def load_replay_streams(file_path):
+    if not os.path.exists(file_path):
+        print(f"Error: The file '{file_path}' does not exist.")
+        return {}
 
-    row_index = 0
-    time_diff_minutes = 1
+    try:
+        return open_replay_source(file_path).streams()
+    except Exception as e:
+        print(f"Error reading the replay file: {e}")
+        return {}
 
-    while True:
-        active = False
+# Simulate traffic (skip_predict leaves scoring to main_host's INGEST_SCORING)
+def simulate_traffic(file_path, skip_predict=False):
+    streams = load_replay_streams(file_path)
+    if not streams:
+        return
 
-        for sheet_name in sheet_names:
-            rows = sheet_data[sheet_name]
-            if row_index < len(rows):
-                active = True
-                patient_meta = rows[row_index]
+    time_diff_minutes = 1
 
-                data = generate_updated_patient_data(patient_meta, time_diff_minutes)
+    # Same order as before: row 0 of every sheet, then row 1, ...
+    for patient_meta in interleave(streams):
+        data = generate_updated_patient_data(patient_meta, time_diff_minutes)
 
-                anomaly_score = get_anomaly_score(data)
-                data["anomaly_score"] = anomaly_score
+        if skip_predict:
+            anomaly_score = "scored by main_host"
+        else:
+            anomaly_score = get_anomaly_score(data)
+            data["anomaly_score"] = anomaly_score
 
-                print("Sending Updated Data:", data)
+        print("Sending Updated Data:", data)
 
-                try:
-                    response = requests.post(MAIN_HOST, json=data)
-                    if response.status_code == 200:
-                        print(f"✔ Sent | Patient: {data['patient']} | Score: {anomaly_score}")
-                    else:
-                        print(f"✘ Failed | Status: {response.status_code} | Patient: {data['patient']}")
-                except requests.exceptions.RequestException as e:
-                    print(f"Error while sending data: {e}")
+        try:
+            response = requests.post(MAIN_HOST, json=data)
+            if response.status_code == 200:
+                print(f"✔ Sent | Patient: {data['patient']} | Score: {anomaly_score}")
+            else:
+                print(f"✘ Failed | Status: {response.status_code} | Patient: {data['patient']}")
+        except requests.exceptions.RequestException as e:
+            print(f"Error while sending data: {e}")
 
-                time.sleep(1)
-                time_diff_minutes += 1
+        time.sleep(1)
+        time_diff_minutes += 1
 
-        if not active:
-            print("All rows processed.")
-            break
+    print("All rows processed.")
 
-        row_index += 1
+# Replay speed from the command line: a multiplier, or "max" (0) for as fast as possible
+def parse_speed(value):
+    if str(value).lower() == 'max':
+        return 0.0
+    speed = float(value)
+    if speed < 0:
+        raise ValueError("speed must be positive or 'max'")
+    return speed
 
 # Main
 if __name__ == '__main__':
-    file_path = "/app/data/patients_data.xlsx"
-    simulate_traffic(file_path)
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Replay patient vitals into ml_service and main_host")
+    parser.add_argument('--file', default=os.environ.get('SIMULATOR_FILE', "/app/data/patients_data.xlsx"),
+                        help="replay file: .xlsx (one sheet per patient), .parquet, .csv or .ndjson")
+    parser.add_argument('--mode', choices=['sync', 'async', 'replay'], default=os.environ.get('SIMULATOR_MODE', 'sync'),
+                        help="sync: one patient at a time (original behaviour); async: all patients concurrently; "
+                             "replay: recorded readings on the schedule of their timestamps")
+    parser.add_argument('--rate', type=float, default=float(os.environ.get('SIMULATOR_RATE', 15)),
+                        help="async mode: target aggregate readings/second (0 = as fast as possible)")
+    parser.add_argument('--max-in-flight', type=int, default=int(os.environ.get('SIMULATOR_MAX_IN_FLIGHT', 256)),
+                        help="async mode: readings allowed in flight at once")
+    parser.add_argument('--skip-predict', action='store_true',
+                        default=os.environ.get('SIMULATOR_SKIP_PREDICT', '0').lower() in ('1', 'true', 'yes'),
+                        help="don't call ml_service; main_host scores readings on ingest (INGEST_SCORING)")
+    parser.add_argument('--speed', type=parse_speed, default=parse_speed(os.environ.get('SIMULATOR_SPEED', '1')),
+                        help="replay mode: speed-up over the recorded timestamps (1, 60, ... or max)")
+    parser.add_argument('--clock', choices=['patient', 'shared'], default=os.environ.get('SIMULATOR_CLOCK', 'patient'),
+                        help="replay mode: start every patient at once (patient) or keep offsets between patients (shared)")
+    args = parser.parse_args()
+
+    if args.mode == 'replay':
+        from timed_replay import replay_traffic
+
+        streams = load_replay_streams(args.file)
+        if streams:
+            replay_traffic(streams, speed=args.speed, clock=args.clock, max_in_flight=args.max_in_flight,
+                           skip_predict=args.skip_predict)
+    elif args.mode == 'async':
+        from async_simulator import simulate_traffic_async
+
+        streams = load_replay_streams(args.file)
+        if streams:
+            simulate_traffic_async(streams, target_rate=args.rate, max_in_flight=args.max_in_flight,
+                                   skip_predict=args.skip_predict)
+    else:
+        simulate_traffic(args.file, skip_predict=args.skip_predict)
\ No newline at end of file
@@ -0,0 +1,165 @@
+"""
+Time-accelerated replay: readings are sent when their recorded timestamp comes due.
+
+Unlike the sync and async modes, which jitter each row and stamp it with the
+current time, replay sends rows as recorded (values and timestamp) and spaces
+them by their `timestamp` column divided by `speed`: 1 is real time, 60 plays
+an hour a minute, 0 ("max") sends as fast as main_host takes them. A day of
+data at 1440x takes a minute.
+
+Schedules follow one of two clocks:
+
+    patient  every patient starts at once and keeps the spacing of its own
+             recording (default; works with files that interleave patients
+             whose recordings start at different times, like generated cohorts)
+    shared   readings keep their absolute offsets from the earliest reading
+
+Rows go through a reorder buffer of `lookahead` rows and leave it in schedule
+order. A row more out of place than that is sent as soon as it is read and
+counted as late. Workbook sheets (one patient each, already in order) are
+merged without a buffer.
+
+Run with:
+    python send_data.py --mode replay --file cohort.parquet --speed 60
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from datetime import datetime, timezone
+
+from async_simulator import AsyncSimulator, SimulatorStats
+
+# Rows held back to put flat files into schedule order
+DEFAULT_LOOKAHEAD = 10000
+
+CLOCKS = ('patient', 'shared')
+
+
+def reading_time(row):
+    """Epoch seconds of a row's recorded timestamp (naive ISO is UTC), None if it has none"""
+    value = row.get('timestamp')
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class ReplayStats(SimulatorStats):
+    """Simulator counters plus how closely the replay keeps to its schedule"""
+
+    def __init__(self, record_latency=False):
+        super().__init__(record_latency)
+        self.scheduled = 0
+        self.late = 0
+        self.skipped = 0
+        # Replay-clock seconds covered so far, and how far sending is behind schedule
+        self.replayed_seconds = 0.0
+        self.lag = 0.0
+
+    def target_rate(self, speed):
+        """Readings/s the schedule asked for so far (None until it has covered any time)"""
+        if self.replayed_seconds <= 0:
+            return None
+        return self.scheduled / (self.replayed_seconds / speed)
+
+    def achieved_speed(self):
+        elapsed = time.monotonic() - self.started
+        return self.replayed_seconds / elapsed if elapsed > 0 else 0.0
+
+
+class TimedReplay(AsyncSimulator):
+    """Sends recorded readings on the schedule of their timestamps, sped up by `speed`"""
+
+    def __init__(self, sheet_data, speed=1.0, clock='patient', lookahead=None, **options):
+        super().__init__(sheet_data, **options)
+        if clock not in CLOCKS:
+            raise ValueError(f"clock must be one of {', '.join(CLOCKS)}, not {clock!r}")
+        self.speed = speed
+        self.clock = clock
+        if lookahead is None:
+            # Sheets hold one patient each, in order; flat files need reordering
+            lookahead = 0 if len(sheet_data) > 1 else DEFAULT_LOOKAHEAD
+        self.lookahead = lookahead
+        self.stats = ReplayStats(self.stats.latencies is not None)
+
+    def _keyed(self, rows, counter, origins):
+        """(schedule key, tie-breaker, row) for each row with a timestamp"""
+        for row in rows:
+            recorded = reading_time(row)
+            if recorded is None:
+                self.stats.skipped += 1
+                continue
+            if self.clock == 'patient':
+                patient = (row.get('hospital'), row.get('dept'), row.get('ward'), row.get('patient'))
+                recorded -= origins.setdefault(patient, recorded)
+            yield recorded, next(counter), row
+
+    def in_schedule_order(self):
+        """Yield (schedule key, tie-breaker, row) for all rows, reordered within the lookahead"""
+        counter = itertools.count()
+        origins = {}
+        merged = heapq.merge(*[self._keyed(rows, counter, origins) for rows in self.sheet_data.values()])
+        buffer = []
+        for item in merged:
+            heapq.heappush(buffer, item)
+            if len(buffer) > self.lookahead:
+                yield heapq.heappop(buffer)
+        while buffer:
+            yield heapq.heappop(buffer)
+
+    async def produce(self, session, slots, in_flight):
+        stats = self.stats
+        started = None
+        origin = None
+        for key, _, row in self.in_schedule_order():
+            if started is None:
+                started, origin = time.monotonic(), key
+            offset = key - origin
+            if offset < stats.replayed_seconds:
+                stats.late += 1
+            else:
+                stats.replayed_seconds = offset
+            if self.speed > 0:
+                delay = started + offset / self.speed - time.monotonic()
+                stats.lag = max(-delay, 0.0)
+            else:
+                delay = 0
+            # sleep(0) still yields when running as fast as possible
+            await asyncio.sleep(max(delay, 0))
+            stats.scheduled += 1
+            await self.dispatch(session, dict(row), slots, in_flight)
+
+    def describe_rate(self):
+        if self.speed > 0:
+            target = self.stats.target_rate(self.speed)
+            target = "-" if target is None else f"{target:.1f}"
+            speed = f"{self.speed:g}x"
+        else:
+            target = speed = "max"
+        return (f"{self.stats.rate():.1f} readings/s (target {target}) "
+                f"| replay {self.stats.achieved_speed():.1f}x of {speed} | lag {self.stats.lag:.1f}s")
+
+    async def report(self):
+        while True:
+            await asyncio.sleep(self.report_every)
+            print(f"📊 {self.describe_rate()} | sent {self.stats.sent} | failed {self.stats.failed} "
+                  f"| late {self.stats.late} | score failures {self.stats.score_failures}")
+
+    async def run(self):
+        stats = await super().run()
+        print(f"⏱ Replayed {stats.replayed_seconds / 3600:.2f}h of recordings: {self.describe_rate()} "
+              f"| {stats.late} late, {stats.skipped} without a timestamp")
+        return stats
+
+
+def replay_traffic(sheet_data, **options):
+    """Replay recorded readings on their timestamps' schedule and return the stats"""
+    return asyncio.run(TimedReplay(sheet_data, **options).run())
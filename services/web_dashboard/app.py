@@ -1,4 +1,4 @@
-from flask import Flask, render_template, jsonify, request, send_file, redirect, url_for
+from flask import Flask, Response, render_template, jsonify, request, send_file, redirect, url_for
 import requests
 import os
 import json
@@ -54,6 +54,8 @@ from models.patient import Patient, PatientVitalSign, PatientLocation, PatientMe
 from routes.auth import auth as auth_blueprint
 from routes.patients import patients as patients_blueprint
 from routes.main import main as main_blueprint
+from utils.api import main_host_api
+from utils.stream import stream_relay
 
 # Register blueprints
 app.register_blueprint(auth_blueprint, url_prefix='/auth')
@@ -82,9 +84,8 @@ def inject_monitoring_urls():
 def get_patients():
     """Get list of all patients"""
     try:
-        # Query the main_host for a list of patients
-        response = requests.get(f"{MAIN_HOST_URL}/api/patients")
-        return response.json()
+        # Query the main_host for a list of patients (pooled, cached for a second, coalesced)
+        return jsonify(main_host_api.fetch('/api/patients').data)
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
@@ -93,21 +94,33 @@ def get_patient_data(patient_id):
     """Get data for a specific patient"""
     try:
         # Query the main_host for data for the specified patient
-        response = requests.get(f"{MAIN_HOST_URL}/api/patient/{patient_id}")
-        return response.json()
+        return jsonify(main_host_api.fetch(f'/api/patient/{patient_id}').data)
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route('/api/metrics')
 def get_metrics():
-    """Get latest metrics from main_host"""
+    """Get latest metrics from main_host (?since=<seq> is passed through, If-None-Match is honoured)"""
     try:
         # Query the main_host for dashboard data
-        response = requests.get(f"{MAIN_HOST_URL}/api/dashboard-data")
-        return response.json()
+        response = main_host_api.fetch('/api/dashboard-data', params=request.args.to_dict())
+        if response.etag and request.if_none_match.contains(response.etag.strip('"')):
+            return Response(status=304, headers={'ETag': response.etag})
+        result = jsonify(response.data)
+        if response.etag:
+            result.headers['ETag'] = response.etag
+        return result
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/api/stream')
+def stream_metrics():
+    """Live patient readings as server-sent events, relayed from main_host /stream"""
+    return Response(stream_relay.events(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
 @app.route('/api/monitoring-urls')
 def get_monitoring_urls():
     """Get URLs for monitoring services"""
@@ -5,16 +5,17 @@ from flask_login import login_required, current_user
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from utils.api import main_host_api
+from utils.snapshot import dashboard_snapshot
 
 main = Blueprint('main', __name__)
 
 @main.route('/')
 def index():
     """Landing page for the application (now the only dashboard)"""
-    # Pre-fetch data to ensure consistency with patients page
-    dashboard_data = main_host_api.get_dashboard_data()
-    return render_template('index.html', dashboard_available=dashboard_data is not None)
+    # Same background-refreshed snapshot as the patients page, read without waiting on main host
+    snapshot = dashboard_snapshot.get()
+    return render_template('index.html', dashboard_available=snapshot.available,
+                           snapshot_age=snapshot.age_seconds)
 
 @main.route('/monitoring')
 def monitoring():
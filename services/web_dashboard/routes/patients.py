@@ -11,56 +11,16 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils.api import main_host_api
+from utils.snapshot import dashboard_snapshot
 
 # Patient views (HTML pages)
 @patients.route('/')
 def list_patients():
     """Show list of all patients (public, no login required)"""
-    # Try to get data from main host first
-    dashboard_data = main_host_api.get_dashboard_data()
-    patients_list = []
-    
-    if dashboard_data and dashboard_data.get('status') == 'success':
-        # Convert main host data to patient format
-        data = dashboard_data.get('data', {})
-        seen_patients = set()
-        
-        for key, patient_data in data.items():
-            if isinstance(patient_data, dict):
-                patient_id = patient_data.get('patient', 'Unknown')
-                if patient_id not in seen_patients:
-                    seen_patients.add(patient_id)
-                    
-                    # Create a patient-like object for template
-                    patient_info = {
-                        'patient_id': patient_id,
-                        'first_name': f'Patient {patient_id}',  # Better naming
-                        'last_name': '',
-                        'hospital': patient_data.get('hospital', 'Unknown'),
-                        'dept': patient_data.get('dept', 'Unknown'),
-                        'ward': patient_data.get('ward', 'Unknown'),
-                        'status': 'active',
-                        'heart_rate': patient_data.get('heart_rate'),
-                        'spo2': patient_data.get('spo2'),
-                        'bp_systolic': patient_data.get('bp_systolic'),
-                        'bp_diastolic': patient_data.get('bp_diastolic'),
-                        'respiratory_rate': patient_data.get('respiratory_rate'),
-                        'temperature': patient_data.get('temperature'),
-                        'etco2': patient_data.get('etco2'),
-                        'fio2': patient_data.get('fio2'),
-                        'blood_glucose': patient_data.get('blood_glucose'),
-                        'lactate': patient_data.get('lactate'),
-                        'wbc_count': patient_data.get('wbc_count'),
-                        'anomaly_score': patient_data.get('anomaly_score', 0),
-                        'timestamp': patient_data.get('timestamp')
-                    }
-                    patients_list.append(patient_info)
-    
-    # If no data from main host, show empty list (consistent with home page)
-    if not patients_list:
-        patients_list = []
-    
-    return render_template('patients/list.html', patients=patients_list)
+    # Served from the background-refreshed snapshot, so no round trip to main host here
+    snapshot = dashboard_snapshot.get()
+    return render_template('patients/list.html', patients=snapshot.patients,
+                           snapshot_age=snapshot.age_seconds)
 
 @patients.route('/<patient_id>')
 def view_patient(patient_id):
@@ -9,8 +9,14 @@ let anomalyTimelineChart;
 
 // Initialize the page
 document.addEventListener('DOMContentLoaded', function() {
-    fetchAnalyticsData();
-    setInterval(fetchAnalyticsData, 30000); // Refresh every 30 seconds
+    // Live updates from /api/stream, redrawn at most every 5 seconds;
+    // polls every 30 seconds if streaming is unavailable
+    subscribePatientUpdates({
+        onData: updateAnalyticsCharts,
+        poll: fetchAnalyticsData,
+        pollInterval: 30000,
+        minInterval: 5000
+    });
 });
 
 // Fetch analytics data
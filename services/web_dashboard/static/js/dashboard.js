@@ -2,20 +2,50 @@
 
 // Initialize the dashboard
 document.addEventListener('DOMContentLoaded', function() {
-    fetchDashboardData();
-    setInterval(fetchDashboardData, 10000); // Refresh every 10 seconds
+    // Live updates from /api/stream; polls every 10 seconds if streaming is unavailable
+    subscribePatientUpdates({
+        onData: renderDashboard,
+        poll: fetchDashboardData,
+        pollInterval: 10000
+    });
 });
 
-// Fetch dashboard data
+// Render every widget from the latest reading of each patient
+function renderDashboard(data) {
+    updateDashboardWidgets(data);
+    updateAnomaliesList(data);
+    updateHospitalHierarchy(data);
+}
+
+// Latest reading per patient and the cursor of the last poll
+const dashboardData = {};
+let dashboardSeq = null;
+let dashboardEtag = null;
+
+// Fetch dashboard data (only what changed since the previous poll)
 function fetchDashboardData() {
-    // Fetch metrics data
-    fetch('/api/metrics')
-        .then(response => response.json())
+    const url = dashboardSeq === null ? '/api/metrics' : `/api/metrics?since=${dashboardSeq}`;
+    const headers = dashboardEtag ? {'If-None-Match': dashboardEtag} : {};
+    fetch(url, {headers: headers, cache: 'no-store'})
+        .then(response => {
+            if (response.status === 304) {
+                return null; // Nothing changed since the last poll
+            }
+            dashboardEtag = response.headers.get('ETag');
+            return response.json();
+        })
         .then(data => {
+            if (data === null) {
+                return;
+            }
             if (data.status === 'success') {
-                updateDashboardWidgets(data.data);
-                updateAnomaliesList(data.data);
-                updateHospitalHierarchy(data.data);
+                if (data.full) {
+                    Object.keys(dashboardData).forEach(key => delete dashboardData[key]);
+                }
+                Object.assign(dashboardData, data.data);
+                (data.removed || []).forEach(key => delete dashboardData[key]);
+                dashboardSeq = data.seq;
+                renderDashboard(dashboardData);
             } else {
                 console.error('Error fetching metrics:', data.message);
             }
@@ -0,0 +1,80 @@
+// Live patient updates from /api/stream (server-sent events), with polling as the fallback
+
+// Subscribe to the latest reading of every patient.
+// options.onData(latest, changedKeys) is called with every patient's latest reading
+// (keyed by "hospital|dept|ward|patient") and the keys changed since the last call,
+// at most once per options.minInterval milliseconds. A changed key missing from
+// latest was removed.
+// options.poll() is called every options.pollInterval milliseconds instead if the
+// browser has no EventSource or the stream keeps failing.
+function subscribePatientUpdates(options) {
+    const minInterval = options.minInterval || 1000;
+    const latest = {};
+    let pending = null;
+    let timer = null;
+    let lastFlush = 0;
+    let pollTimer = null;
+    let failures = 0;
+
+    function flush() {
+        timer = null;
+        lastFlush = Date.now();
+        const changed = pending;
+        pending = null;
+        options.onData(latest, changed);
+    }
+
+    function schedule(keys) {
+        pending = pending || new Set();
+        keys.forEach(key => pending.add(key));
+        if (!timer) {
+            // Render right away unless we rendered less than minInterval ago
+            timer = setTimeout(flush, Math.max(0, lastFlush + minInterval - Date.now()));
+        }
+    }
+
+    function startPolling() {
+        if (pollTimer || !options.poll) {
+            return;
+        }
+        console.warn('Live updates unavailable, falling back to polling');
+        options.poll();
+        pollTimer = setInterval(options.poll, options.pollInterval || 10000);
+    }
+
+    if (!window.EventSource) {
+        startPolling();
+        return null;
+    }
+
+    const source = new EventSource('/api/stream');
+
+    source.addEventListener('snapshot', event => {
+        const payload = JSON.parse(event.data);
+        // Keys missing from a new snapshot (after a resync) count as changed, so pages drop them
+        const previous = Object.keys(latest);
+        previous.forEach(key => delete latest[key]);
+        Object.assign(latest, payload.data);
+        failures = 0;
+        schedule(previous.concat(Object.keys(payload.data)));
+    });
+
+    source.addEventListener('update', event => {
+        const payload = JSON.parse(event.data);
+        Object.assign(latest, payload.data);
+        (payload.removed || []).forEach(key => delete latest[key]);
+        failures = 0;
+        schedule(Object.keys(payload.data).concat(payload.removed || []));
+    });
+
+    source.onerror = () => {
+        // EventSource reconnects on its own; give up after a few failures in a row
+        failures++;
+        if (failures >= 3) {
+            source.close();
+            startPolling();
+        }
+    };
+
+    return source;
+}
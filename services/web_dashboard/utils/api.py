@@ -1,50 +1,171 @@
 import requests
 import logging
+import threading
+import time
 from typing import Dict, List, Optional
 import os
 
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
 logger = logging.getLogger(__name__)
 
-class MainHostAPI:
-    """Utility class to interact with the main host service API"""
-    
+# (connect, read) timeouts in seconds for every call to main host
+DEFAULT_TIMEOUT = (2, 5)
+
+
+class CachedResponse:
+    """Status, JSON body and ETag of one upstream response"""
+
+    def __init__(self, status_code: int, data: Optional[Dict], etag: Optional[str], fetched_at: float):
+        self.status_code = status_code
+        self.data = data
+        self.etag = etag
+        self.fetched_at = fetched_at
+
+
+class _InFlight:
+    """An upstream fetch that concurrent callers of the same URL wait on"""
+
     def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MainHostAPI:
+    """Utility class to interact with the main host service API
+
+    All calls share one pooled keep-alive session with timeouts and retries.
+    GETs go through a short-TTL response cache, and concurrent requests for the
+    same URL are coalesced into a single upstream fetch. Page latency therefore
+    stays flat however many viewers load a page at once.
+    """
+
+    def __init__(self, cache_ttl: Optional[float] = None, pool_size: int = 20):
         # Get main host URL from environment or use default
         self.base_url = os.getenv('MAIN_HOST_URL', 'http://main_host:8000')
         # Fallback to localhost if running in development
         if 'localhost' in os.getenv('FLASK_ENV', '') or os.getenv('DEVELOPMENT', False):
             self.base_url = 'http://localhost:8000'
-    
-    def get_dashboard_data(self) -> Optional[Dict]:
-        """Get all dashboard data from main host"""
+        self.cache_ttl = float(cache_ttl if cache_ttl is not None else os.getenv('MAIN_HOST_CACHE_TTL', 1.0))
+
+        # Retry idempotent GETs on connection errors and 502/503/504, with exponential backoff
+        retry = Retry(total=3, backoff_factor=0.2, status_forcelist=(502, 503, 504),
+                      allowed_methods=frozenset(['GET']), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._cache = {}
+        self._in_flight = {}
+        self._cache_lock = threading.Lock()
+
+        # Local copy of /api/dashboard-data, kept current with ?since= and ETags
+        self._dashboard = {}
+        self._dashboard_seq = None
+        self._dashboard_fetched_at = 0.0
+        self._dashboard_lock = threading.Lock()
+
+    def _get(self, path: str, params: Optional[Dict] = None, headers: Optional[Dict] = None) -> CachedResponse:
+        response = self.session.get(f"{self.base_url}{path}", params=params, headers=headers,
+                                    timeout=DEFAULT_TIMEOUT)
+        if response.status_code == 304:
+            return CachedResponse(304, None, response.headers.get('ETag'), time.monotonic())
+        response.raise_for_status()
+        return CachedResponse(response.status_code, response.json(), response.headers.get('ETag'),
+                              time.monotonic())
+
+    def fetch(self, path: str, params: Optional[Dict] = None, ttl: Optional[float] = None) -> CachedResponse:
+        """GET a main host path, served from cache when younger than ttl seconds
+
+        Only one request per URL is ever in flight; callers arriving meanwhile
+        wait for it and share its result (or its error).
+        """
+        ttl = self.cache_ttl if ttl is None else ttl
+        key = (path, tuple(sorted((params or {}).items())))
+        with self._cache_lock:
+            cached = self._cache.get(key)
+            if cached is not None and time.monotonic() - cached.fetched_at < ttl:
+                return cached
+            in_flight = self._in_flight.get(key)
+            leader = in_flight is None
+            if leader:
+                in_flight = self._in_flight[key] = _InFlight()
+
+        if not leader:
+            in_flight.done.wait()
+            if in_flight.error is not None:
+                raise in_flight.error
+            return in_flight.result
+
         try:
-            response = requests.get(f"{self.base_url}/api/dashboard-data", timeout=5)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Failed to fetch dashboard data: {e}")
-            return None
-    
+            in_flight.result = self._get(path, params)
+            with self._cache_lock:
+                self._cache[key] = in_flight.result
+                # Keep the cache small: drop entries well past any TTL
+                if len(self._cache) > 1000:
+                    cutoff = time.monotonic() - 60
+                    self._cache = {k: v for k, v in self._cache.items() if v.fetched_at > cutoff}
+            return in_flight.result
+        except (requests.exceptions.RequestException, ValueError) as e:
+            in_flight.error = e
+            raise
+        finally:
+            with self._cache_lock:
+                self._in_flight.pop(key, None)
+            in_flight.done.set()
+
+    def get_dashboard_data(self) -> Optional[Dict]:
+        """Get all dashboard data from main host
+
+        Only patients changed since the previous call are transferred; the
+        result is the merged copy in the same shape main host returns.
+        Concurrent callers within the cache TTL share one refresh.
+        """
+        with self._dashboard_lock:
+            if self._dashboard_seq is None or time.monotonic() - self._dashboard_fetched_at >= self.cache_ttl:
+                params, headers = {}, {}
+                if self._dashboard_seq is not None:
+                    params['since'] = self._dashboard_seq
+                    headers['If-None-Match'] = f'"{self._dashboard_seq}"'
+                try:
+                    response = self._get('/api/dashboard-data', params, headers)
+                    if response.status_code != 304:
+                        self._merge_dashboard(response.data)
+                    self._dashboard_fetched_at = response.fetched_at
+                except (requests.exceptions.RequestException, ValueError) as e:
+                    logger.error(f"Failed to fetch dashboard data: {e}")
+                    return None
+            return {'status': 'success', 'seq': self._dashboard_seq, 'data': dict(self._dashboard)}
+
+    def _merge_dashboard(self, update: Dict):
+        if update.get('status') != 'success':
+            raise ValueError(update.get('message', 'main host returned an error'))
+        if update.get('full', True):
+            self._dashboard = {}
+        self._dashboard.update(update.get('data', {}))
+        for key in update.get('removed', []):
+            self._dashboard.pop(key, None)
+        self._dashboard_seq = update.get('seq')
+
     def get_patients(self) -> List[str]:
         """Get list of all patients from main host"""
         try:
-            response = requests.get(f"{self.base_url}/api/patients", timeout=5)
-            response.raise_for_status()
-            data = response.json()
+            data = self.fetch('/api/patients').data
             return data.get('patients', [])
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, ValueError) as e:
             logger.error(f"Failed to fetch patients: {e}")
             return []
-    
+
     def get_patient_data(self, patient_id: str) -> Optional[Dict]:
         """Get data for a specific patient from main host"""
         try:
-            response = requests.get(f"{self.base_url}/api/patient/{patient_id}", timeout=5)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
+            return self.fetch(f'/api/patient/{patient_id}').data
+        except (requests.exceptions.RequestException, ValueError) as e:
             logger.error(f"Failed to fetch patient data for {patient_id}: {e}")
             return None
 
 # Global instance
-main_host_api = MainHostAPI()
\ No newline at end of file
+main_host_api = MainHostAPI()
@@ -0,0 +1,138 @@
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from utils.api import main_host_api
+
+logger = logging.getLogger(__name__)
+
+
+def patient_info(patient_data: Dict) -> Dict:
+    """Patient-like dict for templates, built from one main host dashboard entry"""
+    patient_id = patient_data.get('patient', 'Unknown')
+    return {
+        'patient_id': patient_id,
+        'first_name': f'Patient {patient_id}',  # Better naming
+        'last_name': '',
+        'hospital': patient_data.get('hospital', 'Unknown'),
+        'dept': patient_data.get('dept', 'Unknown'),
+        'ward': patient_data.get('ward', 'Unknown'),
+        'status': 'active',
+        'heart_rate': patient_data.get('heart_rate'),
+        'spo2': patient_data.get('spo2'),
+        'bp_systolic': patient_data.get('bp_systolic'),
+        'bp_diastolic': patient_data.get('bp_diastolic'),
+        'respiratory_rate': patient_data.get('respiratory_rate'),
+        'temperature': patient_data.get('temperature'),
+        'etco2': patient_data.get('etco2'),
+        'fio2': patient_data.get('fio2'),
+        'blood_glucose': patient_data.get('blood_glucose'),
+        'lactate': patient_data.get('lactate'),
+        'wbc_count': patient_data.get('wbc_count'),
+        'anomaly_score': patient_data.get('anomaly_score', 0),
+        'timestamp': patient_data.get('timestamp')
+    }
+
+
+class Snapshot:
+    """Dashboard data as of one refresh, plus the patient list built from it"""
+
+    def __init__(self, dashboard_data: Optional[Dict], patients: List[Dict], fetched_at: Optional[float]):
+        self.dashboard_data = dashboard_data
+        self.patients = patients
+        self.fetched_at = fetched_at
+
+    @property
+    def available(self) -> bool:
+        return self.dashboard_data is not None
+
+    @property
+    def age_seconds(self) -> Optional[float]:
+        """Seconds since main host was last reached, None if it never was"""
+        if self.fetched_at is None:
+            return None
+        return time.time() - self.fetched_at
+
+
+class DashboardSnapshot:
+    """In-process copy of the dashboard data, refreshed by a background thread
+
+    Page handlers read the current snapshot without waiting on main host; while
+    a refresh is in flight (or main host is down) they keep getting the previous
+    one, and its age tells the page how stale it is. Only the very first request
+    of the process waits for a fetch.
+    """
+
+    def __init__(self, refresh_seconds: Optional[float] = None):
+        self.refresh_seconds = float(refresh_seconds if refresh_seconds is not None
+                                     else os.getenv('SNAPSHOT_REFRESH_SECONDS', 2.0))
+        self._current = Snapshot(None, [], None)
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._attempted = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the refresh thread on first use"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='dashboard-snapshot', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Dashboard snapshot refresh failed: {e}")
+            time.sleep(self.refresh_seconds)
+
+    def refresh(self) -> Snapshot:
+        """Fetch the changes from main host and swap in a new snapshot"""
+        with self._refresh_lock:
+            return self._refresh_locked()
+
+    def _refresh_locked(self) -> Snapshot:
+        try:
+            dashboard_data = main_host_api.get_dashboard_data()
+        finally:
+            self._attempted.set()
+        current = self._current
+        if dashboard_data is None:
+            # Keep serving the last good snapshot; its age keeps growing
+            return current
+        if current.dashboard_data is not None and current.dashboard_data.get('seq') == dashboard_data.get('seq'):
+            patients = current.patients
+        else:
+            patients = self._build_patients(dashboard_data.get('data', {}))
+        self._current = Snapshot(dashboard_data, patients, time.time())
+        return self._current
+
+    @staticmethod
+    def _build_patients(data: Dict) -> List[Dict]:
+        # Convert main host data to patient format, one entry per patient id
+        patients_list = []
+        seen_patients = set()
+        for key, patient_data in data.items():
+            if isinstance(patient_data, dict):
+                patient_id = patient_data.get('patient', 'Unknown')
+                if patient_id not in seen_patients:
+                    seen_patients.add(patient_id)
+                    patients_list.append(patient_info(patient_data))
+        return patients_list
+
+    def get(self) -> Snapshot:
+        """Current snapshot, returned immediately once the first refresh has happened"""
+        self.start()
+        if not self._attempted.is_set():
+            # Cold start: wait for one fetch (shared with the refresh thread)
+            with self._refresh_lock:
+                if not self._attempted.is_set():
+                    return self._refresh_locked()
+        return self._current
+
+
+# Global instance
+dashboard_snapshot = DashboardSnapshot()
@@ -0,0 +1,134 @@
+import json
+import logging
+import queue
+import threading
+import time
+from typing import Dict, Iterator, Optional
+
+import requests
+
+from utils.api import main_host_api
+
+logger = logging.getLogger(__name__)
+
+# Browser connections get a comment line this often so idle streams stay open
+KEEPALIVE_SECONDS = 15
+
+
+def parse_sse(lines: Iterator[str]) -> Iterator[tuple]:
+    """Yield (event, data) pairs from the lines of a text/event-stream body"""
+    event, data = 'message', []
+    for line in lines:
+        if line is None:
+            continue
+        if line == '':
+            if data:
+                yield event, '\n'.join(data)
+            event, data = 'message', []
+        elif line.startswith(':'):
+            continue
+        elif line.startswith('event:'):
+            event = line[6:].strip()
+        elif line.startswith('data:'):
+            data.append(line[5:].lstrip())
+
+
+def format_event(event: str, payload: Dict) -> str:
+    return f"id: {payload['seq']}\nevent: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+class StreamRelay:
+    """One subscription to main_host /stream, fanned out to every browser connection
+
+    Browsers connect to this dashboard instead of main_host, so main_host sees a
+    single stream no matter how many pages are open. The relay keeps the latest
+    reading per patient, which lets a new browser connection start with a full
+    snapshot without asking main_host again.
+    """
+
+    def __init__(self, base_url: str, max_queue: int = 100, reconnect_seconds: float = 2.0):
+        self.url = f"{base_url}/stream"
+        self.max_queue = max_queue
+        self.reconnect_seconds = reconnect_seconds
+        self.latest: Dict[str, Dict] = {}
+        self.seq: Optional[int] = None
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """Connect to main_host on first use; reconnects in the background for the life of the process"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='stream-relay', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self._consume()
+            except (requests.exceptions.RequestException, ValueError) as e:
+                logger.warning(f"Stream from main_host interrupted: {e}")
+            time.sleep(self.reconnect_seconds)
+
+    def _consume(self):
+        # Resume from the last event seen so a reconnect does not resend everything;
+        # chunk_size=None hands over each chunk as soon as main_host flushes it
+        params = {'since': self.seq} if self.seq is not None else {}
+        with main_host_api.session.get(self.url, params=params, stream=True,
+                                       timeout=(5, KEEPALIVE_SECONDS * 4)) as response:
+            response.raise_for_status()
+            for event, data in parse_sse(response.iter_lines(chunk_size=None, decode_unicode=True)):
+                self._apply(event, json.loads(data))
+
+    def _apply(self, event: str, payload: Dict):
+        with self._lock:
+            if event == 'snapshot':
+                self.latest = dict(payload.get('data', {}))
+            else:
+                self.latest.update(payload.get('data', {}))
+                for key in payload.get('removed', []):
+                    self.latest.pop(key, None)
+            self.seq = payload['seq']
+            message = format_event(event, payload)
+            for subscriber in self._subscribers:
+                try:
+                    subscriber.put_nowait(message)
+                except queue.Full:
+                    # Too slow to keep up: drop its backlog and send it a fresh snapshot instead
+                    with subscriber.mutex:
+                        subscriber.queue.clear()
+                    subscriber.put_nowait(None)
+
+    def _snapshot_message(self) -> Optional[str]:
+        if self.seq is None:
+            return None
+        return format_event('snapshot', {'seq': self.seq, 'data': self.latest})
+
+    def events(self) -> Iterator[str]:
+        """text/event-stream body for one browser connection"""
+        self.start()
+        subscriber = queue.Queue(maxsize=self.max_queue)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            initial = self._snapshot_message()
+        try:
+            if initial:
+                yield initial
+            while True:
+                try:
+                    message = subscriber.get(timeout=KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if message is None:
+                    with self._lock:
+                        message = self._snapshot_message()
+                yield message
+        finally:
+            with self._lock:
+                self._subscribers.discard(subscriber)
+
+
+# Global instance
+stream_relay = StreamRelay(main_host_api.base_url)